@@ -0,0 +1,91 @@
+import importlib
+import os
+import time
+from typing import List, Optional, Sequence
+
+from config import config
+
+
+class SubServer:
+    """
+        A FastMCP sub-server mounted under `mount`. Its module is only imported by `load()`,
+        so disabled servers never pay for their imports. The module must define `mcp` and may
+        define `async def warm_up()` to prepare its caches before the app takes traffic
+        (WARM_START), `async def shutdown()` to release its resources when the app stops and
+        `router`, an APIRouter with extra routes for the app root.
+
+        `upstreams` names the http_clients upstreams the server calls: only those get a
+        client and a readiness probe.
+    """
+
+    def __init__(self, name: str, module_path: str, mount: str, upstreams: Sequence[str] = ()):
+        self.name = name
+        self.module_path = module_path
+        self.mount = mount
+        self.upstreams = list(upstreams)
+        self.module = None
+        self.import_seconds: Optional[float] = None
+
+    def load(self):
+        started = time.perf_counter()
+        self.module = importlib.import_module(self.module_path)
+        self.import_seconds = round(time.perf_counter() - started, 4)
+        return self
+
+    @property
+    def mcp(self):
+        return self.module.mcp
+
+    @property
+    def has_warm_up(self) -> bool:
+        return hasattr(self.module, "warm_up")
+
+    @property
+    def router(self):
+        return getattr(self.module, "router", None)
+
+    async def warm_up(self):
+        await self.module.warm_up()
+
+    async def shutdown(self):
+        hook = getattr(self.module, "shutdown", None)
+        if hook is not None:
+            await hook()
+
+
+SUB_SERVERS = {
+    server.name: server
+    for server in [
+        SubServer("math", "app.v1.math_server", "/math"),
+        SubServer("secret", "app.v1.secret_server", "/secret"),
+        SubServer("legaldocs", "app.v1.legaldocs_server", "/legaldocs", upstreams=["legal_docs", "external"]),
+        SubServer("audit_agent", "app.v1.audit_agent_server", "/audit_agent", upstreams=["chimbitas_lambda", "api_chimbitas", "s3", "external"]),
+    ]
+}
+
+
+def enabled_servers() -> List[SubServer]:
+    """
+        The sub-servers listed in ENABLED_SERVERS, in that order.
+    """
+    names = [name.strip() for name in config.ENABLED_SERVERS.split(",") if name.strip()]
+    unknown = [name for name in names if name not in SUB_SERVERS]
+    if unknown:
+        raise ValueError(f"Unknown servers in ENABLED_SERVERS: {', '.join(unknown)}. Available: {', '.join(SUB_SERVERS)}")
+    return [SUB_SERVERS[name] for name in names]
+
+
+def process_age_seconds() -> Optional[float]:
+    """
+        Seconds since this process was started, including interpreter and uvicorn start-up.
+        Read from /proc, so only available on Linux.
+    """
+    try:
+        with open("/proc/self/stat") as stat:
+            # El nombre del proceso va entre paréntesis y puede contener espacios.
+            start_ticks = int(stat.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as uptime:
+            system_uptime = float(uptime.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return round(system_uptime - start_ticks / os.sysconf("SC_CLK_TCK"), 3)
@@ -1,44 +1,93 @@
 # main.py
-from mcp.server.fastmcp import FastMCP
+from fastapi import APIRouter, Header, HTTPException
+from mcp.server.fastmcp import FastMCP, Context
 from config import config
-from schemas.request_schemas import AA_CreateAuditProcessRequest, FileInfo
-from typing import List
-from requests_toolbelt.multipart.encoder import MultipartEncoder
-from schemas.response_schemas import AA_SessionsResponseItem, AA_GetParentSessionFromUserResponse
+from schemas.request_schemas import AA_CreateAuditProcessRequest, AA_TaskStatusCallback, FileInfo
+from typing import Dict, List, Optional
+from schemas.response_schemas import AA_SessionsResponseItem, AA_GetParentSessionFromUserResponse, AA_AuditJobStatusResponse, AA_ListAuditJobsResponse
+from services.blob_cache import blob_cache
+from services.cache import AsyncTTLCache
+from services.checkpoints import Checkpoint, audit_checkpoints, checkpoint_id_for
+from services.chimbitas_auth import token_manager
+from services.http_clients import get_client
+from services.jobs import Job, JobFailed, JobManager, SUCCEEDED
+from services.shared_store import shared_store
+from services.task_poller import task_poller, PollingTimeout, PollingError
+from services.streaming import StreamedFile, open_source, post_multipart_stream
+from services.tracing import span, tracer
+from services.transfer_pipeline import PipelineStage, TransferError, run_pipeline
+from services.worker_status import register_load
 
-import requests
-
-
-import time
+import asyncio
+import hmac
 import math, sys
 import os
 import io
+import logging
+import time
+
+logger = logging.getLogger(__name__)
 mcp = FastMCP(name="secrets-mcp", host="0.0.0.0", stateless_http=True)
+# Rutas en la raíz de la app (fuera del montaje MCP).
+router = APIRouter()
+audit_jobs = JobManager(
+    workers=config.AUDIT_JOB_WORKERS,
+    max_retained=config.AUDIT_JOB_MAX_RETAINED,
+    store=shared_store,
+    snapshot_ttl=config.AUDIT_JOB_SNAPSHOT_TTL,
+    max_pending=config.AUDIT_JOB_MAX_PENDING,
+)
+# Listados de /sessions/list por (user_id, parent_session_id); None son las sesiones padre.
+session_listings = AsyncTTLCache(
+    "session_listings",
+    ttl=config.SESSION_LIST_TTL,
+    stale_ttl=config.SESSION_LIST_STALE_TTL,
+    max_entries=config.SESSION_LIST_MAX_ENTRIES,
+    store=shared_store,
+)
+register_load("audit_jobs_running", lambda: audit_jobs.running)
+register_load("poll_watches", lambda: task_poller.active_watches)
+
+UPLOAD_FAILURE_MESSAGES = {
+    "audict_process_files": "Failed to upload files to Chimbitas.",
+    "normatives": "Failed to upload normative files to Chimbitas.",
+    "audit_reports": "Failed to upload audit report files to Chimbitas.",
+}
 
-def obtain_chimbitas_access_token() -> str:
+async def obtain_chimbitas_access_token() -> str:
     """
         Obtains an access token from the Chimbitas API using the provided credentials.
+        The token is cached until shortly before it expires and shared between concurrent callers.
     """
-    try:
-        # Login into Chimbitas to get acccess token
-        login_payload = {
-            "username": config.USER_NAME_CHIMBITAS,
-            "password": config.PASSWORD_CHIMBITAS,
-            "grant_type": "password"
-        }
-        response = requests.post(f"{config.CHIMBITAS_LAMBDA_URL}/token", data=login_payload)
-        response.raise_for_status()
-        if response.status_code == 200:
-            print("Successfully obtained Chimbitas session ID.")
-            access_token = response.json().get("access_token", "")
-            return access_token
-        else:
-            raise Exception(f"Failed to obtain Chimbitas access token, status code: {response.status_code}")
-    except Exception as e:
-        print(f"Error obtaining Chimbitas access token: {e}")
-        return None
+    return await token_manager.get_token()
 
-def get_chimbitas_session_id(session_name: str, access_token: str) -> str:
+async def list_sessions(user_id: int, parent_session_id: Optional[int] = None) -> dict:
+    """
+        Fetches parent sessions (or the children of `parent_session_id`) from /sessions/list.
+        Raises on any failure so that errors are never cached.
+    """
+    access_token = await obtain_chimbitas_access_token()
+    if not access_token:
+        raise Exception("Failed to obtain Chimbitas access token.")
+    headers = {
+        "Authorization": f"Bearer {access_token}"
+    }
+    params = {"user_id": user_id, "company_id": config.COMPANY_ID_CHIMBITAS, "is_info_source": 1}
+    if parent_session_id is not None:
+        params.update({"parent_session_id": parent_session_id, "is_info_source": 0})
+    response = await get_client("chimbitas_lambda").get("/sessions/list", params=params, headers=headers)
+    response.raise_for_status()
+    return response.json()
+
+async def invalidate_session_listings(parent_session_id: Optional[int] = None):
+    """
+        Drops the cached parent listings, or the child listings of `parent_session_id`,
+        after a session was added. Sessions are owned by the service user, so every
+        user's listings for that level are dropped.
+    """
+    await session_listings.invalidate_where(lambda key: key[1] == parent_session_id)
+
+async def get_chimbitas_session_id(session_name: str, access_token: str) -> str:
     """
         Obtains a session ID from the Chimbitas API using the provided credentials.
     """
@@ -56,18 +105,18 @@ def get_chimbitas_session_id(session_name: str, access_token: str) -> str:
         headers = {
             "Authorization": f"Bearer {access_token}"
         }
-        response = requests.post(f"{config.CHIMBITAS_LAMBDA_URL}/sessions/add", json=sessionid_payload, headers=headers)
+        response = await get_client("chimbitas_lambda").post("/sessions/add", json=sessionid_payload, headers=headers)
         response.raise_for_status()
         if response.status_code == 200:
-            
+            await invalidate_session_listings()
             return str(response.json().get("session", "").get("session_id", ""))
         else:
             raise Exception(f"Failed to create Chimbitas session, status code: {response.status_code}")
     except Exception as e:
-        print(f"Error obtaining Chimbitas session ID: {e}")
+        logger.error("Error obtaining Chimbitas session ID: %s", e)
         return ""
 
-def generate_presigned_s3url_chimbitas(session_id: str, object_name: str, access_token: str, object_prefix: str) -> dict:
+async def generate_presigned_s3url_chimbitas(session_id: str, object_name: str, access_token: str, object_prefix: str) -> dict:
     """
         Generates a presigned S3 URL for file upload to Chimbitas.
     """
@@ -84,29 +133,34 @@ def generate_presigned_s3url_chimbitas(session_id: str, object_name: str, access
         headers = {
             "Authorization": f"Bearer {access_token}"
         }
-        response = requests.post(f"{config.API_CHIMBITAS_URL}/files/upload", json=payload, headers=headers)
+        response = await get_client("api_chimbitas").post("/files/upload", json=payload, headers=headers)
         response.raise_for_status()
         if response.status_code == 200:
             return response.json()
         else:
             raise Exception(f"Failed to generate presigned S3 URL, status code: {response.status_code}")
     except Exception as e:
-        print(f"Error generating presigned S3 URL: {e}")
+        logger.error("Error generating presigned S3 URL for %s: %s", object_name, e)
         return {}
 
-def download_file(file_url: str) -> bytes:
+async def stream_file_to_s3(presigned_content: dict, file_url: str, filename: str, content_type="multipart/form-data") -> int:
     """
-        Downloads a file from the given URL and returns its content as bytes.
+        Streams the file at `file_url` straight into the presigned S3 POST, chunk by chunk,
+        without holding the whole document in memory. Returns the number of file bytes
+        uploaded, or -1 if the download or the upload failed.
     """
     try:
-        response = requests.get(file_url)
+        async with open_source(file_url) as source:
+            upload = StreamedFile("file", filename, content_type, source)
+            response, _ = await post_multipart_stream(get_client("s3"), presigned_content.get("url", ""), presigned_content.get("fields", {}), [upload])
+        logger.info("File %s uploaded to S3 with status code: %s, %d bytes", filename, response.status_code, upload.bytes_sent)
         response.raise_for_status()
-        return response.content
+        return upload.bytes_sent if response.status_code in (200, 204) else -1
     except Exception as e:
-        print(f"Error downloading file from {file_url}: {e}")
-        return b""
+        logger.error("Error streaming file from %s to S3: %s", file_url, e)
+        return -1
 
-def upload_files_to_s3(presigned_content: dict, content_type="multipart/form-data", file_content: bytes = None, filename: str = None) -> bool:
+async def upload_files_to_s3(presigned_content: dict, content_type="multipart/form-data", file_content: bytes = None, filename: str = None) -> bool:
     """
         Uploads files to the given presigned S3 URL.
     """
@@ -114,94 +168,114 @@ def upload_files_to_s3(presigned_content: dict, content_type="multipart/form-dat
         files = {}
         if file_content is not None:
             files = {'file': (filename, file_content, content_type)}
-        form_data_subida_s3 = MultipartEncoder(
-            fields={**presigned_content.get("fields", {}), **files}
-        )
-        print(f"Uploading file to S3 with presigned URL: {type(presigned_content.get('fields', ''))}")
-        response = requests.post(presigned_content.get("url", ""), data=form_data_subida_s3, headers={'Content-Type': form_data_subida_s3.content_type})
-        print(f"File uploaded to S3 with status code: {response.status_code}")
+        # httpx envía los campos del formulario antes del archivo, como exige el POST presignado de S3
+        response = await get_client("s3").post(presigned_content.get("url", ""), data=presigned_content.get("fields", {}), files=files)
+        logger.info("File uploaded to S3 with status code: %s", response.status_code)
         response.raise_for_status()
         return response.status_code == 200 or response.status_code == 204
     except Exception as e:
-        print(f"Error uploading files to S3: {e}")
+        logger.error("Error uploading files to S3: %s", e)
         return False
 
-def manage_upload_process(file_urls: List[FileInfo], session_id: str, access_token: str, list_type: str) -> bool:
-    s3_keys = []
-    object_prefix = ''
+def get_object_prefix(session_id: str, list_type: str) -> str:
     if list_type == "audict_process_files":
-        object_prefix = f"{config.COMPANY_ID_CHIMBITAS}/{config.USER_ID_CHIMBITAS}/{session_id}"
+        return f"{config.COMPANY_ID_CHIMBITAS}/{config.USER_ID_CHIMBITAS}/{session_id}"
     elif list_type == "normatives":
-        object_prefix = f"{config.COMPANY_ID_CHIMBITAS}/{config.USER_ID_CHIMBITAS}/{session_id}/norm"
+        return f"{config.COMPANY_ID_CHIMBITAS}/{config.USER_ID_CHIMBITAS}/{session_id}/norm"
     elif list_type == "audit_reports":
-        object_prefix = f"{config.COMPANY_ID_CHIMBITAS}/{config.USER_ID_CHIMBITAS}/{session_id}/audits"
-    else:
-        object_prefix = None   
-        
-    for file_info in file_urls:
-        file_content = download_file(file_info.file_url)
-        if not file_content:
-            print(f"Failed to download file from {file_info.file_url}")
-            return False
-        presigned_content = generate_presigned_s3url_chimbitas(session_id, file_info.filename, access_token, object_prefix)
+        return f"{config.COMPANY_ID_CHIMBITAS}/{config.USER_ID_CHIMBITAS}/{session_id}/audits"
+    return None
+
+class UploadItem:
+    def __init__(self, list_type: str, index: int, file_info: FileInfo, object_prefix: str):
+        self.list_type = list_type
+        self.file_info = file_info
+        self.object_prefix = object_prefix
+        # Nombre del checkpoint de este archivo.
+        self.key = f"upload:{list_type}:{index}"
+
+async def manage_upload_process(file_lists: Dict[str, List[FileInfo]], session_id: str, access_token: str, checkpoint: Optional[Checkpoint] = None):
+    """
+        Presigns and streams the files of every list to S3 at the same time, with a
+        concurrency limit per stage. Returns (True, {list_type: s3_keys}) with the keys in
+        the same order as the input, or (False, list_type) for the list whose file failed.
+        With a checkpoint, every uploaded file is recorded as soon as it lands and files
+        recorded by an earlier run are not uploaded again.
+    """
+    items = [
+        UploadItem(list_type, index, file_info, get_object_prefix(session_id, list_type))
+        for list_type, file_urls in file_lists.items()
+        for index, file_info in enumerate(file_urls)
+    ]
+    uploaded_keys = {item.key: checkpoint.get(item.key) for item in items if checkpoint is not None and checkpoint.get(item.key)}
+    pending = [item for item in items if item.key not in uploaded_keys]
+
+    async def presign_stage(item: UploadItem, _):
+        with span("presign", file=item.file_info.filename, list_type=item.list_type):
+            presigned_content = await generate_presigned_s3url_chimbitas(session_id, item.file_info.filename, access_token, item.object_prefix)
         if not presigned_content:
-            print(f"Failed to generate presigned URL for {file_info.filename}")
-            return False
-        success = upload_files_to_s3(presigned_content, file_content=file_content, filename=file_info.filename)
-        if not success:
-            print(f"Failed to upload file {file_info.filename} to S3")
-            return False
-        s3_keys.append({
-            'name': file_info.filename,
+            raise TransferError(f"Failed to generate presigned URL for {item.file_info.filename}", item)
+        return presigned_content
+
+    async def transfer_stage(item: UploadItem, presigned_content: dict):
+        with span("transfer", file=item.file_info.filename, list_type=item.list_type) as transfer_span:
+            uploaded_bytes = await stream_file_to_s3(presigned_content, item.file_info.file_url, item.file_info.filename)
+            transfer_span.set(bytes=uploaded_bytes)
+            if uploaded_bytes < 0:
+                transfer_span.fail("upload failed")
+        if uploaded_bytes < 0:
+            raise TransferError(f"Failed to upload file {item.file_info.filename} from {item.file_info.file_url} to S3", item)
+        s3_key = {
+            'name': item.file_info.filename,
             's3_key': presigned_content.get('fields', {}).get('key', ''),
-            'description': file_info.description,
-            'file_prefix': object_prefix,
+            'description': item.file_info.description,
+            'file_prefix': item.object_prefix,
             'type': "file"
-        })
-    print(f"All files uploaded successfully: {s3_keys}")
+        }
+        if checkpoint is not None:
+            await checkpoint.save(item.key, s3_key)
+        return s3_key
+
+    stages = [
+        PipelineStage("presign", presign_stage, config.TRANSFER_PRESIGN_CONCURRENCY),
+        PipelineStage("transfer", transfer_stage, config.TRANSFER_STREAM_CONCURRENCY),
+    ]
+    try:
+        uploaded = await run_pipeline(pending, stages)
+    except TransferError as e:
+        logger.error("%s", e)
+        return False, e.item.list_type
+    uploaded_keys.update({item.key: s3_key for item, s3_key in zip(pending, uploaded)})
+
+    s3_keys = {list_type: [] for list_type in file_lists}
+    for item in items:
+        s3_keys[item.list_type].append(uploaded_keys[item.key])
+    logger.info("All files uploaded successfully: %s", {list_type: len(keys) for list_type, keys in s3_keys.items()})
     return True, s3_keys
 
-async def poll_status(session_id: str, token: str, analysis_type_id: int):
-    start_time = time.time()
-    requestsCount = 0
-    pollingInterval = 3000 # Initial polling interval (3 seconds)
-    maxPollingDuration = 10800000 # 3 hours
-    while True:
-        requestsCount += 1
-        if requestsCount > 3 and requestsCount <= 10:
-            pollingInterval = 10000 # After 3 requests, set interval to 10 seconds
-        elif requestsCount > 10:
-            pollingInterval = 30000 # After 6 requests, set interval to 30 seconds
-
-        if requestsCount == 20:
-            print("Proceso de obtener polling status detenido en el count: ", requestsCount)
-            return "failed", {'session_id': session_id, 'status': 'failed'}
-        if requestsCount % 2 == 0:
-            print(f"Seguimos procesando la informacion: Polling count: {requestsCount}")
-            # print("SEGUIMOS PROCESANDO EL ARCHIVOS")
-
-        print(f"Polling interval: {pollingInterval / 1000} seconds")
-
-        try:
-            response = requests.get(f"{config.API_CHIMBITAS_URL}/task/status?session_id={int(session_id)}&analysis_type_id={int(analysis_type_id)}", headers={"Authorization ": f"Bearer {token}"})
-            status = response.json().get("status")
-            print(f"STATUS DEL POLL STATUS: {status}")
-            print(f"RESPUESTAS DEL POLL STATUS: {response.json()}")
-
-            if status == "completed" or status == "failed":
-                return status,response
-            if time.time() - start_time > maxPollingDuration:
-                return None,"Polling timed out."
-            time.sleep(pollingInterval/1000)
-        except Exception as e:
-            print(f"Error polling status: {e}")
-            return None,"Error fetching task status. Please try again."
-
-async def process_files(session_id: str, s3_keys: List[str], company_name: str, job_description: str, project_description: str):
+async def poll_status(session_id: str, analysis_type_id: int, since: Optional[float] = None):
+    """
+        Waits for a Chimbitas task to finish. The status checks are multiplexed by the shared
+        task poller, so many audits can wait at the same time without blocking the event loop.
+        `since` is when the task was started; earlier events on the session are ignored.
+    """
     try:
-        access_token = obtain_chimbitas_access_token()
+        return await task_poller.wait_for(session_id, analysis_type_id, since=since)
+    except PollingTimeout:
+        logger.warning("Polling timed out for session %s", session_id)
+        return None, "Polling timed out."
+    except PollingError as e:
+        logger.error("Error polling status of session %s: %s", session_id, e)
+        return None, "Error fetching task status. Please try again."
+
+async def search_files(session_id: str, s3_keys: List[dict], company_name: str, job_description: str, project_description: str) -> bool:
+    """
+        Starts the Chimbitas /files/search processing of the uploaded files.
+    """
+    try:
+        access_token = await obtain_chimbitas_access_token()
         if not access_token:
-            print("Failed to obtain Chimbitas access token.")
+            logger.error("Failed to obtain Chimbitas access token.")
             return False
         headers = {
             "Authorization": f"Bearer {access_token}"
@@ -223,27 +297,29 @@ async def process_files(session_id: str, s3_keys: List[str], company_name: str,
                 "audits_folder": "audits"
             }
         }
-        print(f"Processing files with payload: {payload}")
-        response = requests.post(f"{config.API_CHIMBITAS_URL}/files/search", json=payload, headers=headers)
+        if config.TASK_CALLBACK_URL:
+            payload["callback_url"] = config.TASK_CALLBACK_URL
+        logger.info("Processing %d files of session %s", len(s3_keys), session_id)
+        logger.debug("Processing files with payload: %s", payload)
+        response = await get_client("api_chimbitas").post("/files/search", json=payload, headers=headers)
         response.raise_for_status()
         if response.status_code != 200:
-            print(f"Failed to process files, status code: {response.status_code}")
+            logger.error("Failed to process files, status code: %s", response.status_code)
             return False
-        time.sleep(3)  # Wait for processing to complete
-        access_token = obtain_chimbitas_access_token()
-        status, response = await poll_status(session_id, access_token, 1)
-        print(f"Final polling status: {status}")
-        print(f"Final polling response: {response}")
-        
-        if response == "Polling timed out." or response == "Error fetching task status. Please try again.":
-            print("Polling process failed or timed out.")
-            return False
-        
-        if status != "completed":
-            print(f"File processing failed with status: {status}")
-            return False
-        print("File processing completed successfully. Begining with Ingest")
-        
+        return True
+    except Exception as e:
+        logger.error("Error processing files: %s", e)
+        return False
+
+async def ingest_data(session_id: str) -> str:
+    """
+        Starts the Chimbitas /ingest_data step and returns the session id to poll, or "" on failure.
+    """
+    try:
+        access_token = await obtain_chimbitas_access_token()
+        if not access_token:
+            logger.error("Failed to obtain Chimbitas access token.")
+            return ""
         ingest_request_payload = {
             "region": "us-east-1",
             "session_id": int(session_id),
@@ -252,136 +328,276 @@ async def process_files(session_id: str, s3_keys: List[str], company_name: str,
             "object_prefix": f"{config.COMPANY_ID_CHIMBITAS}/{config.USER_ID_CHIMBITAS}/{session_id}",
             "context": "audit_demo"
         }
-        
+        if config.TASK_CALLBACK_URL:
+            ingest_request_payload["callback_url"] = config.TASK_CALLBACK_URL
         headers = {
             "Authorization": f"Bearer {access_token}"
         }
-        
-        data_ingest_response = requests.post(f"{config.API_CHIMBITAS_URL}/ingest_data", json=ingest_request_payload, headers=headers)
-        print("Data Ingest Response Status Code:", data_ingest_response.status_code)
+        data_ingest_response = await get_client("api_chimbitas").post("/ingest_data", json=ingest_request_payload, headers=headers)
+        logger.info("Data ingest response status code: %s", data_ingest_response.status_code)
         data_ingest_response.raise_for_status()
         if data_ingest_response.status_code != 200:
-            print(f"Failed to ingest data, status code: {data_ingest_response.status_code}")
-            return False
-        
-        print("Data ingestion completed successfully. Initiating polling status for ingestion.")
-        data_ingest_session_id = data_ingest_response.json().get("session_id", "")
-        status, response = await poll_status(data_ingest_session_id, access_token, 1)
-        
-        print(f"Final ingestion polling status: {status}")
-        print(f"Final ingestion polling response: {response}") 
-        if response == "Polling timed out." or response == "Error fetching task status. Please try again.":
-            print("Ingestion polling process failed or timed out.")
-            return False
-        if status != "completed":
-            print(f"Data ingestion failed with status: {status}")
-            return False
-        print("Data ingestion completed successfully.")
-        return True            
+            logger.error("Failed to ingest data, status code: %s", data_ingest_response.status_code)
+            return ""
+        return str(data_ingest_response.json().get("session_id", ""))
     except Exception as e:
-        print(f"Error processing files: {e}")
-    return True
+        logger.error("Error ingesting data: %s", e)
+        return ""
+
+async def wait_for_task(session_id: str, task_name: str, since: Optional[float] = None) -> Optional[str]:
+    """
+        Final status of a Chimbitas task ("completed" or "failed"), or None when polling
+        gave up before the task finished.
+    """
+    status, response = await poll_status(session_id, 1, since)
+    logger.info("Final %s polling status: %s", task_name, status)
+    logger.debug("Final %s polling response: %s", task_name, response)
+    if status is None:
+        logger.error("%s polling process failed or timed out.", task_name)
+    elif status != "completed":
+        logger.error("%s failed with status: %s", task_name, status)
+    return status
+
+AUDIT_PIPELINE_STAGES = ["token", "session", "upload", "activity", "search", "search_polling", "ingest", "ingest_polling"]
+
+async def run_audit_pipeline(job: Job, request: AA_CreateAuditProcessRequest, checkpoint: Checkpoint) -> str:
+    """
+        Runs every step of an audit process creation, recording each one as a job stage.
+        Raises JobFailed with the same messages the tool used to return.
+        Each completed step is saved to `checkpoint`; steps an earlier run already completed
+        are skipped, so a resumed run continues from the first incomplete one.
+    """
+    if checkpoint.get("result"):
+        for stage_name in AUDIT_PIPELINE_STAGES:
+            job.skip_stage(stage_name)
+        return checkpoint.get("result")
+
+    async with job.stage("token"):
+        access_token = await obtain_chimbitas_access_token()
+        if not access_token:
+            raise JobFailed("Failed to obtain Chimbitas access token.")
+
+    # Paso #1: Crear sesión en Chimbitas
+    session_id = checkpoint.get("session")
+    if session_id:
+        job.skip_stage("session", session_id=session_id)
+    else:
+        async with job.stage("session") as stage:
+            session_id = await get_chimbitas_session_id(request.titulo_proceso, access_token)
+            if not session_id:
+                raise JobFailed("Failed to create Chimbitas session.")
+            stage.detail["session_id"] = session_id
+            await checkpoint.save("session", session_id)
+
+    # Paso #2: Subir archivos del proceso, normativos e informes de auditoría en paralelo
+    async with job.stage("upload") as stage:
+        upload_success, upload_result = await manage_upload_process({
+            "audict_process_files": request.urls_planteamiento_proceso_auditoria,
+            "normatives": request.urls_normativas_proceso,
+            "audit_reports": request.urls_informes_auditoria,
+        }, session_id, access_token, checkpoint)
+        if not upload_success:
+            raise JobFailed(UPLOAD_FAILURE_MESSAGES[upload_result])
+        stage.detail["files"] = sum(len(keys) for keys in upload_result.values())
+
+    # Paso #3:  Crea activity.txt
+    activity_s3_key = checkpoint.get("activity")
+    if activity_s3_key:
+        job.skip_stage("activity")
+    else:
+        async with job.stage("activity"):
+            activityFileContent = f"1. Nombre de la empresa: {request.nombre_compania}\nNombre del proceso: {request.titulo_proceso}\nDescripcion del proceso: {request.descripcion_proceso}"
+            # Crear txt con el contenido
+            bytes_content = activityFileContent.encode('utf-8')
+            presigned_content_activity = await generate_presigned_s3url_chimbitas(session_id, "activity.txt", access_token, f"{config.COMPANY_ID_CHIMBITAS}/{config.USER_ID_CHIMBITAS}/{session_id}")
+            if not presigned_content_activity:
+                raise JobFailed("Failed to generate presigned URL for activity.txt")
+            success_activity = await upload_files_to_s3(presigned_content_activity, content_type="text/plain", file_content=bytes_content)
+            if not success_activity:
+                raise JobFailed("Failed to upload activity.txt to S3")
+            activity_s3_key = {'name':"activity.txt", 's3_key': presigned_content_activity.get('fields', {}).get('key', ''), 'description': 'Activity File', 'file_prefix': f"{config.COMPANY_ID_CHIMBITAS}/{config.USER_ID_CHIMBITAS}/{session_id}", 'type': 'file'}
+            await checkpoint.save("activity", activity_s3_key)
+
+    s3_keys = upload_result["audict_process_files"] + upload_result["normatives"] + upload_result["audit_reports"] + [activity_s3_key]
+    logger.info("All %d files including activity.txt uploaded successfully", len(s3_keys))
+
+    # Paso #4: Procesar los archivos en Chimbitas y esperar a que termine
+    if checkpoint.get("search"):
+        job.skip_stage("search")
+    else:
+        async with job.stage("search"):
+            started_at = time.time()
+            if not await search_files(session_id, s3_keys, request.nombre_compania, request.cargo_usuario, request.descripcion_proceso):
+                raise JobFailed("Failed to process files in Chimbitas.")
+            # Se guarda el inicio: la espera ignora eventos de búsquedas anteriores en la misma sesión.
+            await checkpoint.save("search", started_at)
+            if not config.TASK_CALLBACK_URL:
+                await asyncio.sleep(3)  # Wait for processing to complete
+    if checkpoint.get("search_polling"):
+        job.skip_stage("search_polling")
+    else:
+        async with job.stage("search_polling"):
+            status = await wait_for_task(session_id, "File processing", since=checkpoint.get("search"))
+            if status != "completed":
+                if status is not None:
+                    # La tarea terminó con error: al reanudar hay que volver a lanzarla.
+                    await checkpoint.discard("search", "search_polling")
+                raise JobFailed("Failed to process files in Chimbitas.")
+            await checkpoint.save("search_polling", True)
+
+    # Paso #5: Ingesta de datos
+    data_ingest_session_id = checkpoint.get("ingest")
+    if data_ingest_session_id:
+        job.skip_stage("ingest", ingest_session_id=data_ingest_session_id)
+    else:
+        async with job.stage("ingest") as stage:
+            started_at = time.time()
+            data_ingest_session_id = await ingest_data(session_id)
+            if not data_ingest_session_id:
+                raise JobFailed("Failed to process files in Chimbitas.")
+            stage.detail["ingest_session_id"] = data_ingest_session_id
+            await checkpoint.save("ingest_started_at", started_at)
+            await checkpoint.save("ingest", data_ingest_session_id)
+    async with job.stage("ingest_polling"):
+        # La ingesta puede devolver la misma sesión que la búsqueda: su evento no cuenta.
+        status = await wait_for_task(data_ingest_session_id, "Data ingestion", since=checkpoint.get("ingest_started_at"))
+        if status != "completed":
+            if status is not None:
+                await checkpoint.discard("ingest", "ingest_started_at")
+            raise JobFailed("Failed to process files in Chimbitas.")
+    logger.info("Data ingestion completed successfully.")
+    result = "Audit process created and files processed successfully."
+    await checkpoint.save("result", result)
+    return result
+
+async def start_audit_job(request: AA_CreateAuditProcessRequest, checkpoint: Checkpoint) -> Job:
+    """
+        Submits the pipeline and holds the checkpoint for the job. Call it inside
+        audit_checkpoints.claiming(), after checking that no job owns the checkpoint.
+    """
+    job = audit_jobs.submit("create_audit_process", AUDIT_PIPELINE_STAGES, lambda job: run_audit_pipeline(job, request, checkpoint))
+    job.detail["checkpoint_id"] = checkpoint.id
+    await audit_checkpoints.hold(checkpoint.id, job.id, audit_jobs.wait(job))
+    return job
+
+def already_running(checkpoint_id: str, job_id: str) -> str:
+    return f"Audit process {checkpoint_id} is already running as job {job_id}. Use get_audit_job_status to follow its progress."
+
+async def follow_audit_job(job: Job, checkpoint: Checkpoint, ctx: Context, wait: bool) -> str:
+    if not wait:
+        return f"Audit process submitted as job {job.id}. Use get_audit_job_status to follow its progress."
+
+    async def report(job: Job):
+        await ctx.report_progress(job.completed_stages, len(job.stages), job.current_stage or job.status)
+
+    await audit_jobs.wait(job, on_change=report)
+    if job.status == SUCCEEDED:
+        return job.result
+    error = job.error or f"Audit job {job.id} {job.status}."
+    return f"{error} Resume it with resume_audit_process(checkpoint_id=\"{checkpoint.id}\")."
 
 
 @mcp.tool(
     name="create_audit_process"
 )
-async def create_audit_process(request: AA_CreateAuditProcessRequest) -> str:
+async def create_audit_process(request: AA_CreateAuditProcessRequest, ctx: Context, wait: bool = False) -> str:
     """
         Creates an Audict process by invoking the Chimbitas Lambda function. This process
         is responsible for managing and storing the information to be used in the audit process.
+        The process runs as a background job and its id is returned at once; follow it with
+        get_audit_job_status. With wait=True the call stays open until the job finishes and
+        reports progress notifications while it runs.
+        Every completed step is checkpointed; if the job fails, resume_audit_process continues
+        it from the first incomplete step instead of starting over.
     """
-    access_token = obtain_chimbitas_access_token()
-    if not access_token:
-        return "Failed to obtain Chimbitas access token."
-    
-    # Paso #1: Crear sesión en Chimbitas
-    session_id = get_chimbitas_session_id(request.titulo_proceso, access_token)
-    if not session_id:
-        return "Failed to create Chimbitas session."
-    
-    # Paso #2: Subir archivos relacionados al proceso de auditoría
-    upload_success_audict_pro, s3_keys_audict_pro = manage_upload_process(request.urls_planteamiento_proceso_auditoria, session_id, access_token, list_type="audict_process_files")
-    if not upload_success_audict_pro:
-        return "Failed to upload files to Chimbitas."
-    
-    # Paso #3: Subir archivos normativos
-    upload_success_normatives, s3_keys_normatives = manage_upload_process(request.urls_normativas_proceso, session_id, access_token, list_type="normatives")
-    if not upload_success_normatives:
-        return "Failed to upload normative files to Chimbitas."
-    
-    # Paso #4: Subir informes de auditoría
-    upload_success_audit_reports, s3_keys_audit_reports = manage_upload_process(request.urls_informes_auditoria, session_id, access_token, list_type="audit_reports")
-    if not upload_success_audit_reports:
-        return "Failed to upload audit report files to Chimbitas."
-    
-    # Paso #5:  Crea activity.txt
-    activityFileContent = f"1. Nombre de la empresa: {request.nombre_compania}\nNombre del proceso: {request.titulo_proceso}\nDescripcion del proceso: {request.descripcion_proceso}"
-    # Crear txt con el contenido
-    bytes_content = activityFileContent.encode('utf-8')
-    presigned_content_activity = generate_presigned_s3url_chimbitas(session_id, "activity.txt", access_token, f"{config.COMPANY_ID_CHIMBITAS}/{config.USER_ID_CHIMBITAS}/{session_id}")
-    if not presigned_content_activity:
-        return "Failed to generate presigned URL for activity.txt"
-    success_activity = upload_files_to_s3(presigned_content_activity, content_type="text/plain", file_content=bytes_content)
-    if not success_activity:
-        return "Failed to upload activity.txt to S3"
-
-    s3_keys = s3_keys_audict_pro + s3_keys_normatives + s3_keys_audit_reports + [{'name':"activity.txt", 's3_key': presigned_content_activity.get('fields', {}).get('key', ''), 'description': 'Activity File', 'file_prefix': f"{config.COMPANY_ID_CHIMBITAS}/{config.USER_ID_CHIMBITAS}/{session_id}", 'type': 'file'}]
-    print(f"All files including activity.txt uploaded successfully: {s3_keys}")    
-    processing_success = await process_files(session_id, s3_keys, request.nombre_compania, request.cargo_usuario, request.descripcion_proceso)
-    if not processing_success:
-        return "Failed to process files in Chimbitas."
-    return "Audit process created and files processed successfully."
+    checkpoint_id = checkpoint_id_for(request.model_dump())
+    async with audit_checkpoints.claiming():
+        job_id = await audit_checkpoints.owner(checkpoint_id)
+        if job_id is None:
+            checkpoint = await audit_checkpoints.open(checkpoint_id)
+            # Un create siempre empieza de cero; para continuar un intento anterior está resume_audit_process.
+            await checkpoint.clear()
+            await checkpoint.save("request", request.model_dump())
+            job = await start_audit_job(request, checkpoint)
+    if job_id is not None:
+        return already_running(checkpoint_id, job_id)
+    return await follow_audit_job(job, checkpoint, ctx, wait)
+
+@mcp.tool(name="resume_audit_process", description="Resume a failed or interrupted audit process from its first incomplete step. Pass the checkpoint_id reported by the failed job (detail.checkpoint_id) or the same request that was given to create_audit_process.")
+async def resume_audit_process(ctx: Context, checkpoint_id: Optional[str] = None, request: Optional[AA_CreateAuditProcessRequest] = None, wait: bool = False) -> str:
+    if checkpoint_id is None:
+        if request is None:
+            raise ValueError("Pass either checkpoint_id or request")
+        checkpoint_id = checkpoint_id_for(request.model_dump())
+    async with audit_checkpoints.claiming():
+        job_id = await audit_checkpoints.owner(checkpoint_id)
+        if job_id is None:
+            checkpoint = await audit_checkpoints.open(checkpoint_id)
+            if checkpoint.get("request") is None:
+                raise ValueError(f"No checkpoint found for {checkpoint_id}; start the process with create_audit_process")
+            job = await start_audit_job(AA_CreateAuditProcessRequest(**checkpoint.get("request")), checkpoint)
+    if job_id is not None:
+        return already_running(checkpoint_id, job_id)
+    return await follow_audit_job(job, checkpoint, ctx, wait)
+
+@mcp.tool(name="get_audit_job_status", description="Get the status and per-stage progress of an audit job.")
+async def get_audit_job_status(job_id: str) -> AA_AuditJobStatusResponse:
+    snapshot = await audit_jobs.snapshot(job_id)
+    if snapshot is None:
+        raise ValueError(f"Audit job {job_id} not found")
+    return AA_AuditJobStatusResponse(**snapshot)
+
+@mcp.tool(name="list_audit_jobs", description="List audit jobs, optionally filtered by status (pending, running, succeeded, failed, cancelled).")
+async def list_audit_jobs(status: Optional[str] = None) -> AA_ListAuditJobsResponse:
+    return AA_ListAuditJobsResponse(jobs=[AA_AuditJobStatusResponse(**snapshot) for snapshot in await audit_jobs.snapshots(status)])
+
+@mcp.tool(name="cancel_audit_job", description="Cancel a pending or running audit job.")
+async def cancel_audit_job(job_id: str) -> AA_AuditJobStatusResponse:
+    job = await audit_jobs.cancel(job_id)
+    if job is None:
+        # Los jobs solo se pueden cancelar desde el worker que los ejecuta.
+        snapshot = await audit_jobs.snapshot(job_id)
+        if snapshot is not None:
+            raise ValueError(f"Audit job {job_id} runs in worker {snapshot['worker_id']} and can only be cancelled there")
+        raise ValueError(f"Audit job {job_id} not found")
+    return AA_AuditJobStatusResponse(**audit_jobs.snapshot_of(job))
+
+@mcp.tool(name="get_audit_job_trace", description="Get the timed trace of an audit job, as JSON spans (format='json') or an OTLP/JSON export body (format='otlp').")
+async def get_audit_job_trace(job_id: str, format: str = "json") -> dict:
+    trace = tracer.get(job_id)
+    if trace is None:
+        raise ValueError(f"Trace for audit job {job_id} not found")
+    if format == "otlp":
+        return trace.to_otlp()
+    return trace.to_dict()
 
 @mcp.tool(name="get_parents_sessions_from_user", description="Get parent sessions from user id.")
-def get_parents_sessions_from_user(user_id: int) -> AA_GetParentSessionFromUserResponse:
+async def get_parents_sessions_from_user(user_id: int) -> AA_GetParentSessionFromUserResponse:
     """
         Retrieves parent sessions for a given user ID from the Chimbitas API.
     """
     try:
-        access_token = obtain_chimbitas_access_token()
-        if not access_token:
-            return {"error": "Failed to obtain Chimbitas access token."}
-        headers = {
-            "Authorization": f"Bearer {access_token}"
-        }
-        response = requests.get(f"{config.CHIMBITAS_LAMBDA_URL}/sessions/list?user_id={user_id}&company_id={config.COMPANY_ID_CHIMBITAS}&is_info_source=1", headers=headers)
-        response.raise_for_status()
-        if response.status_code == 200:
-            return response.json()
-        else:
-            return {"error": f"Failed to retrieve parent sessions, status code: {response.status_code}"}
+        return await session_listings.get((user_id, None), lambda _: list_sessions(user_id))
     except Exception as e:
         return {"error": f"Error retrieving parent sessions: {e}"}
     
 @mcp.tool(name="get_child_sessions_from_user", description="Get child sessions from user id and parent session id.")
-def get_child_sessions_from_user(user_id: int, parent_session_id: int) -> AA_GetParentSessionFromUserResponse:
+async def get_child_sessions_from_user(user_id: int, parent_session_id: int) -> AA_GetParentSessionFromUserResponse:
     """
         Retrieves child sessions for a given user ID and parent session ID from the Chimbitas API.
     """
     try:
-        access_token = obtain_chimbitas_access_token()
-        if not access_token:
-            return {"error": "Failed to obtain Chimbitas access token."}
-        headers = {
-            "Authorization": f"Bearer {access_token}"
-        }
-        response = requests.get(f"{config.CHIMBITAS_LAMBDA_URL}/sessions/list?user_id={user_id}&company_id={config.COMPANY_ID_CHIMBITAS}&parent_session_id={parent_session_id}&is_info_source=0", headers=headers)
-        response.raise_for_status()
-        if response.status_code == 200:
-            return response.json()
-        else:
-            return {"error": f"Failed to retrieve child sessions, status code: {response.status_code}"}
+        return await session_listings.get((user_id, parent_session_id), lambda _: list_sessions(user_id, parent_session_id))
     except Exception as e:
         return {"error": f"Error retrieving child sessions: {e}"}
     
 @mcp.tool(name="create_audit_chat_session", description="Create audit chat session in Chimbitas.")
-def create_audit_chat_session(session_name: str, parent_session_id: int) -> dict:
+async def create_audit_chat_session(session_name: str, parent_session_id: int) -> dict:
     """
         Creates an audit chat session in Chimbitas.
     """
     try:
-        access_token = obtain_chimbitas_access_token()
+        access_token = await obtain_chimbitas_access_token()
         if not access_token:
             return {"error": "Failed to obtain Chimbitas access token."}
         sessionid_payload = {
@@ -399,11 +615,42 @@ def create_audit_chat_session(session_name: str, parent_session_id: int) -> dict
         headers = {
             "Authorization": f"Bearer {access_token}"
         }
-        response = requests.post(f"{config.CHIMBITAS_LAMBDA_URL}/sessions/add", json=sessionid_payload, headers=headers)
+        response = await get_client("chimbitas_lambda").post("/sessions/add", json=sessionid_payload, headers=headers)
         response.raise_for_status()
         if response.status_code == 200:
+            await invalidate_session_listings(parent_session_id)
             return response.json()
         else:
             return {"error": f"Failed to create audit chat session, status code: {response.status_code}"}
     except Exception as e:
-        return {"error": f"Error creating audit chat session: {e}"}
\ No newline at end of file
+        return {"error": f"Error creating audit chat session: {e}"}
+
+async def task_status_callback(event: AA_TaskStatusCallback, token: Optional[str] = None, x_callback_token: Optional[str] = Header(None)):
+    """
+        Completion events pushed by the Chimbitas processing (see TASK_CALLBACK_URL). The
+        secret may come in the X-Callback-Token header or, for upstreams that can only call
+        a fixed URL, in the `token` query parameter.
+    """
+    if not hmac.compare_digest(x_callback_token or token or "", config.TASK_CALLBACK_SECRET):
+        raise HTTPException(status_code=401, detail="Invalid callback token")
+    woken = await task_poller.notify(event.session_id, event.analysis_type_id, event.status, event.model_dump())
+    return {"received": True, "woken": woken}
+
+# Solo se aceptan callbacks si los upstreams fueron configurados para enviarlos, y siempre autenticados.
+if config.TASK_CALLBACK_URL:
+    if not config.TASK_CALLBACK_SECRET:
+        raise ValueError("TASK_CALLBACK_SECRET must be set when TASK_CALLBACK_URL is")
+    router.add_api_route("/callbacks/task-status", task_status_callback, methods=["POST"])
+
+async def warm_up():
+    # El primer create_audit_process no espera el login en Chimbitas.
+    if not await obtain_chimbitas_access_token():
+        raise RuntimeError("Failed to obtain Chimbitas access token.")
+
+async def shutdown():
+    await audit_jobs.close()
+    await session_listings.close()
+    await task_poller.close()
+    await token_manager.close()
+    audit_checkpoints.close()
+    blob_cache.flush()
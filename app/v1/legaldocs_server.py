@@ -1,39 +1,67 @@
 from mcp.server.fastmcp import FastMCP
-from dotenv import load_dotenv
-from schemas.response_schemas import LD_GetTemplatesResponse, LD_UploadTemplateResponse, LD_UploadFileTemplateCompletitionResponse
+from config import config
+from schemas.response_schemas import LD_GetTemplatesResponse, LD_UploadTemplateResponse, LD_UploadFileTemplateCompletitionResponse, LD_BatchUploadFileTemplateCompletitionResponse
 from schemas.request_schemas import LD_UploadFileTemplateCompletition
-from io import BytesIO
+from services.blob_cache import blob_cache
+from services.cache import NOT_MODIFIED, AsyncTTLCache, CacheEntry
+from services.http_clients import get_client
+from services.shared_store import shared_store
+from services.streaming import SourceStream, StreamedFile, open_source, post_multipart_stream, spooled_source
+from typing import List, Optional
 
-import base64
-import os
-import requests
-
-load_dotenv()  # Carga las variables de entorno desde el archivo .env
+import asyncio
+import contextlib
+import httpx
+import logging
 
+logger = logging.getLogger(__name__)
 mcp = FastMCP(name="legaldocs-mcp", host="0.0.0.0", stateless_http=True)
-LEGAL_DOCS_URL = os.getenv("LEGAL_DOCS_URL")
-CREATE_DOCUMENT_LAMBDA = os.getenv("CREATE_DOCUMENT_LAMBDA")
+
+templates_cache = AsyncTTLCache(
+    "legal_docs_templates",
+    ttl=config.LEGAL_DOCS_TEMPLATES_TTL,
+    stale_ttl=config.LEGAL_DOCS_TEMPLATES_STALE_TTL,
+    store=shared_store,
+)
+
+async def fetch_templates(previous: CacheEntry = None):
+    """
+        Loads the template list from LegalDocs. When a previous copy carries an ETag the
+        request is conditional and a 304 keeps that copy.
+    """
+    headers = {"If-None-Match": previous.etag} if previous is not None and previous.etag else {}
+    response = await get_client("legal_docs").get("/get-templates", headers=headers)
+    if response.status_code == 304:
+        return NOT_MODIFIED
+    response.raise_for_status()
+    templates = response.json().get("available templates", [])
+    logger.info("Loaded %d templates from legal docs service", len(templates))
+    return CacheEntry(templates, response.headers.get("ETag"))
 
 @mcp.tool(
     name="get_legal_docs_templates", 
     description="Get available legal document templates name from the external service.",
     structured_output=True,
 )
-def get_available_temples() -> LD_GetTemplatesResponse:
+async def get_available_temples() -> LD_GetTemplatesResponse:
     try:
-        response = requests.get(f"{LEGAL_DOCS_URL}/get-templates")
-        if response.status_code == 200:
-            response = response.json().get("available templates", [])
-            print(f"Response from legal docs service: {response}")
-            return LD_GetTemplatesResponse(templates=response, result="Success")
+        templates = await templates_cache.get("templates", fetch_templates)
+        return LD_GetTemplatesResponse(templates=templates, result="Success")
     except Exception as e:
         return LD_GetTemplatesResponse(templates=[], result="Error retrieving legal documents")
 
+@mcp.tool(
+    name="get_legal_docs_templates_cache_stats",
+    description="Hit/miss counters of the legal document templates cache.",
+)
+async def get_templates_cache_stats() -> dict:
+    return templates_cache.stats()
+
 @mcp.tool(
     name="upload_legal_doc_template",
     structured_output=True
 )
-def upload_legal_doc_template(file_path: str, filename: str) -> LD_UploadTemplateResponse:
+async def upload_legal_doc_template(file_path: str, filename: str) -> LD_UploadTemplateResponse:
     """
     Upload a legal document template to the external service.
     Args:
@@ -43,36 +71,19 @@ def upload_legal_doc_template(file_path: str, filename: str) -> LD_UploadTemplat
     Returns:
     """
     try:
-        print(f"Uploading template: {filename}")
-        print(f"File path: {file_path}")
-        # print(f"Base64 content size: {len(base64_content)} characters")
-        # print(f"First 100 chars': {base64_content[:100]}")
-        # b64 = base64_content.split(",")[-1] if "," in base64_content else base64_content
-        # file_bytes = base64.b64decode(b64)
-        # print(f"Decoded file size: {len(file_bytes)} bytes")
+        logger.info("Uploading template %s from %s", filename, file_path)
         # Request para obtener el archivo y subirlo
-        response = requests.get(file_path)
-        if response.status_code != 200:
-            return LD_UploadTemplateResponse(
-                result=f"Failed to download file from {file_path}",
-                filename=filename,
-                status_code=response.status_code,
-                success=False
-            )
-        file_bytes = response.content
-        files = {
-            'file': (filename.strip() if filename.strip().endswith(".pdf") else f"{filename.strip()}.pdf", BytesIO(file_bytes), 'application/pdf')
-        }
-        print(f"Prepared files for upload: {files['file'][0]}, size: {len(file_bytes)} bytes")
-        
+        file_name = filename.strip() if filename.strip().endswith(".pdf") else f"{filename.strip()}.pdf"
         data = {
             'name': filename
         }
-        print(f"Uploading template: {filename}")
-        response = requests.post(f"{LEGAL_DOCS_URL}/upload-template", files=files, data=data)
-        print(f"Response status code: {response.status_code}")
-        print(f"Response content: {response.json()}")
+        async with open_source(file_path) as source:
+            upload = StreamedFile("file", file_name, "application/pdf", source)
+            response, _ = await post_multipart_stream(get_client("legal_docs"), "/upload-template", data, [upload])
+        logger.info("Uploaded file: %s, size: %d bytes, status code: %s", file_name, upload.bytes_sent, response.status_code)
+        logger.debug("Response content: %s", response.text)
         if response.status_code == 200:
+            await templates_cache.invalidate()
             return LD_UploadTemplateResponse(
                 result=response.json().get("message", "Template uploaded successfully"),
                 filename=filename,
@@ -87,6 +98,13 @@ def upload_legal_doc_template(file_path: str, filename: str) -> LD_UploadTemplat
                 status_code=response.status_code,
                 success=False
             )
+    except httpx.HTTPStatusError as e:
+        return LD_UploadTemplateResponse(
+            result=f"Failed to download file from {file_path}",
+            filename=filename,
+            status_code=e.response.status_code,
+            success=False
+        )
     except Exception as e:
         return LD_UploadTemplateResponse(
             result="Error uploading template",
@@ -99,7 +117,7 @@ def upload_legal_doc_template(file_path: str, filename: str) -> LD_UploadTemplat
     name="upload_doc_for_template_completition",
     structured_output=True
 )
-def upload_doc_for_template_completition(filename: str, file_path: str) -> LD_UploadFileTemplateCompletitionResponse:
+async def upload_doc_for_template_completition(filename: str, file_path: str) -> LD_UploadFileTemplateCompletitionResponse:
     """
     Upload a legal document template to the external service.
     Args:
@@ -110,27 +128,13 @@ def upload_doc_for_template_completition(filename: str, file_path: str) -> LD_Up
     Returns:
     """
     try:
-        print(f"Generating document from template: {filename}")
-        print(f"File path: {file_path}")
-        response = requests.get(file_path)
-        if response.status_code != 200:
-            return LD_UploadFileTemplateCompletitionResponse(
-                result=f"Failed to download file from {file_path}",
-                filename=filename,
-                status_code=response.status_code,
-                success=False
-            )
-        file_bytes = response.content
+        logger.info("Generating document %s from %s", filename, file_path)
         file_name = filename if filename.strip().endswith(".pdf") else f"{filename.strip()}.pdf"
-        files = []
-        files.append((
-                "files",
-                (file_name, BytesIO(file_bytes), "application/pdf")
-            ))
-        print(f"Prepared {len(files)} info files for upload.")
-        response = requests.post(f"{LEGAL_DOCS_URL}/upload_unstructured_document", files=files)
-        print(f"Response status code: {response.status_code}")
-        print(f"Response content: {response.json()}")
+        async with open_source(file_path) as source:
+            files = [StreamedFile("files", file_name, "application/pdf", source)]
+            response, _ = await post_multipart_stream(get_client("legal_docs"), "/upload_unstructured_document", {}, files)
+        logger.info("Response status code: %s", response.status_code)
+        logger.debug("Response content: %s", response.text)
         if response.status_code == 200:
             return LD_UploadFileTemplateCompletitionResponse(
                 result=response.json().get("message", "Document generated successfully"),
@@ -145,6 +149,13 @@ def upload_doc_for_template_completition(filename: str, file_path: str) -> LD_Up
                 status_code=response.status_code,
                 success=False
             )
+    except httpx.HTTPStatusError as e:
+        return LD_UploadFileTemplateCompletitionResponse(
+            result=f"Failed to download file from {file_path}",
+            filename=filename,
+            status_code=e.response.status_code,
+            success=False
+        )
     except Exception as e:
         return LD_UploadFileTemplateCompletitionResponse(
             result=f"Error generating document: {e}",
@@ -153,20 +164,107 @@ def upload_doc_for_template_completition(filename: str, file_path: str) -> LD_Up
             success=False
         )
 
+class BatchItem:
+    def __init__(self, filename: str, file_path: str):
+        self.file_path = file_path
+        self.file_name = filename if filename.strip().endswith(".pdf") else f"{filename.strip()}.pdf"
+        self.source: Optional[SourceStream] = None
+        self.result: Optional[LD_UploadFileTemplateCompletitionResponse] = None
+
+    def fail(self, result: str, status_code: int):
+        self.result = LD_UploadFileTemplateCompletitionResponse(result=result, filename="", status_code=status_code, success=False)
+
+def size_capped_batches(items: List[BatchItem], max_bytes: int) -> List[List[BatchItem]]:
+    """
+        Groups the downloaded items, in order, into POSTs of at most `max_bytes` of files;
+        a file larger than the cap goes alone.
+    """
+    batches, batch, batch_bytes = [], [], 0
+    for item in items:
+        if batch and batch_bytes + item.source.size > max_bytes:
+            batches.append(batch)
+            batch, batch_bytes = [], 0
+        batch.append(item)
+        batch_bytes += item.source.size
+    if batch:
+        batches.append(batch)
+    return batches
+
+async def upload_batch(batch: List[BatchItem]):
+    files = [StreamedFile("files", item.file_name, "application/pdf", item.source) for item in batch]
+    try:
+        response, _ = await post_multipart_stream(get_client("legal_docs"), "/upload_unstructured_document", {}, files)
+    except Exception as e:
+        for item in batch:
+            item.fail(f"Error generating document: {e}", 500)
+        return
+    logger.info("Batch of %d documents: status code %s", len(batch), response.status_code)
+    if response.status_code != 200:
+        for item in batch:
+            item.fail(f"Failed to generate document: {response.text}", response.status_code)
+        return
+    body = response.json()
+    # LegalDocs devuelve document_names en el orden de las partes enviadas.
+    document_names = body.get("document_names", [])
+    for index, item in enumerate(batch):
+        item.result = LD_UploadFileTemplateCompletitionResponse(
+            result=body.get("message", "Document generated successfully"),
+            filename=document_names[index] if index < len(document_names) else "",
+            status_code=response.status_code,
+            success=True,
+        )
+
+@mcp.tool(
+    name="upload_docs_for_template_completition",
+    structured_output=True
+)
+async def upload_docs_for_template_completition(files: List[LD_UploadFileTemplateCompletition]) -> LD_BatchUploadFileTemplateCompletitionResponse:
+    """
+    Batch version of upload_doc_for_template_completition: uploads several documents to be
+    used with create_document_from_template in one call.
+    Args:
+        files (list): Items with the filename and file_path (URL) of each document.
+
+    Returns:
+        One result per file, in the same order, with the document name to pass to
+        create_document_from_template when it succeeded.
+    """
+    if len(files) > config.LEGAL_DOCS_BATCH_MAX_FILES:
+        raise ValueError(f"At most {config.LEGAL_DOCS_BATCH_MAX_FILES} files per call")
+    items = [BatchItem(file.filename, file.file_path) for file in files]
+    semaphore = asyncio.Semaphore(config.LEGAL_DOCS_BATCH_CONCURRENCY)
+    async with contextlib.AsyncExitStack() as stack:
+        async def download(item: BatchItem):
+            async with semaphore:
+                try:
+                    item.source = await stack.enter_async_context(spooled_source(item.file_path))
+                except httpx.HTTPStatusError as e:
+                    item.fail(f"Failed to download file from {item.file_path}", e.response.status_code)
+                except Exception as e:
+                    item.fail(f"Failed to download file from {item.file_path}: {e}", 500)
+
+        await asyncio.gather(*[download(item) for item in items])
+        batches = size_capped_batches([item for item in items if item.source is not None], config.LEGAL_DOCS_BATCH_MAX_BYTES)
+        for batch in batches:
+            await upload_batch(batch)
+    results = [item.result for item in items]
+    uploaded = sum(1 for result in results if result.success)
+    return LD_BatchUploadFileTemplateCompletitionResponse(results=results, uploaded=uploaded, failed=len(results) - uploaded, requests=len(batches))
+
 @mcp.tool(
     name="create_document_from_template",
     description="Create a legal document from a template and a list of info files.",
     structured_output=False,
 )
-def create_document_from_template(template_name: str, info_file_names: list[str], email: str) -> dict:
+async def create_document_from_template(template_name: str, info_file_names: list[str], email: str) -> dict:
     try:
         payload = {
             "template_name": template_name,
             "document_names": ",".join(info_file_names),
             "email": email
         }
-        print(f"Creating document with payload: {payload}")
-        response = requests.post(CREATE_DOCUMENT_LAMBDA, json=payload)
+        logger.info("Creating document from template %s with %d info files", template_name, len(info_file_names))
+        response = await get_client("external").post(config.CREATE_DOCUMENT_LAMBDA, json=payload)
         if response.status_code == 200 or response.status_code == 201 or response.status_code == 202:
             return response.json()
         else:
@@ -175,5 +273,14 @@ def create_document_from_template(template_name: str, info_file_names: list[str]
     except Exception as e:
         return {"error": f"Error creating document from template: {e}"}
 
+async def warm_up():
+    await templates_cache.get("templates", fetch_templates)
+
+async def shutdown():
+    await templates_cache.close()
+    blob_cache.flush()
+
 if __name__ == "__main__":
+    from services.log import configure_logging
+    configure_logging()
     mcp.run(transport="streamable-http")
@@ -1,33 +1,79 @@
 # main.py
 from mcp.server.fastmcp import FastMCP
-import math, sys
+from config import config
+from schemas.response_schemas import MT_FactorialHandleResponse
+from services import factorial
+from services.worker_status import register_load
 import os
 mcp = FastMCP(name="math-tools-mcp", host="0.0.0.0", stateless_http=True)
+# Más dígitos de los extremos se leen por páginas con factorial://{n}/digits/{page}.
+MAX_EDGE_DIGITS = 1000
+register_load("factorials_in_flight", lambda: factorial.factorial_engine.in_flight)
 
-if hasattr(sys, "set_int_max_str_digits"):
-    sys.set_int_max_str_digits(1_000_000)
-
-def compute_factorial(n: int) -> int:
+async def compute_factorial(n: int, encoding: str = "decimal") -> str:
     if not isinstance(n, int) or n < 0:
         raise ValueError("n must be a non-negative integer")
-    return math.factorial(n)
+    value, digits = await factorial.factorial_engine.factorial(n)
+    return factorial.encode_factorial(value, digits, encoding)
 
 @mcp.tool()  # ← sin kwargs; el schema sale de las anotaciones
-def factorial_value(n: int) -> int:
-    """Return the exact value of n! (factorial of n). Example: factorial_value(5) -> 120"""
-    return compute_factorial(n)  # → output_schema = {"result": {"type": "integer"}}
+async def factorial_value(n: int, encoding: str = "decimal") -> str:
+    """Return the exact value of n! (factorial of n). Example: factorial_value(5) -> '120'
+    encoding: "decimal" (default), "hex", "base64" (big-endian binary) or "summary"
+    (leading/trailing digits and the digit count). For very large n prefer factorial_handle
+    and read only the pages you need."""
+    return await compute_factorial(n, encoding)  # → output_schema = {"result": {"type": "string"}}
+
+@mcp.tool()
+async def factorial_handle(n: int, edge_digits: int = 20) -> MT_FactorialHandleResponse:
+    """Compute n! once and return a handle to it: digit and byte counts, the leading and
+    trailing digits (1 to MAX_EDGE_DIGITS of each), and the resource URIs to read it in
+    digit pages or byte ranges."""
+    if not 1 <= edge_digits <= MAX_EDGE_DIGITS:
+        raise ValueError(f"edge_digits must be between 1 and {MAX_EDGE_DIGITS}")
+    value, digits = await factorial.factorial_engine.factorial(n)
+    size = len(factorial.to_bytes(value))
+    return MT_FactorialHandleResponse(
+        n=n,
+        digits=len(digits),
+        bytes=size,
+        page_digits=config.FACTORIAL_PAGE_DIGITS,
+        pages=-(-len(digits) // config.FACTORIAL_PAGE_DIGITS),
+        leading_digits=digits[:edge_digits],
+        trailing_digits=digits[max(len(digits) - edge_digits, 0):],
+        digits_uri_template=f"factorial://{n}/digits/{{page}}",
+        bytes_uri_template=f"factorial://{n}/bytes/{{start}}/{{end}}",
+    )
+
+@mcp.resource("factorial://{n}/digits/{page}", mime_type="text/plain")
+async def factorial_digits_page(n: int, page: int) -> str:
+    """Page `page` (0-based) of the decimal digits of n!, FACTORIAL_PAGE_DIGITS digits per page."""
+    _, digits = await factorial.factorial_engine.factorial(n)
+    start = page * config.FACTORIAL_PAGE_DIGITS
+    if page < 0 or start >= len(digits):
+        raise ValueError(f"page must be between 0 and {(len(digits) - 1) // config.FACTORIAL_PAGE_DIGITS}")
+    return digits[start:start + config.FACTORIAL_PAGE_DIGITS]
+
+@mcp.resource("factorial://{n}/bytes/{start}/{end}", mime_type="application/octet-stream")
+async def factorial_byte_range(n: int, start: int, end: int) -> bytes:
+    """Bytes [start, end) of the big-endian binary value of n!."""
+    if start < 0 or end <= start or end - start > config.FACTORIAL_MAX_RANGE_BYTES:
+        raise ValueError(f"byte ranges must satisfy 0 <= start < end and span at most {config.FACTORIAL_MAX_RANGE_BYTES} bytes")
+    value, _ = await factorial.factorial_engine.factorial(n)
+    return factorial.to_bytes(value)[start:end]
 
 @mcp.tool()
 def factorial_digits(n: int) -> int:
     """Return the number of digits in n! (factorial of n). Example: factorial_digits(5) -> 3"""
-    if n < 0:
-        raise ValueError("n must be a non-negative integer")
-    if n <= 1:
-        return 1
-    s = 0.0
-    for i in range(2, n + 1):
-        s += math.log10(i)
-    return int(math.floor(s)) + 1
+    return factorial.factorial_digits(n)
+
+@mcp.tool()
+def factorial_digits_batch(ns: list[int]) -> list[int]:
+    """Return the number of digits in n! for every n in the list. Example: factorial_digits_batch([5, 10]) -> [3, 7]"""
+    return factorial.factorial_digits_batch(ns)
+
+async def shutdown():
+    await factorial.factorial_engine.close()
 
 if __name__ == "__main__":
     mcp.run(transport="streamable-http")
@@ -0,0 +1,214 @@
+"""
+    Local stand-ins for the upstream services, for benchmarks only. A single FastAPI app
+    answers the Chimbitas Lambda (CHIMBITAS_LAMBDA_URL), Chimbitas API (API_CHIMBITAS_URL),
+    LegalDocs (LEGAL_DOCS_URL), the document-creation Lambda, a presigned-POST S3 bucket
+    and the source documents that tools download.
+
+    When /files/search or /ingest_data carry a callback_url (the server sets it from
+    TASK_CALLBACK_URL), the task completes after --callback-delay seconds and a completion
+    event is POSTed to that URL, as the real processing would. With --reuse-session-id,
+    /ingest_data answers with the session id it was given instead of a new one, so the
+    ingestion task is tracked under the same key as the file search.
+
+    Usage:
+        python -m benchmarks.fake_upstreams --port 9100 --latency 0.05 --failure-rate 0.01
+        python -m benchmarks.fake_upstreams --port 9100 --callback-delay 0.5
+        python -m benchmarks.fake_upstreams --port 9100 --callback-delay 0.5 --reuse-session-id
+"""
+import argparse
+import asyncio
+import itertools
+import random
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
+
+
+class UpstreamSettings:
+    def __init__(self, base_url: str, latency: float = 0.0, jitter: float = 0.0, failure_rate: float = 0.0,
+                 task_checks: int = 1, document_size: int = 256 * 1024, callback_delay: float = 0.5,
+                 reuse_session_id: bool = False):
+        self.base_url = base_url
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.task_checks = task_checks
+        self.document_size = document_size
+        self.callback_delay = callback_delay
+        self.reuse_session_id = reuse_session_id
+
+
+def build_app(settings: UpstreamSettings) -> FastAPI:
+    app = FastAPI()
+    session_ids = itertools.count(1000)
+    status_checks = {}
+    completed = set()
+    pending = set()
+    callbacks = set()
+
+    async def complete_later(callback_url: str, session_id: int):
+        # Tarea "en proceso" hasta que se dispara el callback; desde entonces /task/status responde completed.
+        await asyncio.sleep(settings.callback_delay)
+        pending.discard((session_id, 1))
+        completed.add((session_id, 1))
+        async with httpx.AsyncClient() as client:
+            try:
+                await client.post(callback_url, json={"session_id": session_id, "analysis_type_id": 1, "status": "completed"})
+            except httpx.HTTPError as e:
+                print(f"Callback to {callback_url} failed: {e}")
+
+    def start_task(body: dict, session_id: int):
+        # Una tarea nueva en la misma sesión vuelve a estar en proceso.
+        completed.discard((session_id, 1))
+        if body.get("callback_url"):
+            pending.add((session_id, 1))
+            task = asyncio.ensure_future(complete_later(body["callback_url"], session_id))
+            callbacks.add(task)
+            task.add_done_callback(callbacks.discard)
+    templates = ["contrato_arrendamiento", "acuerdo_confidencialidad", "poder_general"]
+
+    @app.middleware("http")
+    async def latency_and_failures(request: Request, call_next):
+        # Los documentos de origen y S3 también pasan por aquí: simulan redes lentas.
+        delay = settings.latency + random.uniform(0, settings.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if random.random() < settings.failure_rate:
+            return JSONResponse({"error": "injected failure"}, status_code=503)
+        return await call_next(request)
+
+    # Chimbitas Lambda
+    @app.post("/token")
+    async def token():
+        return {"access_token": "benchmark-token", "expires_in": 3600}
+
+    @app.post("/sessions/add")
+    async def add_session():
+        return {"session": {"session_id": next(session_ids)}}
+
+    @app.get("/sessions/list")
+    async def list_sessions(user_id: int, company_id: int, is_info_source: int, parent_session_id: int = None):
+        sessions = [{
+            "session_id": n,
+            "company_id": company_id,
+            "user_id": user_id,
+            "session_name": f"session {n}",
+            "task": "benchmark",
+            "objective": "benchmark",
+            "analysis_type_id": 1,
+            "created_at": "2025-01-01T00:00:00",
+            "kb_id": f"kb-{n}",
+            "process_name": f"process {n}",
+            "process_description": "benchmark",
+            "parent_session_id": parent_session_id,
+            "is_info_source": is_info_source,
+        } for n in range(20)]
+        return {"message": "Sessions retrieved successfully", "sessions": sessions}
+
+    # Chimbitas API
+    @app.post("/files/upload")
+    async def presign(request: Request):
+        body = await request.json()
+        key = f"{body['object_prefix']}/{body['object_name']}"
+        return {"url": f"{settings.base_url}/s3", "fields": {"key": key, "policy": "benchmark", "x-amz-signature": "benchmark"}}
+
+    @app.post("/files/search")
+    async def search_files(request: Request):
+        body = await request.json()
+        start_task(body, int(body["session_id"]))
+        return {"message": "processing"}
+
+    @app.post("/ingest_data")
+    async def ingest_data(request: Request):
+        body = await request.json()
+        session_id = int(body["session_id"]) if settings.reuse_session_id else next(session_ids)
+        start_task(body, session_id)
+        return {"session_id": session_id}
+
+    @app.get("/task/status")
+    async def task_status(session_id: int, analysis_type_id: int):
+        key = (session_id, analysis_type_id)
+        if key in completed:
+            return {"status": "completed"}
+        if key in pending:
+            # Con callback la tarea sigue en proceso hasta que este se dispare.
+            return {"status": "processing"}
+        status_checks[key] = status_checks.get(key, 0) + 1
+        if status_checks[key] >= settings.task_checks:
+            status_checks.pop(key)
+            return {"status": "completed"}
+        return {"status": "processing"}
+
+    # S3 (POST presignado)
+    @app.post("/s3")
+    async def s3_upload(request: Request):
+        size = 0
+        async for chunk in request.stream():
+            size += len(chunk)
+        return Response(status_code=204, headers={"x-benchmark-bytes": str(size)})
+
+    # LegalDocs y Lambda de creación de documentos
+    @app.get("/get-templates")
+    async def get_templates():
+        return JSONResponse({"available templates": templates}, headers={"ETag": f'"{len(templates)}"'})
+
+    @app.post("/upload-template")
+    async def upload_template(request: Request):
+        async for _ in request.stream():
+            pass
+        return {"message": "Template uploaded successfully"}
+
+    @app.post("/upload_unstructured_document")
+    async def upload_document(request: Request):
+        async for _ in request.stream():
+            pass
+        return {"message": "Document generated successfully", "document_names": ["benchmark.pdf"]}
+
+    @app.post("/create-document")
+    async def create_document():
+        return JSONResponse({"message": "Document creation started"}, status_code=202)
+
+    # Documentos de origen: /documents/{size}/{name}; con ETag para ejercitar la caché de blobs.
+    @app.get("/documents/{size}/{name}")
+    async def document(size: int, name: str, request: Request):
+        etag = f'"{size}-{name}"'
+        if request.headers.get("If-None-Match") == etag:
+            return Response(status_code=304)
+        return Response(b"%" * size, media_type="application/pdf", headers={"ETag": etag})
+
+    @app.get("/documents/{name}")
+    async def default_document(name: str, request: Request):
+        return await document(settings.document_size, name, request)
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake upstream services for benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", type=float, default=0.0, help="Base latency added to every response, in seconds.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Extra uniform random latency, in seconds.")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of requests answered with 503.")
+    parser.add_argument("--task-checks", type=int, default=1, help="Status checks before a task reports completed.")
+    parser.add_argument("--document-size", type=int, default=256 * 1024, help="Size in bytes of /documents/{name}.")
+    parser.add_argument("--callback-delay", type=float, default=0.5, help="Seconds until a task with a callback_url completes.")
+    parser.add_argument("--reuse-session-id", action="store_true", help="Have /ingest_data reuse the session id of the search.")
+    args = parser.parse_args()
+    settings = UpstreamSettings(
+        base_url=f"http://{args.host}:{args.port}",
+        latency=args.latency,
+        jitter=args.jitter,
+        failure_rate=args.failure_rate,
+        task_checks=args.task_checks,
+        document_size=args.document_size,
+        callback_delay=args.callback_delay,
+        reuse_session_id=args.reuse_session_id,
+    )
+    uvicorn.run(build_app(settings), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+    Replays MCP tool calls recorded by the capture middleware (CAPTURE_PATH) against a
+    running server and compares latency distributions between runs, so an optimization can
+    be checked against the shape of real traffic.
+
+    `replay` re-issues the calls in capture order, either at the original pacing (each
+    call sent at its captured offset, divided by --speed) or as fast as possible with
+    --concurrency calls in flight, and writes one JSONL line per call. `compare` takes two
+    such files (a capture or a replay output) and reports count, errors and p50/p95/p99 per
+    tool. Captures hold server-side latency and replays client-side latency: compare a
+    replay with another replay for a like-for-like result.
+
+    Redacted arguments are sent as captured ("[REDACTED]"); use --skip-redacted to leave
+    those calls out.
+
+    Usage (from the repository root):
+        python -m benchmarks.replay replay capture.jsonl --url http://127.0.0.1:8001 --output before.jsonl
+        python -m benchmarks.replay replay capture.jsonl --url http://127.0.0.1:8001 --pacing asap --concurrency 16 --output after.jsonl
+        python -m benchmarks.replay compare before.jsonl after.jsonl --fail-above 10
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import sys
+import time
+from typing import Dict, List, Optional
+
+from mcp import ClientSession
+from mcp.client.streamable_http import streamablehttp_client
+
+from benchmarks.run import _ms, percentile
+
+ALL = "*"
+
+
+def load_calls(path: str, tools: Optional[List[str]] = None, skip_redacted: bool = False, limit: Optional[int] = None) -> List[dict]:
+    calls = []
+    with open(path) as file:
+        for line in file:
+            if not line.strip():
+                continue
+            call = json.loads(line)
+            if skip_redacted and call.get("redacted"):
+                continue
+            if tools and call["tool"] not in tools:
+                continue
+            calls.append(call)
+    calls.sort(key=lambda call: call["ts"])
+    return calls[:limit] if limit else calls
+
+
+async def replay(args: argparse.Namespace, calls: List[dict]) -> List[dict]:
+    results: List[dict] = []
+    async with contextlib.AsyncExitStack() as stack:
+        # Una sesión por servidor montado; las llamadas concurrentes comparten la sesión.
+        sessions: Dict[str, ClientSession] = {}
+        for mount in sorted({call["mount"] for call in calls}):
+            read, write, _ = await stack.enter_async_context(streamablehttp_client(f"{args.url.rstrip('/')}/{mount}/mcp", timeout=args.timeout))
+            sessions[mount] = await stack.enter_async_context(ClientSession(read, write))
+            await sessions[mount].initialize()
+
+        semaphore = asyncio.Semaphore(args.concurrency) if args.pacing == "asap" else None
+        first_ts = calls[0]["ts"]
+        started = time.perf_counter()
+
+        async def send(call: dict, scheduled: float):
+            sent = time.perf_counter() - started
+            try:
+                result = await sessions[call["mount"]].call_tool(call["tool"], call["arguments"])
+                is_error, response_bytes = result.isError, len(result.model_dump_json())
+            except Exception as e:
+                is_error, response_bytes = True, 0
+                print(f"{call['mount']}/{call['tool']} failed: {e}", file=sys.stderr)
+            results.append({
+                "ts": call["ts"],
+                "mount": call["mount"],
+                "tool": call["tool"],
+                "offset_s": round(sent, 6),
+                "lag_ms": _ms(max(0.0, sent - scheduled)),
+                "duration_ms": round((time.perf_counter() - started - sent) * 1000, 3),
+                "response_bytes": response_bytes,
+                "is_error": is_error,
+            })
+
+        async def issue(call: dict):
+            if semaphore is not None:
+                async with semaphore:
+                    await send(call, 0.0)
+                return
+            scheduled = (call["ts"] - first_ts) / args.speed
+            delay = scheduled - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await send(call, scheduled)
+
+        await asyncio.gather(*[issue(call) for call in calls])
+    return results
+
+
+def summarize(calls: List[dict]) -> Dict[str, dict]:
+    groups: Dict[str, List[dict]] = {ALL: calls}
+    for call in calls:
+        groups.setdefault(f"{call['mount']}/{call['tool']}", []).append(call)
+    summary = {}
+    for name, group in groups.items():
+        latencies = [call["duration_ms"] / 1000 for call in group]
+        summary[name] = {
+            "calls": len(group),
+            "errors": sum(1 for call in group if call.get("is_error")),
+            "p50_ms": _ms(percentile(latencies, 0.50)),
+            "p95_ms": _ms(percentile(latencies, 0.95)),
+            "p99_ms": _ms(percentile(latencies, 0.99)),
+        }
+    return summary
+
+
+def _change(before: Optional[float], after: Optional[float]) -> Optional[float]:
+    if not before or after is None:
+        return None
+    return round((after - before) / before * 100, 1)
+
+
+def compare(baseline: List[dict], candidate: List[dict]) -> List[dict]:
+    before, after = summarize(baseline), summarize(candidate)
+    rows = []
+    for name in [ALL] + sorted((set(before) | set(after)) - {ALL}):
+        a, b = before.get(name, {}), after.get(name, {})
+        row = {"tool": name, "calls": f"{a.get('calls', 0)}/{b.get('calls', 0)}", "errors": f"{a.get('errors', 0)}/{b.get('errors', 0)}"}
+        for column in ("p50_ms", "p95_ms", "p99_ms"):
+            row[column] = f"{a.get(column)} -> {b.get(column)}"
+            row[f"{column[:3]}_change_pct"] = _change(a.get(column), b.get(column))
+        rows.append(row)
+    return rows
+
+
+def print_rows(rows: List[dict]):
+    columns = list(rows[0])
+    widths = [max(len(column), *(len(str(row[column])) for row in rows)) for column in columns]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(str(row[column]).ljust(width) for column, width in zip(columns, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured MCP tool calls and compare latency distributions.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    replay_parser = commands.add_parser("replay", help="Re-issue a capture against a running server.")
+    replay_parser.add_argument("capture", help="JSONL written by the capture middleware (CAPTURE_PATH).")
+    replay_parser.add_argument("--url", default="http://127.0.0.1:8001", help="Base URL of the server; calls go to <url>/<mount>/mcp.")
+    replay_parser.add_argument("--pacing", choices=["original", "asap"], default="original",
+                               help="original: keep the captured offsets between calls; asap: --concurrency calls in flight.")
+    replay_parser.add_argument("--speed", type=float, default=1.0, help="With original pacing, divide the captured offsets by this factor.")
+    replay_parser.add_argument("--concurrency", type=int, default=8, help="Calls in flight with --pacing asap.")
+    replay_parser.add_argument("--tools", help="Comma separated tool names to replay (default: all).")
+    replay_parser.add_argument("--skip-redacted", action="store_true", help="Leave out calls whose arguments were redacted.")
+    replay_parser.add_argument("--limit", type=int, help="Replay only the first N calls.")
+    replay_parser.add_argument("--timeout", type=float, default=300, help="Client timeout per call, in seconds.")
+    replay_parser.add_argument("--output", help="Write one JSONL line per replayed call to this file.")
+
+    compare_parser = commands.add_parser("compare", help="Compare the latency distributions of two runs.")
+    compare_parser.add_argument("baseline", help="Capture or replay output.")
+    compare_parser.add_argument("candidate", help="Capture or replay output.")
+    compare_parser.add_argument("--fail-above", type=float, help="Exit with status 1 if the overall p95 grows by more than this percentage.")
+    compare_parser.add_argument("--json", help="Also write the comparison to this file.")
+    args = parser.parse_args()
+
+    if args.command == "replay":
+        tools = [name.strip() for name in args.tools.split(",") if name.strip()] if args.tools else None
+        calls = load_calls(args.capture, tools, args.skip_redacted, args.limit)
+        if not calls:
+            parser.error("no calls to replay")
+        print(f"Replaying {len(calls)} calls ({args.pacing} pacing)...", file=sys.stderr)
+        results = asyncio.run(replay(args, calls))
+        if args.output:
+            with open(args.output, "w") as file:
+                file.writelines(json.dumps(result) + "\n" for result in results)
+        print_rows([{"tool": name, **stats} for name, stats in summarize(results).items()])
+        return
+
+    rows = compare(load_calls(args.baseline), load_calls(args.candidate))
+    print_rows(rows)
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(rows, file, indent=2)
+    change = rows[0]["p95_change_pct"]
+    if args.fail_above is not None and change is not None and change > args.fail_above:
+        print(f"p95 grew {change}% (limit {args.fail_above}%)", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+"""
+    Benchmarks the MCP tools end to end, offline. Starts the fake upstreams and, for each
+    scenario, a fresh `uvicorn server:app` pointed at them, then calls one tool over
+    streamable HTTP at a fixed concurrency. Reports throughput, p50/p95/p99 latency,
+    errors and the peak RSS of the server process (and its worker processes).
+
+    Usage (from the repository root):
+        python -m benchmarks.run
+        python -m benchmarks.run --scenarios factorial_value,factorial_digits --factorial-n 200000
+        python -m benchmarks.run --concurrency 32 --requests 500 --latency 0.05 --failure-rate 0.01 --json results.json
+        python -m benchmarks.run --scenarios create_audit_process --requests 20 --callbacks
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+import httpx
+from mcp import ClientSession
+from mcp.client.streamable_http import streamablehttp_client
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Scenario:
+    def __init__(self, name: str, mount: str, tool: str, arguments: Callable[[argparse.Namespace, int], dict]):
+        self.name = name
+        self.mount = mount
+        self.tool = tool
+        self.arguments = arguments
+
+
+def _audit_request(args: argparse.Namespace, i: int) -> dict:
+    upstream = f"http://127.0.0.1:{args.upstream_port}"
+    files = [{"filename": f"doc_{i}_{n}.pdf", "file_url": f"{upstream}/documents/doc_{i}_{n}.pdf"} for n in range(args.files)]
+    return {
+        "request": {
+            "nombre_compania": "Benchmark S.A.",
+            "cargo_usuario": "Auditor",
+            "titulo_proceso": f"benchmark {i}",
+            "descripcion_proceso": "Proceso generado por el benchmark",
+            "urls_planteamiento_proceso_auditoria": files,
+            "urls_normativas_proceso": [],
+            "urls_informes_auditoria": [],
+        },
+        "wait": True,
+    }
+
+
+SCENARIOS: Dict[str, Scenario] = {scenario.name: scenario for scenario in [
+    Scenario("factorial_value", "math", "factorial_value", lambda args, i: {"n": args.factorial_n}),
+    Scenario("factorial_value_summary", "math", "factorial_value", lambda args, i: {"n": args.factorial_n, "encoding": "summary"}),
+    Scenario("factorial_digits", "math", "factorial_digits", lambda args, i: {"n": args.factorial_n * 1000 + i}),
+    Scenario("factorial_digits_batch", "math", "factorial_digits_batch", lambda args, i: {"ns": list(range(i * 1000, i * 1000 + 1000))}),
+    Scenario("get_legal_docs_templates", "legaldocs", "get_legal_docs_templates", lambda args, i: {}),
+    Scenario("upload_legal_doc_template", "legaldocs", "upload_legal_doc_template",
+             lambda args, i: {"file_path": f"http://127.0.0.1:{args.upstream_port}/documents/template_{i % 10}.pdf", "filename": f"template_{i % 10}"}),
+    Scenario("upload_docs_for_template_completition", "legaldocs", "upload_docs_for_template_completition",
+             lambda args, i: {"files": [{"filename": f"doc_{i}_{n}", "file_path": f"http://127.0.0.1:{args.upstream_port}/documents/doc_{i}_{n}.pdf"} for n in range(args.files)]}),
+    Scenario("get_parents_sessions_from_user", "audit_agent", "get_parents_sessions_from_user", lambda args, i: {"user_id": i % 10}),
+    Scenario("create_audit_process", "audit_agent", "create_audit_process", _audit_request),
+]}
+
+DEFAULT_SCENARIOS = "factorial_value,factorial_digits,factorial_digits_batch,get_legal_docs_templates,upload_legal_doc_template,get_parents_sessions_from_user"
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    # Nearest-rank.
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def peak_rss_kib(pid: int) -> Optional[int]:
+    """
+        Peak resident set size (VmHWM) of `pid` plus its direct children, from /proc.
+        Returns None where /proc is not available.
+    """
+    def vm_hwm(process_id) -> int:
+        with open(f"/proc/{process_id}/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+        return 0
+
+    try:
+        total = vm_hwm(pid)
+    except OSError:
+        return None
+    for task in os.listdir(f"/proc/{pid}/task"):
+        try:
+            with open(f"/proc/{pid}/task/{task}/children") as children:
+                for child in children.read().split():
+                    total += vm_hwm(child)
+        except OSError:
+            pass
+    return total
+
+
+def wait_until_up(url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} did not start within {timeout} seconds")
+
+
+def start_upstreams(args: argparse.Namespace) -> subprocess.Popen:
+    process = subprocess.Popen([
+        sys.executable, "-m", "benchmarks.fake_upstreams",
+        "--port", str(args.upstream_port),
+        "--latency", str(args.latency),
+        "--jitter", str(args.jitter),
+        "--failure-rate", str(args.failure_rate),
+        "--task-checks", str(args.task_checks),
+        "--document-size", str(args.document_size),
+        "--callback-delay", str(args.callback_delay),
+    ] + (["--reuse-session-id"] if args.reuse_session_id else []), cwd=ROOT)
+    wait_until_up(f"http://127.0.0.1:{args.upstream_port}/get-templates")
+    return process
+
+
+def start_server(args: argparse.Namespace, cache_dir: str) -> subprocess.Popen:
+    upstream = f"http://127.0.0.1:{args.upstream_port}"
+    env = dict(os.environ)
+    env.update({
+        "CHIMBITAS_LAMBDA_URL": upstream,
+        "API_CHIMBITAS_URL": upstream,
+        "LEGAL_DOCS_URL": upstream,
+        "CREATE_DOCUMENT_LAMBDA": f"{upstream}/create-document",
+        "USER_NAME_CHIMBITAS": "benchmark",
+        "USER_ID_CHIMBITAS": "1",
+        "COMPANY_ID_CHIMBITAS": "1",
+        "PASSWORD_CHIMBITAS": "benchmark",
+        "POLL_INITIAL_INTERVAL": str(args.poll_interval),
+        "BLOB_CACHE_DIR": cache_dir,
+    })
+    if args.callbacks:
+        # El secreto viaja en la URL: el upstream falso solo llama a la URL que recibe.
+        env["TASK_CALLBACK_SECRET"] = "benchmark"
+        env["TASK_CALLBACK_URL"] = f"http://127.0.0.1:{args.server_port}/callbacks/task-status?token=benchmark"
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--port", str(args.server_port), "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL if args.quiet else None,
+    )
+    wait_until_up(f"http://127.0.0.1:{args.server_port}/health")
+    return process
+
+
+async def drive(args: argparse.Namespace, scenario: Scenario) -> dict:
+    url = f"http://127.0.0.1:{args.server_port}/{scenario.mount}/mcp"
+    latencies: List[float] = []
+    errors = 0
+    next_request = iter(range(args.requests))
+
+    async def worker():
+        nonlocal errors
+        async with streamablehttp_client(url, timeout=args.timeout) as (read, write, _):
+            async with ClientSession(read, write) as session:
+                await session.initialize()
+                for i in next_request:
+                    started = time.perf_counter()
+                    try:
+                        result = await session.call_tool(scenario.tool, scenario.arguments(args, i))
+                        failed = result.isError
+                    except Exception:
+                        failed = True
+                    latencies.append(time.perf_counter() - started)
+                    errors += failed
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(args.concurrency)])
+    elapsed = time.perf_counter() - started
+    return {
+        "scenario": scenario.name,
+        "requests": len(latencies),
+        "errors": errors,
+        "concurrency": args.concurrency,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "p50_ms": _ms(percentile(latencies, 0.50)),
+        "p95_ms": _ms(percentile(latencies, 0.95)),
+        "p99_ms": _ms(percentile(latencies, 0.99)),
+    }
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return round(seconds * 1000, 2) if seconds is not None else None
+
+
+def run_scenario(args: argparse.Namespace, scenario: Scenario) -> dict:
+    # Un servidor nuevo por escenario: el pico de RSS corresponde solo a esa tool.
+    with tempfile.TemporaryDirectory() as cache_dir:
+        server = start_server(args, cache_dir)
+        try:
+            result = asyncio.run(drive(args, scenario))
+            rss = peak_rss_kib(server.pid)
+            result["peak_rss_mib"] = round(rss / 1024, 1) if rss is not None else None
+            return result
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+
+def print_table(results: List[dict]):
+    columns = ["scenario", "requests", "errors", "throughput_rps", "p50_ms", "p95_ms", "p99_ms", "peak_rss_mib"]
+    widths = [max(len(column), *(len(str(result[column])) for result in results)) for column in columns]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for result in results:
+        print("  ".join(str(result[column]).ljust(width) for column, width in zip(columns, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the MCP tools.")
+    parser.add_argument("--scenarios", default=DEFAULT_SCENARIOS, help=f"Comma separated, from: {', '.join(SCENARIOS)}.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent MCP client sessions.")
+    parser.add_argument("--requests", type=int, default=200, help="Tool calls per scenario.")
+    parser.add_argument("--factorial-n", type=int, default=100_000)
+    parser.add_argument("--files", type=int, default=3, help="Files per create_audit_process request.")
+    parser.add_argument("--latency", type=float, default=0.02, help="Upstream base latency, in seconds.")
+    parser.add_argument("--jitter", type=float, default=0.01, help="Upstream extra random latency, in seconds.")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of upstream requests that fail with 503.")
+    parser.add_argument("--task-checks", type=int, default=2, help="Status checks before an upstream task completes.")
+    parser.add_argument("--document-size", type=int, default=256 * 1024, help="Size in bytes of downloaded documents.")
+    parser.add_argument("--poll-interval", type=float, default=0.2, help="POLL_INITIAL_INTERVAL for the server.")
+    parser.add_argument("--callbacks", action="store_true", help="Have the upstreams push task completion instead of polling.")
+    parser.add_argument("--callback-delay", type=float, default=0.5, help="Seconds until an upstream task with a callback completes.")
+    parser.add_argument("--reuse-session-id", action="store_true", help="Have the upstream ingestion reuse the search session id.")
+    parser.add_argument("--timeout", type=float, default=300, help="Client timeout per call, in seconds.")
+    parser.add_argument("--upstream-port", type=int, default=9100)
+    parser.add_argument("--server-port", type=int, default=9101)
+    parser.add_argument("--json", help="Also write the results to this file.")
+    parser.add_argument("--quiet", action="store_true", help="Hide the server output.")
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    upstreams = start_upstreams(args)
+    results = []
+    try:
+        for name in names:
+            print(f"Running {name}...", file=sys.stderr)
+            results.append(run_scenario(args, SCENARIOS[name]))
+    finally:
+        upstreams.terminate()
+        upstreams.wait(timeout=30)
+
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,18 @@
 from dotenv import load_dotenv
 import os
+import tempfile
 load_dotenv()  # Carga las variables de entorno desde el archivo .env
 
 class Config:
+    # Sub-servidores montados por server.py (solo se importan los habilitados)
+    ENABLED_SERVERS = os.getenv("ENABLED_SERVERS", "math,secret,legaldocs,audit_agent")
+
+    # Modo multi-worker: uvicorn toma el número de workers de WEB_CONCURRENCY. Con más de uno,
+    # token y cachés se comparten en un SQLite local (SHARED_STORE_PATH vacío lo desactiva).
+    WORKERS = int(os.getenv("WEB_CONCURRENCY", 1))
+    SHARED_STORE_PATH = os.getenv("SHARED_STORE_PATH", os.path.join(tempfile.gettempdir(), "mcp_shared_store.sqlite") if WORKERS > 1 else "")
+    WORKER_HEARTBEAT_INTERVAL = float(os.getenv("WORKER_HEARTBEAT_INTERVAL", 5))
+
     LEGAL_DOCS_URL = os.getenv("LEGAL_DOCS_URL")
     CHIMBITAS_LAMBDA_URL = os.getenv("CHIMBITAS_LAMBDA_URL")
     USER_NAME_CHIMBITAS = os.getenv("USER_NAME_CHIMBITAS")
@@ -10,5 +20,147 @@ class Config:
     COMPANY_ID_CHIMBITAS = os.getenv("COMPANY_ID_CHIMBITAS")
     PASSWORD_CHIMBITAS = os.getenv("PASSWORD_CHIMBITAS")
     API_CHIMBITAS_URL = os.getenv("API_CHIMBITAS_URL")
-    
+    CREATE_DOCUMENT_LAMBDA = os.getenv("CREATE_DOCUMENT_LAMBDA")
+
+    # Cache del access token de Chimbitas
+    CHIMBITAS_TOKEN_REFRESH_MARGIN = float(os.getenv("CHIMBITAS_TOKEN_REFRESH_MARGIN", 60))
+    CHIMBITAS_TOKEN_DEFAULT_TTL = float(os.getenv("CHIMBITAS_TOKEN_DEFAULT_TTL", 300))
+    # Tokens de vida muy corta: intervalo mínimo entre renovaciones, duplicado en cada repetición hasta el máximo
+    CHIMBITAS_TOKEN_MIN_REFRESH_INTERVAL = float(os.getenv("CHIMBITAS_TOKEN_MIN_REFRESH_INTERVAL", 5))
+    CHIMBITAS_TOKEN_MAX_REFRESH_BACKOFF = float(os.getenv("CHIMBITAS_TOKEN_MAX_REFRESH_BACKOFF", 300))
+
+    # Pool de conexiones HTTP compartido (uno por upstream)
+    HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", 100))
+    HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", 20))
+    HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 30))
+    HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 10))
+    HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", 60))
+    HTTP_WRITE_TIMEOUT = float(os.getenv("HTTP_WRITE_TIMEOUT", 60))
+    HTTP_POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", 30))
+
+    # Lecturas idempotentes (GET): timeout hasta los headers, reintentos, hedging y circuit breaker
+    HTTP_GET_TIMEOUT = float(os.getenv("HTTP_GET_TIMEOUT", 15))
+    HTTP_RETRY_ATTEMPTS = int(os.getenv("HTTP_RETRY_ATTEMPTS", 3))
+    HTTP_RETRY_BACKOFF = float(os.getenv("HTTP_RETRY_BACKOFF", 0.2))
+    HTTP_RETRY_MAX_BACKOFF = float(os.getenv("HTTP_RETRY_MAX_BACKOFF", 2))
+    HTTP_HEDGE_PERCENTILE = float(os.getenv("HTTP_HEDGE_PERCENTILE", 0.95))
+    HTTP_HEDGE_MIN_SAMPLES = int(os.getenv("HTTP_HEDGE_MIN_SAMPLES", 20))
+    HTTP_HEDGE_DEFAULT_DELAY = float(os.getenv("HTTP_HEDGE_DEFAULT_DELAY", 1))
+    HTTP_HEDGE_MIN_DELAY = float(os.getenv("HTTP_HEDGE_MIN_DELAY", 0.05))
+    CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 5))
+    CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", 30))
+
+    # Polling de /task/status
+    POLL_INITIAL_INTERVAL = float(os.getenv("POLL_INITIAL_INTERVAL", 3))
+    POLL_MAX_INTERVAL = float(os.getenv("POLL_MAX_INTERVAL", 30))
+    POLL_BACKOFF_FACTOR = float(os.getenv("POLL_BACKOFF_FACTOR", 1.5))
+    POLL_JITTER = float(os.getenv("POLL_JITTER", 0.2))
+    POLL_DEADLINE = float(os.getenv("POLL_DEADLINE", 10800))  # 3 horas
+    POLL_MAX_ERRORS = int(os.getenv("POLL_MAX_ERRORS", 3))
+    POLL_MAX_CONCURRENCY = int(os.getenv("POLL_MAX_CONCURRENCY", 20))
+
+    # Callbacks de finalización de tasks: con TASK_CALLBACK_URL (URL pública de /callbacks/task-status)
+    # los upstreams avisan al terminar y el polling queda como respaldo cada POLL_FALLBACK_INTERVAL.
+    # Sin TASK_CALLBACK_URL el endpoint no se registra; con ella TASK_CALLBACK_SECRET es obligatorio.
+    TASK_CALLBACK_URL = os.getenv("TASK_CALLBACK_URL", "")
+    TASK_CALLBACK_SECRET = os.getenv("TASK_CALLBACK_SECRET", "")
+    POLL_FALLBACK_INTERVAL = float(os.getenv("POLL_FALLBACK_INTERVAL", 60))
+    TASK_EVENT_TTL = float(os.getenv("TASK_EVENT_TTL", 600))
+    TASK_EVENT_MAX_ENTRIES = int(os.getenv("TASK_EVENT_MAX_ENTRIES", 10000))
+    TASK_EVENT_RELAY_INTERVAL = float(os.getenv("TASK_EVENT_RELAY_INTERVAL", 1))
+
+    # Concurrencia por etapa al transferir archivos a S3
+    TRANSFER_PRESIGN_CONCURRENCY = int(os.getenv("TRANSFER_PRESIGN_CONCURRENCY", 8))
+    TRANSFER_STREAM_CONCURRENCY = int(os.getenv("TRANSFER_STREAM_CONCURRENCY", 4))
+    TRANSFER_CHUNK_SIZE = int(os.getenv("TRANSFER_CHUNK_SIZE", 64 * 1024))
+
+    # Jobs en segundo plano de create_audit_process
+    AUDIT_JOB_WORKERS = int(os.getenv("AUDIT_JOB_WORKERS", 4))
+    AUDIT_JOB_MAX_RETAINED = int(os.getenv("AUDIT_JOB_MAX_RETAINED", 200))
+    AUDIT_JOB_SNAPSHOT_TTL = float(os.getenv("AUDIT_JOB_SNAPSHOT_TTL", 86400))
+
+    AUDIT_JOB_MAX_PENDING = int(os.getenv("AUDIT_JOB_MAX_PENDING", 100))
+
+    # Control de admisión: "nombre=concurrencia/cola[/llamadas por segundo]"; lo que no cabe en la cola
+    # (o espera más de ADMISSION_QUEUE_TIMEOUT) recibe un error "busy" de inmediato.
+    ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 30))
+    UPSTREAM_LIMITS = os.getenv(
+        "UPSTREAM_LIMITS",
+        "chimbitas_lambda=16/128/20,api_chimbitas=32/256/50,legal_docs=16/128,s3=32/256,external=32/256",
+    )
+    TOOL_LIMITS = os.getenv(
+        "TOOL_LIMITS",
+        "audit_agent.create_audit_process=8/32,audit_agent.resume_audit_process=4/16,"
+        "legaldocs.upload_legal_doc_template=8/32,legaldocs.upload_doc_for_template_completition=8/32,"
+        "legaldocs.upload_docs_for_template_completition=4/16,math.factorial_value=4/32,math.factorial_handle=4/32",
+    )
+
+    # Checkpoints de create_audit_process, para reanudar desde la primera etapa incompleta
+    AUDIT_CHECKPOINT_PATH = os.getenv("AUDIT_CHECKPOINT_PATH", os.path.join(tempfile.gettempdir(), "mcp_audit_checkpoints.sqlite"))
+    AUDIT_CHECKPOINT_TTL = float(os.getenv("AUDIT_CHECKPOINT_TTL", 7 * 86400))
+    # Segundos que un checkpoint sigue reservado por el job de un worker caído
+    AUDIT_CHECKPOINT_LEASE = float(os.getenv("AUDIT_CHECKPOINT_LEASE", 60))
+
+    # Motor de factoriales grandes (math server)
+    FACTORIAL_INLINE_LIMIT = int(os.getenv("FACTORIAL_INLINE_LIMIT", 1000))
+    FACTORIAL_WORKERS = int(os.getenv("FACTORIAL_WORKERS", 2))
+    FACTORIAL_TIMEOUT = float(os.getenv("FACTORIAL_TIMEOUT", 60))
+    FACTORIAL_CACHE_BYTES = int(os.getenv("FACTORIAL_CACHE_BYTES", 64 * 1024 * 1024))
+    FACTORIAL_PAGE_DIGITS = int(os.getenv("FACTORIAL_PAGE_DIGITS", 100_000))
+    FACTORIAL_MAX_RANGE_BYTES = int(os.getenv("FACTORIAL_MAX_RANGE_BYTES", 1024 * 1024))
+
+    # Caché del listado de plantillas de LegalDocs
+    LEGAL_DOCS_TEMPLATES_TTL = float(os.getenv("LEGAL_DOCS_TEMPLATES_TTL", 60))
+    LEGAL_DOCS_TEMPLATES_STALE_TTL = float(os.getenv("LEGAL_DOCS_TEMPLATES_STALE_TTL", 600))
+
+    # Subida en lote de documentos para completar plantillas (tamaño máximo por POST a LegalDocs)
+    LEGAL_DOCS_BATCH_MAX_FILES = int(os.getenv("LEGAL_DOCS_BATCH_MAX_FILES", 50))
+    LEGAL_DOCS_BATCH_MAX_BYTES = int(os.getenv("LEGAL_DOCS_BATCH_MAX_BYTES", 50 * 1024 * 1024))
+    LEGAL_DOCS_BATCH_CONCURRENCY = int(os.getenv("LEGAL_DOCS_BATCH_CONCURRENCY", 4))
+
+    # Caché en disco de documentos descargados (0 bytes la desactiva); cada worker usa su propio
+    # subdirectorio de BLOB_CACHE_DIR y BLOB_CACHE_MAX_BYTES aplica a cada uno.
+    BLOB_CACHE_DIR = os.getenv("BLOB_CACHE_DIR", os.path.join(tempfile.gettempdir(), "mcp_blob_cache"))
+    BLOB_CACHE_MAX_BYTES = int(os.getenv("BLOB_CACHE_MAX_BYTES", 1024 * 1024 * 1024))
+
+    # Caché de listados de sesiones de Chimbitas
+    SESSION_LIST_TTL = float(os.getenv("SESSION_LIST_TTL", 30))
+    SESSION_LIST_STALE_TTL = float(os.getenv("SESSION_LIST_STALE_TTL", 300))
+    SESSION_LIST_MAX_ENTRIES = int(os.getenv("SESSION_LIST_MAX_ENTRIES", 1000))
+
+    # Trazas por etapa de los jobs (OTLP_TRACES_ENDPOINT, p. ej. http://collector:4318/v1/traces)
+    TRACE_MAX_RETAINED = int(os.getenv("TRACE_MAX_RETAINED", 200))
+    TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", 2000))
+    TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "mcp-servers")
+    OTLP_TRACES_ENDPOINT = os.getenv("OTLP_TRACES_ENDPOINT")
+
+    # Logs JSON por línea: se encolan sin bloquear y un hilo aparte los escribe en stdout.
+    # LOG_LEVELS ajusta loggers puntuales ("httpx=WARNING,services.task_poller=DEBUG").
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+    LOG_LEVELS = os.getenv("LOG_LEVELS", "httpx=WARNING,mcp.server.lowlevel.server=WARNING,mcp.server.streamable_http=WARNING,mcp.server.streamable_http_manager=WARNING")
+    LOG_MAX_FIELD_CHARS = int(os.getenv("LOG_MAX_FIELD_CHARS", 500))
+    LOG_MAX_MESSAGE_CHARS = int(os.getenv("LOG_MAX_MESSAGE_CHARS", 4000))
+    LOG_SAMPLE_PER_SECOND = float(os.getenv("LOG_SAMPLE_PER_SECOND", 1))
+    LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+
+    # Arranque en caliente: antes de recibir tráfico se abren los pools, se obtiene el token de
+    # Chimbitas y se llena la caché de plantillas (cada paso acotado por WARM_START_TIMEOUT).
+    WARM_START = os.getenv("WARM_START", "false").lower() in ("1", "true", "yes")
+    WARM_START_TIMEOUT = float(os.getenv("WARM_START_TIMEOUT", 10))
+
+    # /ready: estado de los upstreams sondeado en segundo plano cada READY_PROBE_INTERVAL.
+    # Solo los de READY_REQUIRED_UPSTREAMS (p. ej. "api_chimbitas,chimbitas_lambda") marcan la réplica como no lista.
+    READY_PROBE_INTERVAL = float(os.getenv("READY_PROBE_INTERVAL", 15))
+    READY_PROBE_TIMEOUT = float(os.getenv("READY_PROBE_TIMEOUT", 3))
+    READY_PROBE_PATHS = os.getenv("READY_PROBE_PATHS", "")
+    READY_REQUIRED_UPSTREAMS = os.getenv("READY_REQUIRED_UPSTREAMS", "")
+
+    # Captura de llamadas a tools en JSONL (vacío la desactiva), para reproducirlas con benchmarks/replay.py.
+    # Los valores de claves que coinciden con CAPTURE_REDACT_KEYS y los query strings de URLs se ocultan.
+    CAPTURE_PATH = os.getenv("CAPTURE_PATH", "")
+    CAPTURE_SAMPLE_RATE = float(os.getenv("CAPTURE_SAMPLE_RATE", 1))
+    CAPTURE_REDACT_KEYS = os.getenv("CAPTURE_REDACT_KEYS", "password|secret|token|authorization|api_key|credential|email")
+    CAPTURE_MAX_BODY_BYTES = int(os.getenv("CAPTURE_MAX_BODY_BYTES", 1024 * 1024))
+    CAPTURE_QUEUE_SIZE = int(os.getenv("CAPTURE_QUEUE_SIZE", 10000))
+
 config = Config()
\ No newline at end of file
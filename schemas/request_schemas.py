@@ -22,5 +22,11 @@ class AA_CreateAuditProcessRequest(BaseModel):
     urls_planteamiento_proceso_auditoria: List[FileInfo]
     urls_normativas_proceso: List[FileInfo]
     urls_informes_auditoria: List[FileInfo]
+
+class AA_TaskStatusCallback(BaseModel):
+    session_id: int
+    analysis_type_id: int = 1
+    status: str
+    detail: Optional[dict] = None
     
     
\ No newline at end of file
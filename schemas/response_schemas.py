@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 
 class LD_GetTemplatesResponse(BaseModel):
     templates: List[str]
@@ -17,6 +17,13 @@ class LD_UploadFileTemplateCompletitionResponse(BaseModel):
     success: bool
     result: str
 
+class LD_BatchUploadFileTemplateCompletitionResponse(BaseModel):
+    # Un resultado por archivo, en el mismo orden de la solicitud.
+    results: List[LD_UploadFileTemplateCompletitionResponse]
+    uploaded: int
+    failed: int
+    requests: int
+
 class AA_SessionsResponseItem(BaseModel):
     session_id: int
     company_id: int
@@ -34,4 +41,42 @@ class AA_SessionsResponseItem(BaseModel):
 
 class AA_GetParentSessionFromUserResponse(BaseModel):
     message: str
-    sessions: List[AA_SessionsResponseItem]
\ No newline at end of file
+    sessions: List[AA_SessionsResponseItem]
+
+class AA_AuditJobStage(BaseModel):
+    name: str
+    status: str
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+    duration_seconds: Optional[float] = None
+    detail: Dict[str, Any] = {}
+
+class AA_AuditJobStatusResponse(BaseModel):
+    job_id: str
+    kind: str
+    status: str
+    current_stage: Optional[str] = None
+    completed_stages: int
+    total_stages: int
+    stages: List[AA_AuditJobStage]
+    result: Optional[str] = None
+    error: Optional[str] = None
+    detail: Dict[str, Any] = {}
+    created_at: str
+    updated_at: str
+    worker_id: Optional[str] = None
+
+class AA_ListAuditJobsResponse(BaseModel):
+    jobs: List[AA_AuditJobStatusResponse]
+
+
+class MT_FactorialHandleResponse(BaseModel):
+    n: int
+    digits: int
+    bytes: int
+    page_digits: int
+    pages: int
+    leading_digits: str
+    trailing_digits: str
+    digits_uri_template: str
+    bytes_uri_template: str
@@ -1,30 +1,123 @@
+import time
+STARTED = time.perf_counter()
+
+import asyncio
 import contextlib
-from fastapi import FastAPI
-from app.v1.math_server import mcp as math_mcp
-from app.v1.secret_server import mcp as secret_mcp
-from app.v1.legaldocs_server import mcp as legaldocs_mcp
-from app.v1.audit_agent_server import mcp as audit_agent_mcp
+import logging
+from fastapi import FastAPI, HTTPException, Response
+from app.registry import enabled_servers, process_age_seconds
+from config import config
+from services.admission import admission_stats, limit_tools
+from services.capture import CaptureMiddleware, traffic_capture
+from services.log import RequestIdMiddleware, configure_logging, correlate_tools
+from services.metrics import instrument_tools, mark_process_dead, render_metrics, tool_calls_in_flight
+from services.readiness import readiness
+from services.shared_store import shared_store
+from services.tracing import tracer
+from services.worker_status import WORKER_ID, local_status, register_load, worker_heartbeat
 import os
 from datetime import datetime
 
 PORT = int(os.environ.get("PORT", 8001))
 
+# Antes de importar los sub-servidores, para que sus logs también salgan en JSON.
+configure_logging()
+logger = logging.getLogger("server")
+
+# Solo se importan los sub-servidores habilitados en ENABLED_SERVERS.
+servers = [server.load() for server in enabled_servers()]
+for server in servers:
+    limit_tools(server.mcp, server.name)
+    instrument_tools(server.mcp, server.name)
+    correlate_tools(server.mcp, server.name)
+register_load("tool_calls_in_flight", tool_calls_in_flight)
+
+# Upstreams de los sub-servidores habilitados: solo ellos tienen cliente y sondeo de readiness.
+upstreams = list(dict.fromkeys(name for server in servers for name in server.upstreams))
+if upstreams:
+    from services import http_clients
+else:
+    http_clients = None
+
+startup = {
+    "import_seconds": round(time.perf_counter() - STARTED, 4),
+    "server_import_seconds": {server.name: server.import_seconds for server in servers},
+    "lifespan_seconds": None,
+    "warm_start_seconds": None,
+    "process_ready_seconds": None,
+}
+
 @contextlib.asynccontextmanager
 async def lifespan(app: FastAPI):
+    lifespan_started = time.perf_counter()
     async with contextlib.AsyncExitStack() as stack:
-        await stack.enter_async_context(math_mcp.session_manager.run())
-        await stack.enter_async_context(secret_mcp.session_manager.run())
-        await stack.enter_async_context(legaldocs_mcp.session_manager.run())
-        await stack.enter_async_context(audit_agent_mcp.session_manager.run())
+        stack.callback(mark_process_dead)
+        stack.callback(shared_store.close)
+        stack.callback(traffic_capture.close)
+        if http_clients is not None:
+            await http_clients.open_clients(upstreams)
+            stack.push_async_callback(http_clients.close_clients)
+        for server in servers:
+            await stack.enter_async_context(server.mcp.session_manager.run())
+        for server in servers:
+            stack.push_async_callback(server.shutdown)
+        stack.push_async_callback(tracer.close)
+        await worker_heartbeat.start()
+        stack.push_async_callback(worker_heartbeat.close)
+        warm_started = time.perf_counter()
+        # Con WARM_START la primera ronda de sondeos (que abre una conexión por upstream) y
+        # los warm_up de los sub-servidores terminan antes de aceptar tráfico.
+        warm_ups = [readiness.start(upstreams, wait=config.WARM_START)]
+        if config.WARM_START:
+            warm_ups += [readiness.warm_up(server.name, server.warm_up, config.WARM_START_TIMEOUT) for server in servers if server.has_warm_up]
+        await asyncio.gather(*warm_ups)
+        stack.push_async_callback(readiness.close)
+        if config.WARM_START:
+            startup["warm_start_seconds"] = round(time.perf_counter() - warm_started, 4)
+        startup["lifespan_seconds"] = round(time.perf_counter() - lifespan_started, 4)
+        startup["process_ready_seconds"] = process_age_seconds()
+        logger.info("Servers %s ready", [server.name for server in servers], extra={"startup": startup})
         yield
 
 app = FastAPI(lifespan=lifespan)
+if traffic_capture.enabled:
+    app.add_middleware(CaptureMiddleware)
+# El último agregado envuelve a los demás: el request id ya está asignado al capturar.
+app.add_middleware(RequestIdMiddleware)
 
 @app.get("/health")
 async def root():
-    return {"message": "Welcome to the Multi-Model API Server!", "api_version": "1.1.0", "fecha": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+    return {"message": "Welcome to the Multi-Model API Server!", "api_version": "1.1.0", "fecha": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "servers": [server.name for server in servers], "startup": startup, "worker": local_status(), "workers": await worker_heartbeat.workers(), "circuits": http_clients.circuit_states() if http_clients is not None else {}, "admission": admission_stats()}
+
+@app.get("/ready")
+async def ready(response: Response):
+    """
+        Readiness probe for orchestrators. Answers from the last background upstream checks
+        and never contacts the upstreams itself; 503 while a READY_REQUIRED_UPSTREAMS
+        upstream is unreachable or has not been checked recently.
+    """
+    status = readiness.status()
+    if not status["ready"]:
+        response.status_code = 503
+    return {"worker_id": WORKER_ID, **status}
+
+@app.get("/metrics")
+async def metrics():
+    body, content_type = render_metrics()
+    return Response(body, media_type=content_type)
+
+@app.get("/traces")
+async def list_traces():
+    return [trace.summary() for trace in tracer.list()]
+
+@app.get("/traces/{trace_id}")
+async def get_trace(trace_id: str, format: str = "json"):
+    trace = tracer.get(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return trace.to_otlp() if format == "otlp" else trace.to_dict()
 
-app.mount("/math", math_mcp.streamable_http_app())
-app.mount("/secret", secret_mcp.streamable_http_app())
-app.mount("/legaldocs", legaldocs_mcp.streamable_http_app())
-app.mount("/audit_agent", audit_agent_mcp.streamable_http_app())
\ No newline at end of file
+for server in servers:
+    if server.router is not None:
+        app.include_router(server.router)
+    app.mount(server.mount, server.mcp.streamable_http_app())
@@ -0,0 +1,214 @@
+import asyncio
+import collections
+import contextlib
+import functools
+import inspect
+import logging
+import time
+from typing import Deque, Dict, Optional
+
+from config import config
+from services.metrics import ADMISSION_IN_FLIGHT, ADMISSION_QUEUED, ADMISSION_REJECTED, ADMISSION_WAIT
+
+logger = logging.getLogger(__name__)
+
+
+class Busy(Exception):
+    """
+        Raised when a gate's queue is full or a queued call waited longer than its timeout.
+        Callers should back off and retry later.
+    """
+
+
+class GateSettings:
+    def __init__(self, concurrency: int, max_queue: int, rate: Optional[float] = None):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.rate = rate
+
+
+def parse_limits(spec: str) -> Dict[str, GateSettings]:
+    """
+        Parses "name=concurrency/queue[/rate],..." (rate in calls per second) as used by
+        UPSTREAM_LIMITS and TOOL_LIMITS.
+    """
+    limits = {}
+    for entry in spec.split(","):
+        if not entry.strip():
+            continue
+        name, _, values = entry.partition("=")
+        parts = values.split("/")
+        if len(parts) not in (2, 3):
+            raise ValueError(f"Invalid limit '{entry.strip()}', expected name=concurrency/queue[/rate]")
+        rate = float(parts[2]) if len(parts) == 3 else None
+        limits[name.strip()] = GateSettings(int(parts[0]), int(parts[1]), rate)
+    return limits
+
+
+class TokenBucket:
+    """
+        Allows `rate` acquisitions per second on average, with bursts of up to `burst`.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+
+    async def acquire(self, deadline: float) -> bool:
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            wait = (1 - self._tokens) / self.rate
+            if now + wait > deadline:
+                return False
+            await asyncio.sleep(wait)
+
+
+class AdmissionGate:
+    """
+        Admits at most `concurrency` calls at once. Further calls wait in a FIFO queue of at
+        most `max_queue` entries for up to `timeout` seconds; beyond that they get Busy at
+        once instead of piling up. With a `rate`, admitted calls are also paced by a token
+        bucket (bursts of up to `concurrency`).
+    """
+
+    def __init__(self, name: str, settings: GateSettings, timeout: float):
+        self.name = name
+        self.concurrency = max(1, settings.concurrency)
+        self.max_queue = max(0, settings.max_queue)
+        self.timeout = timeout
+        self.bucket = TokenBucket(settings.rate, self.concurrency) if settings.rate else None
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.wait_seconds_total = 0.0
+        self.max_wait_seconds = 0.0
+        self._waiters: Deque[asyncio.Future] = collections.deque()
+
+    async def acquire(self):
+        started = time.monotonic()
+        if self.in_flight < self.concurrency and not self._waiters:
+            self.in_flight += 1
+        else:
+            if len(self._waiters) >= self.max_queue:
+                self._reject("queue_full")
+                raise Busy(f"{self.name} is busy ({self.in_flight} running, {len(self._waiters)} queued); retry later")
+            await self._wait_for_slot()
+        ADMISSION_IN_FLIGHT.labels(self.name).inc()
+        if self.bucket is not None and not await self.bucket.acquire(started + self.timeout):
+            self.release()
+            self._reject("rate")
+            raise Busy(f"{self.name} is rate limited; retry later")
+        waited = time.monotonic() - started
+        self.admitted += 1
+        self.wait_seconds_total += waited
+        self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        ADMISSION_WAIT.labels(self.name).observe(waited)
+
+    def release(self):
+        ADMISSION_IN_FLIGHT.labels(self.name).dec()
+        # El cupo pasa directo al siguiente en la cola, sin dejar que otro se adelante.
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    @contextlib.asynccontextmanager
+    async def admit(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "concurrency": self.concurrency,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "avg_wait_seconds": round(self.wait_seconds_total / self.admitted, 4) if self.admitted else 0.0,
+            "max_wait_seconds": round(self.max_wait_seconds, 4),
+        }
+
+    async def _wait_for_slot(self):
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        ADMISSION_QUEUED.labels(self.name).inc()
+        try:
+            await asyncio.wait_for(waiter, self.timeout)
+        except asyncio.TimeoutError:
+            self._reject("timeout")
+            raise Busy(f"{self.name} is busy: no slot within {self.timeout} seconds; retry later")
+        except BaseException:
+            # Cancelado justo después de recibir el cupo: se devuelve para no perderlo.
+            if waiter.done() and not waiter.cancelled():
+                ADMISSION_IN_FLIGHT.labels(self.name).inc()
+                self.release()
+            raise
+        finally:
+            ADMISSION_QUEUED.labels(self.name).dec()
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def _reject(self, reason: str):
+        self.rejected += 1
+        ADMISSION_REJECTED.labels(self.name, reason).inc()
+
+
+_gates: Dict[str, AdmissionGate] = {}
+
+
+def gate(name: str, settings: Optional[GateSettings]) -> Optional[AdmissionGate]:
+    """
+        The shared gate called `name`, created on first use; None when there is no limit.
+    """
+    if settings is None:
+        return None
+    if name not in _gates:
+        _gates[name] = AdmissionGate(name, settings, config.ADMISSION_QUEUE_TIMEOUT)
+    return _gates[name]
+
+
+def admission_stats() -> Dict[str, dict]:
+    return {name: gate.stats() for name, gate in _gates.items()}
+
+
+def limit_tools(mcp, server: str):
+    """
+        Puts the async tools listed in TOOL_LIMITS as "<server>.<tool>" behind their own
+        gate, so a burst of one heavy tool queues (or is rejected) without taking slots,
+        upstream capacity or event loop time from the other tools. Call before
+        instrument_tools so the recorded latency includes the queueing.
+    """
+    limits = parse_limits(config.TOOL_LIMITS)
+    for tool in mcp._tool_manager.list_tools():
+        settings = limits.get(f"{server}.{tool.name}")
+        if settings is None or getattr(tool.fn, "__admission__", False):
+            continue
+        if not tool.is_async:
+            # Las tools síncronas corren de una en una dentro del event loop: no hay nada que encolar.
+            logger.warning("TOOL_LIMITS: %s.%s is synchronous and is not limited", server, tool.name)
+            continue
+        tool.fn = _limited(tool.fn, gate(f"tool:{server}.{tool.name}", settings))
+
+
+def _limited(fn, tool_gate: AdmissionGate):
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        async with tool_gate.admit():
+            return await fn(*args, **kwargs)
+
+    wrapper.__admission__ = True
+    wrapper.__signature__ = inspect.signature(fn)
+    return wrapper
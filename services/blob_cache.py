@@ -0,0 +1,295 @@
+import asyncio
+import hashlib
+import itertools
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from config import config
+
+try:
+    import fcntl
+except ImportError:  # Windows: un directorio por pid.
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Descargas a medio escribir de procesos que ya no existen; las más recientes pueden ser de otro proceso activo.
+PARTIAL_MAX_AGE = 3600
+# El índice se reescribe como mucho una vez por este intervalo, fuera del event loop.
+INDEX_SAVE_DELAY = 1.0
+
+
+class CachedDocument:
+    """
+        A URL whose body is stored as blob `sha256`, with the validators the upstream sent.
+    """
+
+    def __init__(self, sha256: str, size: int, etag: Optional[str] = None, last_modified: Optional[str] = None):
+        self.sha256 = sha256
+        self.size = size
+        self.etag = etag
+        self.last_modified = last_modified
+
+    def conditional_headers(self) -> Dict[str, str]:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def to_dict(self) -> dict:
+        return {"sha256": self.sha256, "size": self.size, "etag": self.etag, "last_modified": self.last_modified}
+
+
+class BlobWriter:
+    """
+        Copies a download into the cache while it streams. The blob is only published by
+        `commit()` once exactly `expected_size` bytes went through (or any amount when the
+        size was unknown); otherwise it is thrown away.
+    """
+
+    def __init__(self, cache: "BlobCache", url: str, etag: Optional[str], last_modified: Optional[str], expected_size: Optional[int]):
+        self.cache = cache
+        self.url = url
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expected_size = expected_size
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._file = tempfile.NamedTemporaryFile(dir=cache.directory, prefix=_partial_prefix(), delete=False)
+
+    def write(self, chunk: bytes):
+        self._file.write(chunk)
+        self._hash.update(chunk)
+        self.size += len(chunk)
+
+    async def tee(self, chunks):
+        async for chunk in chunks:
+            self.write(chunk)
+            yield chunk
+
+    def commit(self):
+        self._file.close()
+        if self.expected_size is not None and self.size != self.expected_size:
+            self.discard()
+            return
+        self.cache._publish(self.url, self._file.name, CachedDocument(self._hash.hexdigest(), self.size, self.etag, self.last_modified))
+
+    def discard(self):
+        self._file.close()
+        if os.path.exists(self._file.name):
+            os.remove(self._file.name)
+
+
+class BlobCache:
+    """
+        Content-addressed on-disk cache of downloaded documents. Bodies are stored once per
+        SHA-256, so the same file reached through different URLs or tools takes the space of
+        one copy; URLs map to blobs together with their ETag/Last-Modified so a conditional
+        GET answered with 304 is served from disk. Blobs are evicted least recently used
+        first once the total size passes `max_bytes`.
+
+        The index lives in memory, so each worker process keeps its own cache: it claims
+        the first free `slot-N` subdirectory of `directory` under a flock held while the
+        process runs. Slots are reused after restarts and never shared by two processes.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.base_directory = directory
+        self.directory = directory
+        self._slot_fd: Optional[int] = None
+        self.max_bytes = max_bytes
+        self._urls: Dict[str, CachedDocument] = {}
+        self._blobs: "OrderedDict[str, int]" = OrderedDict()
+        self._counters = {"hits": 0, "misses": 0, "stored": 0, "evicted": 0}
+        self._loaded = False
+        self._save_scheduled = False
+        self._write_lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(self._blobs.values())
+
+    def lookup(self, url: str) -> Optional[CachedDocument]:
+        if not self.enabled:
+            return None
+        self._load()
+        return self._urls.get(url)
+
+    def open(self, document: CachedDocument):
+        """
+            Opens the blob of a revalidated document and marks it as recently used. Returns
+            None when the blob is gone (evicted meanwhile or removed from disk); the caller
+            should forget the URL and download it again.
+        """
+        try:
+            file = open(self._blob_path(document.sha256), "rb")
+        except FileNotFoundError:
+            self._drop_blob(document.sha256)
+            self._schedule_save()
+            return None
+        self._counters["hits"] += 1
+        if document.sha256 in self._blobs:
+            self._blobs.move_to_end(document.sha256)
+            self._schedule_save()
+        return file
+
+    def writer(self, url: str, headers, expected_size: Optional[int]) -> Optional[BlobWriter]:
+        """
+            Returns a writer for a 200 response, or None when the response cannot be
+            revalidated later (no ETag nor Last-Modified) or does not fit in the cache.
+        """
+        if not self.enabled:
+            return None
+        self._counters["misses"] += 1
+        etag, last_modified = headers.get("ETag"), headers.get("Last-Modified")
+        if not etag and not last_modified:
+            return None
+        if expected_size is not None and expected_size > self.max_bytes:
+            return None
+        self._load()
+        return BlobWriter(self, url, etag, last_modified, expected_size)
+
+    def forget(self, url: str):
+        self._load()
+        if self._urls.pop(url, None) is not None:
+            self._schedule_save()
+
+    def flush(self):
+        """
+            Writes the index now; used on shutdown so the last hits are not lost.
+        """
+        if self._loaded:
+            self._write_index(self._index())
+
+    def stats(self) -> dict:
+        return {"documents": len(self._urls), "blobs": len(self._blobs), "bytes": self.total_bytes, **self._counters}
+
+    def _blob_path(self, sha256: str) -> str:
+        return os.path.join(self.directory, sha256)
+
+    def _index_path(self) -> str:
+        return os.path.join(self.directory, "index.json")
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        self.directory = self._claim_directory()
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            with open(self._index_path()) as file:
+                index = json.load(file)
+        except (OSError, ValueError):
+            index = {"blobs": [], "urls": {}}
+        # Solo sobreviven los blobs que siguen en disco.
+        for sha256 in index.get("blobs", []):
+            path = self._blob_path(sha256)
+            if os.path.exists(path):
+                self._blobs[sha256] = os.path.getsize(path)
+        for url, document in index.get("urls", {}).items():
+            if document.get("sha256") in self._blobs:
+                self._urls[url] = CachedDocument(**document)
+        self._remove_abandoned_partials()
+
+    def _claim_directory(self) -> str:
+        os.makedirs(self.base_directory, exist_ok=True)
+        if fcntl is None:
+            return os.path.join(self.base_directory, f"worker-{os.getpid()}")
+        for slot in itertools.count():
+            fd = os.open(os.path.join(self.base_directory, f"slot-{slot}.lock"), os.O_CREAT | os.O_RDWR, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+            # El lock se mantiene abierto hasta que termina el proceso.
+            self._slot_fd = fd
+            return os.path.join(self.base_directory, f"slot-{slot}")
+
+    def _remove_abandoned_partials(self):
+        # Solo las propias o las abandonadas: otro proceso puede estar escribiendo las suyas.
+        now = time.time()
+        for name in os.listdir(self.directory):
+            if not name.startswith("partial-"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if name.startswith(_partial_prefix()) or now - os.path.getmtime(path) > PARTIAL_MAX_AGE:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def _publish(self, url: str, partial_path: str, document: CachedDocument):
+        if document.sha256 in self._blobs:
+            os.remove(partial_path)
+        else:
+            os.replace(partial_path, self._blob_path(document.sha256))
+            self._blobs[document.sha256] = document.size
+            self._counters["stored"] += 1
+        self._blobs.move_to_end(document.sha256)
+        self._urls[url] = document
+        self._evict()
+        self._schedule_save()
+
+    def _evict(self):
+        total = self.total_bytes
+        while total > self.max_bytes and self._blobs:
+            sha256, size = next(iter(self._blobs.items()))
+            total -= size
+            self._counters["evicted"] += 1
+            self._drop_blob(sha256)
+            path = self._blob_path(sha256)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _drop_blob(self, sha256: str):
+        self._blobs.pop(sha256, None)
+        for url in [url for url, document in self._urls.items() if document.sha256 == sha256]:
+            del self._urls[url]
+
+    def _index(self) -> dict:
+        return {"blobs": list(self._blobs), "urls": {url: document.to_dict() for url, document in self._urls.items()}}
+
+    def _schedule_save(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._write_index(self._index())
+            return
+        if not self._save_scheduled:
+            self._save_scheduled = True
+            loop.call_later(INDEX_SAVE_DELAY, self._start_save)
+
+    def _start_save(self):
+        self._save_scheduled = False
+        # La copia se toma en el event loop; el archivo se escribe en un hilo.
+        asyncio.ensure_future(asyncio.to_thread(self._write_index, self._index()))
+
+    def _write_index(self, index: dict):
+        partial = f"{self._index_path()}.{os.getpid()}.tmp"
+        try:
+            with self._write_lock:
+                with open(partial, "w") as file:
+                    json.dump(index, file)
+                os.replace(partial, self._index_path())
+        except OSError as e:
+            logger.warning("Error saving blob cache index: %s", e)
+
+
+def _partial_prefix() -> str:
+    return f"partial-{os.getpid()}-"
+
+
+blob_cache = BlobCache(config.BLOB_CACHE_DIR, config.BLOB_CACHE_MAX_BYTES)
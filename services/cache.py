@@ -0,0 +1,183 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from services.shared_store import SharedStore
+
+logger = logging.getLogger(__name__)
+
+
+class CacheEntry:
+    def __init__(self, value: Any, etag: Optional[str] = None, fetched_at: Optional[float] = None):
+        self.value = value
+        self.etag = etag
+        # Hora de reloj (no monotónica) para que la edad tenga sentido entre procesos.
+        self.fetched_at = fetched_at if fetched_at is not None else time.time()
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.fetched_at
+
+
+# Valor que devuelve un loader cuando el upstream responde 304 Not Modified.
+NOT_MODIFIED = object()
+
+
+class AsyncTTLCache:
+    """
+        In-memory cache for upstream reads. Entries younger than `ttl` are served as they are;
+        entries up to `ttl + stale_ttl` old are served immediately while a background refresh
+        runs (stale-while-revalidate). Concurrent misses for the same key share one load.
+
+        `loader(previous_entry)` returns the value, a CacheEntry (to keep an ETag with it) or
+        NOT_MODIFIED, which keeps the previous value and restarts its TTL (conditional
+        requests with ETag/If-None-Match).
+
+        With an enabled `store` the entries live in the shared store instead, so every worker
+        process sees the same values and invalidations. Values must then be JSON. An
+        invalidation also replaces the key's version in the store, so a load that was already
+        running in another worker does not write its value back.
+    """
+
+    def __init__(self, name: str, ttl: float, stale_ttl: float = 0, max_entries: Optional[int] = None,
+                 store: Optional[SharedStore] = None):
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.store = store if store is not None and store.enabled else None
+        self._entries: Dict[Hashable, CacheEntry] = {}
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        # Cargas en curso de claves invalidadas: terminan, pero su resultado no se guarda.
+        self._stale_loads: set = set()
+        self._counters = {"hits": 0, "stale_hits": 0, "misses": 0, "not_modified": 0, "errors": 0}
+
+    async def get(self, key: Hashable, loader: Callable[[Optional[CacheEntry]], Awaitable[Any]]) -> Any:
+        entry = await self._lookup(key)
+        if entry is not None and entry.age < self.ttl:
+            self._counters["hits"] += 1
+            return entry.value
+        if entry is not None and entry.age < self.ttl + self.stale_ttl:
+            self._counters["stale_hits"] += 1
+            self._refresh(key, loader, entry)
+            return entry.value
+        self._counters["misses"] += 1
+        return (await asyncio.shield(self._refresh(key, loader, entry))).value
+
+    async def invalidate(self, key: Optional[Hashable] = None):
+        """
+            Drops one key (or everything). Loads of that key already in flight, in this or
+            (with a store) any other worker, are not stored afterwards.
+        """
+        if key is None:
+            await self.invalidate_where(lambda _: True)
+            return
+        self._entries.pop(key, None)
+        self._discard_load(key)
+        if self.store is not None:
+            await self._invalidate_shared([key])
+
+    async def invalidate_where(self, predicate: Callable[[Hashable], bool]):
+        """
+            Drops every key for which `predicate(key)` is true.
+        """
+        for key in [key for key in self._entries if predicate(key)]:
+            del self._entries[key]
+        inflight = [key for key in self._inflight if predicate(key)]
+        for key in inflight:
+            self._discard_load(key)
+        if self.store is not None:
+            prefix = self._shared_key_prefix()
+            shared_keys = [_decode_key(shared_key[len(prefix):]) for shared_key, _ in await self.store.items(prefix)]
+            await self._invalidate_shared(list(dict.fromkeys([key for key in shared_keys if predicate(key)] + inflight)))
+
+    def stats(self) -> dict:
+        return {"name": self.name, "entries": len(self._entries), **self._counters}
+
+    async def close(self):
+        tasks = list(self._inflight.values())
+        self._inflight.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _discard_load(self, key: Hashable):
+        task = self._inflight.pop(key, None)
+        if task is not None:
+            self._stale_loads.add(task)
+
+    async def _invalidate_shared(self, keys: list):
+        if not keys:
+            return
+        await self.store.delete(*[self._shared_key(key) for key in keys])
+        for key in keys:
+            await self.store.set(self._version_key(key), uuid.uuid4().hex, self.ttl + self.stale_ttl)
+
+    async def _shared_version(self, key: Hashable) -> Optional[str]:
+        version = await self.store.get(self._version_key(key))
+        return version.value if version is not None else None
+
+    def _refresh(self, key: Hashable, loader, entry: Optional[CacheEntry]) -> asyncio.Task:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._load(key, loader, entry))
+            # Los refrescos en segundo plano pueden fallar sin que nadie los espere.
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._inflight[key] = task
+        return task
+
+    async def _lookup(self, key: Hashable) -> Optional[CacheEntry]:
+        if self.store is None:
+            return self._entries.get(key)
+        shared = await self.store.get(self._shared_key(key))
+        if shared is None:
+            return None
+        return CacheEntry(shared.value, shared.etag, shared.stored_at)
+
+    def _shared_key_prefix(self) -> str:
+        return f"cache:{self.name}:"
+
+    def _shared_key(self, key: Hashable) -> str:
+        return self._shared_key_prefix() + json.dumps(key)
+
+    def _version_key(self, key: Hashable) -> str:
+        return f"cache_version:{self.name}:{json.dumps(key)}"
+
+    async def _load(self, key: Hashable, loader, entry: Optional[CacheEntry]) -> CacheEntry:
+        task = asyncio.current_task()
+        try:
+            version = await self._shared_version(key) if self.store is not None else None
+            loaded = await loader(entry)
+        except Exception as e:
+            self._counters["errors"] += 1
+            logger.warning("Cache %s: refresh of %r failed: %s", self.name, key, e)
+            raise
+        finally:
+            if self._inflight.get(key) is task:
+                del self._inflight[key]
+            stale = task in self._stale_loads
+            self._stale_loads.discard(task)
+        if loaded is NOT_MODIFIED:
+            self._counters["not_modified"] += 1
+            loaded = CacheEntry(entry.value, entry.etag)
+        elif not isinstance(loaded, CacheEntry):
+            loaded = CacheEntry(loaded)
+        if stale:
+            return loaded
+        # Reinsertar deja las entradas ordenadas de la más antigua a la más reciente.
+        self._entries.pop(key, None)
+        self._entries[key] = loaded
+        if self.max_entries is not None and len(self._entries) > self.max_entries:
+            del self._entries[next(iter(self._entries))]
+        if self.store is not None and await self._shared_version(key) == version:
+            await self.store.set(self._shared_key(key), loaded.value, self.ttl + self.stale_ttl, loaded.etag, loaded.fetched_at)
+        return loaded
+
+
+def _decode_key(encoded: str) -> Hashable:
+    # JSON convierte las tuplas en listas.
+    key = json.loads(encoded)
+    return tuple(key) if isinstance(key, list) else key
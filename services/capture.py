@@ -0,0 +1,174 @@
+import json
+import logging
+import queue
+import random
+import re
+import threading
+import time
+from typing import Any, Optional
+
+from config import config
+from services.log import request_id
+from services.worker_status import WORKER_ID
+
+logger = logging.getLogger(__name__)
+
+REDACTED = "[REDACTED]"
+# Las URLs prefirmadas llevan la firma en el query string.
+_URL_QUERY = re.compile(r"^(https?://[^?#\s]+)\?\S*$")
+_STOP = object()
+
+
+def redact(value: Any, keys: re.Pattern) -> tuple:
+    """
+        Copy of `value` with the values of secret-looking keys and the query strings of URLs
+        replaced by "[REDACTED]". Returns (copy, whether anything was redacted).
+    """
+    if isinstance(value, dict):
+        redacted, changed = {}, False
+        for key, item in value.items():
+            if keys.search(str(key)):
+                redacted[key], changed = REDACTED, True
+            else:
+                redacted[key], item_changed = redact(item, keys)
+                changed = changed or item_changed
+        return redacted, changed
+    if isinstance(value, list):
+        items = [redact(item, keys) for item in value]
+        return [item for item, _ in items], any(changed for _, changed in items)
+    if isinstance(value, str):
+        match = _URL_QUERY.match(value)
+        if match:
+            return f"{match.group(1)}?{REDACTED}", True
+    return value, False
+
+
+class TrafficCapture:
+    """
+        Appends one JSON line per MCP tool call to `path`. Lines are queued and written by a
+        background thread, so capturing never blocks the event loop; when the queue is full
+        the record is dropped and counted. Several workers can share the file: each line is
+        a single append.
+
+        An empty path disables the capture.
+    """
+
+    def __init__(self, path: str, sample_rate: float, redact_keys: str, max_body_bytes: int, queue_size: int):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.redact_keys = re.compile(redact_keys, re.IGNORECASE)
+        self.max_body_bytes = max_body_bytes
+        self.dropped = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def sampled(self) -> bool:
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def record(self, entry: dict):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._write, name="traffic-capture", daemon=True)
+            self._thread.start()
+        try:
+            self._queue.put_nowait(json.dumps(entry, default=str, ensure_ascii=False) + "\n")
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _write(self):
+        with open(self.path, "ab", buffering=0) as file:
+            while True:
+                line = self._queue.get()
+                if line is _STOP:
+                    return
+                try:
+                    file.write(line.encode("utf-8"))
+                except OSError as e:
+                    logger.warning("Error writing traffic capture: %s", e, extra={"sample": "capture_error"})
+
+
+class CaptureMiddleware:
+    """
+        ASGI middleware that records the tools/call requests posted to the mounted MCP
+        servers (`/<mount>/mcp`): tool, redacted arguments, latency until the response
+        ends, HTTP status, response size and whether the tool reported an error. The
+        request body is copied as it streams through and parsed only after the response
+        has been sent. benchmarks/replay.py re-issues the captured calls.
+    """
+
+    def __init__(self, app, capture: "TrafficCapture" = None):
+        self.app = app
+        self.capture = capture or traffic_capture
+
+    async def __call__(self, scope, receive, send):
+        path = scope.get("path", "").rstrip("/")
+        if scope["type"] != "http" or scope.get("method") != "POST" or not path.endswith("/mcp") or not self.capture.sampled():
+            return await self.app(scope, receive, send)
+        body = bytearray()
+        response = {"status": None, "bytes": 0, "is_error": False}
+        started_at = time.time()
+        started = time.perf_counter()
+
+        async def capture_receive():
+            message = await receive()
+            if message["type"] == "http.request" and len(body) <= self.capture.max_body_bytes:
+                body.extend(message.get("body", b""))
+            return message
+
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                chunk = message.get("body", b"")
+                response["bytes"] += len(chunk)
+                response["is_error"] = response["is_error"] or b'"isError":true' in chunk
+            await send(message)
+
+        try:
+            await self.app(scope, capture_receive, capture_send)
+        finally:
+            self._record(path, bytes(body), response, started_at, time.perf_counter() - started)
+
+    def _record(self, path: str, body: bytes, response: dict, started_at: float, seconds: float):
+        if len(body) > self.capture.max_body_bytes:
+            return
+        try:
+            messages = json.loads(body)
+        except ValueError:
+            return
+        for message in messages if isinstance(messages, list) else [messages]:
+            if not isinstance(message, dict) or message.get("method") != "tools/call":
+                continue
+            params = message.get("params") or {}
+            arguments, redacted = redact(params.get("arguments") or {}, self.capture.redact_keys)
+            self.capture.record({
+                "ts": round(started_at, 6),
+                "mount": path[:-len("/mcp")].strip("/"),
+                "tool": params.get("name"),
+                "arguments": arguments,
+                "redacted": redacted,
+                "duration_ms": round(seconds * 1000, 3),
+                "status": response["status"],
+                "response_bytes": response["bytes"],
+                "is_error": response["is_error"],
+                "request_id": request_id.get(),
+                "worker_id": WORKER_ID,
+            })
+
+
+traffic_capture = TrafficCapture(
+    config.CAPTURE_PATH,
+    sample_rate=config.CAPTURE_SAMPLE_RATE,
+    redact_keys=config.CAPTURE_REDACT_KEYS,
+    max_body_bytes=config.CAPTURE_MAX_BODY_BYTES,
+    queue_size=config.CAPTURE_QUEUE_SIZE,
+)
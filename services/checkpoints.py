@@ -0,0 +1,142 @@
+import asyncio
+import contextlib
+import hashlib
+import json
+import logging
+from typing import Any, Awaitable, Dict, Optional, Tuple
+
+from config import config
+from services.shared_store import SharedStore
+
+logger = logging.getLogger(__name__)
+
+
+def checkpoint_id_for(payload: dict) -> str:
+    """
+        Stable id of a request: the same payload always maps to the same checkpoint.
+    """
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:32]
+
+
+class Checkpoint:
+    """
+        The completed stages of one pipeline run, each stored as a JSON value under its
+        stage name, so a later run can skip them. A failed write is logged and ignored:
+        checkpoints only save work, they never fail the pipeline.
+    """
+
+    def __init__(self, store: SharedStore, checkpoint_id: str, ttl: float):
+        self.store = store
+        self.id = checkpoint_id
+        self.ttl = ttl
+        self.stages: Dict[str, Any] = {}
+
+    @property
+    def _prefix(self) -> str:
+        return f"checkpoint:{self.id}:"
+
+    async def load(self) -> "Checkpoint":
+        self.stages = {key[len(self._prefix):]: value for key, value in await self.store.items(self._prefix)}
+        return self
+
+    def get(self, stage: str) -> Optional[Any]:
+        return self.stages.get(stage)
+
+    async def save(self, stage: str, value: Any):
+        self.stages[stage] = value
+        try:
+            await self.store.set(self._prefix + stage, value, self.ttl)
+        except Exception as e:
+            logger.warning("Error saving checkpoint %s stage %s: %s", self.id, stage, e)
+
+    async def discard(self, *stages: str):
+        """
+            Forgets `stages`, so the next run repeats them.
+        """
+        for stage in stages:
+            self.stages.pop(stage, None)
+        try:
+            await self.store.delete(*[self._prefix + stage for stage in stages])
+        except Exception as e:
+            logger.warning("Error discarding checkpoint %s stages %s: %s", self.id, stages, e)
+
+    async def clear(self):
+        keys = [self._prefix + stage for stage in self.stages]
+        keys += [key for key, _ in await self.store.items(self._prefix) if key not in keys]
+        self.stages = {}
+        await self.store.delete(*keys)
+
+
+class CheckpointStore:
+    """
+        Opens checkpoints and records which job is running each one, so no two workers run
+        (or clear) the same checkpoint at once. The owner record is renewed while the job
+        is alive and lapses `lease` seconds after its worker dies.
+    """
+
+    def __init__(self, store: SharedStore, ttl: float, lease: float):
+        self.store = store
+        self.ttl = ttl
+        self.lease = lease
+        self._holds: Dict[str, Tuple[asyncio.Future, asyncio.Task]] = {}
+
+    async def open(self, checkpoint_id: str) -> Checkpoint:
+        return await Checkpoint(self.store, checkpoint_id, self.ttl).load()
+
+    @contextlib.asynccontextmanager
+    async def claiming(self):
+        """
+            Serializes the owner check and `hold` across workers: hold the block from
+            checking `owner` until the new job is held.
+        """
+        if not self.store.enabled:
+            yield
+            return
+        async with self.store.lock("checkpoint-owners"):
+            yield
+
+    async def owner(self, checkpoint_id: str) -> Optional[str]:
+        """
+            Id of the job running `checkpoint_id`, in any worker, or None.
+        """
+        entry = await self.store.get(self._owner_key(checkpoint_id))
+        return entry.value if entry is not None else None
+
+    async def hold(self, checkpoint_id: str, job_id: str, finished: Awaitable):
+        """
+            Records `job_id` as the owner of `checkpoint_id` until `finished` completes.
+        """
+        await self.store.set(self._owner_key(checkpoint_id), job_id, self.lease)
+        finished = asyncio.ensure_future(finished)
+        self._holds[checkpoint_id] = (finished, asyncio.ensure_future(self._renew(checkpoint_id, job_id, finished)))
+
+    def close(self):
+        # Los registros de los jobs cortados vencen solos tras `lease` segundos.
+        for finished, renewal in self._holds.values():
+            finished.cancel()
+            renewal.cancel()
+        self._holds = {}
+        self.store.close()
+
+    def _owner_key(self, checkpoint_id: str) -> str:
+        return f"checkpoint-owner:{checkpoint_id}"
+
+    async def _renew(self, checkpoint_id: str, job_id: str, finished: asyncio.Future):
+        key = self._owner_key(checkpoint_id)
+        try:
+            while not finished.done():
+                await asyncio.wait([finished], timeout=self.lease / 3)
+                if not finished.done():
+                    try:
+                        await self.store.set(key, job_id, self.lease)
+                    except Exception as e:
+                        logger.warning("Error renewing owner of checkpoint %s: %s", checkpoint_id, e)
+            await self.store.delete(key)
+        except Exception as e:
+            logger.warning("Error releasing owner of checkpoint %s: %s", checkpoint_id, e)
+        finally:
+            self._holds.pop(checkpoint_id, None)
+
+
+audit_checkpoints = CheckpointStore(SharedStore(config.AUDIT_CHECKPOINT_PATH), config.AUDIT_CHECKPOINT_TTL, config.AUDIT_CHECKPOINT_LEASE)
@@ -0,0 +1,180 @@
+import asyncio
+import base64
+import json
+import logging
+import sqlite3
+import time
+from typing import Optional
+
+from config import config
+from services.http_clients import get_client
+from services.shared_store import SharedStore, shared_store
+
+logger = logging.getLogger(__name__)
+
+SHARED_TOKEN_KEY = "chimbitas_token"
+
+
+class ChimbitasTokenManager:
+    """
+        Caches the Chimbitas access token until shortly before it expires and refreshes it
+        in the background. Concurrent callers that find no valid token share a single
+        in-flight /token request instead of each performing their own login; an expired
+        token is never handed out while a new one can still be awaited. With an
+        enabled shared store the token is also shared between worker processes: one worker
+        logs in under a cross-process lock and the others adopt its token.
+    """
+
+    def __init__(self, refresh_margin: float, default_ttl: float, store: Optional[SharedStore] = None,
+                 min_refresh_interval: float = 5.0, max_refresh_backoff: float = 300.0):
+        self.refresh_margin = refresh_margin
+        self.default_ttl = default_ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.max_refresh_backoff = max_refresh_backoff
+        self.store = store if store is not None and store.enabled else None
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+        self._refresh_at = 0.0
+        self._short_lifetimes = 0
+        self._inflight: Optional[asyncio.Task] = None
+        self._refresher: Optional[asyncio.Task] = None
+
+    async def get_token(self) -> Optional[str]:
+        """
+            Returns a valid access token, logging in only when the cached one is missing or expired.
+        """
+        now = time.monotonic()
+        if self._token and now < self._expires_at:
+            if now >= self._refresh_at:
+                # Still valid but close to expiring: refresh ahead without making the caller wait.
+                self._start_refresh()
+            return self._token
+        if self._token and (self._inflight is None or self._inflight.done()) and now < self._refresh_at:
+            # Los tokens llegan vencidos (vida corta, reloj desfasado): se espera la renovación
+            # programada en vez de loguearse en cada llamada.
+            await asyncio.sleep(self._refresh_at - now)
+        return await asyncio.shield(self._start_refresh())
+
+    async def close(self):
+        for task in (self._refresher, self._inflight):
+            if task is not None and not task.done():
+                task.cancel()
+        self._refresher = None
+        self._inflight = None
+
+    def _start_refresh(self) -> asyncio.Task:
+        if self._inflight is None or self._inflight.done():
+            self._inflight = asyncio.ensure_future(self._refresh())
+        return self._inflight
+
+    async def _refresh(self) -> Optional[str]:
+        if self.store is None:
+            return await self._login()
+        try:
+            async with self.store.lock(SHARED_TOKEN_KEY):
+                # Otro worker pudo renovarlo mientras se esperaba el lock.
+                shared = await self.store.get(SHARED_TOKEN_KEY)
+                if shared is not None and shared.expires_at - time.time() > self._margin(shared.expires_at - shared.stored_at):
+                    self._adopt(shared.value, shared.expires_at - time.time())
+                    return shared.value
+                access_token = await self._login()
+                if access_token:
+                    await self.store.set(SHARED_TOKEN_KEY, access_token, self._expires_at - time.monotonic())
+                return access_token
+        except (OSError, sqlite3.Error) as e:
+            logger.warning("Shared token store unavailable, logging in locally: %s", e)
+            return await self._login()
+
+    async def _login(self) -> Optional[str]:
+        try:
+            payload = await self._request_token()
+        except Exception as e:
+            logger.error("Error obtaining Chimbitas access token: %s", e)
+            return None
+        access_token = payload.get("access_token", "")
+        if not access_token:
+            logger.error("Chimbitas /token response did not include an access token.")
+            return None
+        self._adopt(access_token, self._token_ttl(payload, access_token))
+        logger.info("Successfully obtained Chimbitas access token.")
+        return access_token
+
+    def _adopt(self, access_token: str, ttl: float):
+        now = time.monotonic()
+        self._token = access_token
+        self._expires_at = now + ttl
+        delay = ttl - self._margin(ttl)
+        if delay < self.min_refresh_interval:
+            # Tokens que llegan vencidos o casi: se renueva con un intervalo mínimo que crece
+            # mientras sigan llegando así, en vez de volver a loguearse en un ciclo.
+            self._short_lifetimes += 1
+            delay = min(self.min_refresh_interval * 2 ** (self._short_lifetimes - 1), self.max_refresh_backoff)
+        else:
+            self._short_lifetimes = 0
+        self._refresh_at = now + delay
+        self._schedule_background_refresh()
+
+    def _margin(self, ttl: float) -> float:
+        # Con vidas más cortas que el margen configurado se renueva a la mitad de la vida del token.
+        return min(self.refresh_margin, max(ttl, 0.0) / 2)
+
+    async def _request_token(self) -> dict:
+        login_payload = {
+            "username": config.USER_NAME_CHIMBITAS,
+            "password": config.PASSWORD_CHIMBITAS,
+            "grant_type": "password"
+        }
+        response = await get_client("chimbitas_lambda").post("/token", data=login_payload)
+        response.raise_for_status()
+        return response.json()
+
+    def _token_ttl(self, payload: dict, access_token: str) -> float:
+        """
+            Seconds the token stays valid: `expires_in` from the response, then the JWT `exp`
+            claim, then the configured default.
+        """
+        expires_in = payload.get("expires_in")
+        if expires_in:
+            try:
+                return float(expires_in)
+            except (TypeError, ValueError):
+                pass
+        exp = _jwt_expiration(access_token)
+        if exp is not None:
+            return max(exp - time.time(), 0.0)
+        return self.default_ttl
+
+    def _schedule_background_refresh(self):
+        if self._refresher is not None and not self._refresher.done():
+            self._refresher.cancel()
+        delay = max(self._refresh_at - time.monotonic(), 0.0)
+        self._refresher = asyncio.ensure_future(self._refresh_after(delay))
+
+    async def _refresh_after(self, delay: float):
+        await asyncio.sleep(delay)
+        self._refresher = None
+        self._start_refresh()
+
+
+def _jwt_expiration(token: str) -> Optional[float]:
+    """
+        Reads the `exp` claim of a JWT without verifying it. Returns None for opaque tokens.
+    """
+    parts = token.split(".")
+    if len(parts) != 3:
+        return None
+    try:
+        body = parts[1] + "=" * (-len(parts[1]) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(body))
+        return float(claims["exp"])
+    except Exception:
+        return None
+
+
+token_manager = ChimbitasTokenManager(
+    refresh_margin=config.CHIMBITAS_TOKEN_REFRESH_MARGIN,
+    default_ttl=config.CHIMBITAS_TOKEN_DEFAULT_TTL,
+    store=shared_store,
+    min_refresh_interval=config.CHIMBITAS_TOKEN_MIN_REFRESH_INTERVAL,
+    max_refresh_backoff=config.CHIMBITAS_TOKEN_MAX_REFRESH_BACKOFF,
+)
@@ -0,0 +1,376 @@
+import asyncio
+import base64
+import bisect
+import decimal
+import functools
+import math
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from decimal import Decimal, localcontext
+from typing import List, Optional, Tuple
+
+from config import config
+
+LN10 = math.log(10)
+
+# n! = 10^k solo ocurre para n <= 1, así que log10(n!) nunca cae exactamente en un entero
+# para n >= 2: basta con una estimación cuyo error sea menor que su distancia al entero.
+EXACT_LIMIT = 1000
+FLOAT_LIMIT = 2 ** 53
+
+# Cota (relativa) del error de math.lgamma / Stirling en float64 tras dividir por ln(10).
+# El error medido es ~4.5e-16; se deja un factor 10 de holgura.
+FLOAT_RELATIVE_ERROR = 5e-15
+
+PI = Decimal(
+    "3.14159265358979323846264338327950288419716939937510"
+    "58209749445923078164062862089986280348253421170679"
+)
+
+# B_2k / (2k (2k - 1)) para la serie asintótica de Stirling.
+STIRLING_COEFFICIENTS = [
+    Decimal(1) / 12,
+    Decimal(-1) / 360,
+    Decimal(1) / 1260,
+    Decimal(-1) / 1680,
+    Decimal(1) / 1188,
+    Decimal(-691) / 360360,
+    Decimal(1) / 156,
+    Decimal(-3617) / 122400,
+]
+
+
+def _validate(n: int):
+    if not isinstance(n, int) or n < 0:
+        raise ValueError("n must be a non-negative integer")
+
+
+def _digits_exact(n: int) -> int:
+    """
+        Exact digit count by comparing n! against powers of ten. Only used for small n or when
+        every estimate is too close to an integer boundary.
+    """
+    value = math.factorial(n)
+    k = max(int((value.bit_length() - 1) * math.log10(2)), 0)
+    while 10 ** (k + 1) <= value:
+        k += 1
+    while 10 ** k > value:
+        k -= 1
+    return k + 1
+
+
+def _log10_factorial_decimal(n: int, precision: int) -> Decimal:
+    """
+        log10(n!) from the Stirling series evaluated with `precision` significant digits.
+        For n >= EXACT_LIMIT the truncation error of the series is below 10^-60.
+    """
+    with localcontext() as ctx:
+        ctx.prec = precision
+        x = Decimal(n)
+        value = x * x.ln() - x + (2 * PI * x).ln() / 2
+        x_squared = x * x
+        power = x
+        for coefficient in STIRLING_COEFFICIENTS:
+            value += coefficient / power
+            power *= x_squared
+        return value / Decimal(10).ln()
+
+
+def _digits_precise(n: int) -> int:
+    if n < EXACT_LIMIT:
+        return _digits_exact(n)
+    precision = 2 * len(str(n)) + 40
+    value = _log10_factorial_decimal(n, precision)
+    k = int(value)
+    margin = Decimal(10) ** (len(str(n)) + 5 - precision)
+    if value - k > margin and k + 1 - value > margin:
+        return k + 1
+    return _digits_exact(n)
+
+
+def _is_safe(estimate: float) -> bool:
+    margin = FLOAT_RELATIVE_ERROR * max(estimate, 1.0)
+    fraction = estimate - math.floor(estimate)
+    return margin < fraction < 1 - margin
+
+
+def factorial_digits(n: int) -> int:
+    """
+        Number of decimal digits of n! in constant time: log10(n!) comes from math.lgamma
+        and is only recomputed with high precision when it falls within its error bound of
+        an integer.
+    """
+    _validate(n)
+    if n <= 1:
+        return 1
+    if n < FLOAT_LIMIT:
+        estimate = math.lgamma(n + 1) / LN10
+        if _is_safe(estimate):
+            return math.floor(estimate) + 1
+    return _digits_precise(n)
+
+
+def factorial_digits_batch(ns: List[int]) -> List[int]:
+    """
+        Vectorized factorial_digits. With NumPy the Stirling series is evaluated over the whole
+        batch at once; the few entries that land too close to an integer (and small or huge n)
+        are resolved one by one.
+    """
+    for n in ns:
+        _validate(n)
+    np = _numpy() if ns else None
+    if np is None:
+        return [factorial_digits(n) for n in ns]
+
+    values = np.array([n if 32 <= n < FLOAT_LIMIT else 32 for n in ns], dtype=np.float64)
+    inverse = 1.0 / values
+    inverse_squared = inverse * inverse
+    series = inverse * (1 / 12 - inverse_squared * (1 / 360 - inverse_squared * (1 / 1260)))
+    estimates = (values * np.log(values) - values + 0.5 * np.log(2 * np.pi * values) + series) / LN10
+    margins = FLOAT_RELATIVE_ERROR * np.maximum(estimates, 1.0)
+    fractions = estimates - np.floor(estimates)
+    safe = (fractions > margins) & (fractions < 1 - margins)
+    digits = np.floor(estimates).astype(np.int64) + 1
+
+    return [
+        int(digits[i]) if safe[i] and 32 <= n < FLOAT_LIMIT else factorial_digits(n)
+        for i, n in enumerate(ns)
+    ]
+
+
+@functools.lru_cache(maxsize=None)
+def _numpy():
+    # Import diferido: NumPy tarda en cargar y solo lo usan los lotes. Sin él se usa el
+    # cálculo escalar.
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def _range_product(low: int, high: int) -> int:
+    """
+        Product of the integers in [low, high) by binary splitting, so the big multiplications
+        are balanced and use Karatsuba.
+    """
+    if high - low <= 32:
+        result = 1
+        for i in range(low, high):
+            result *= i
+        return result
+    middle = (low + high) // 2
+    return _range_product(low, middle) * _range_product(middle, high)
+
+
+def int_to_decimal_string(value: int) -> str:
+    """
+        Decimal representation of a non-negative int in subquadratic time. int.__str__ is
+        quadratic before Python 3.12; here the int is split by bits and the halves are
+        recombined with decimal's (number-theoretic-transform) multiplication.
+    """
+    bit_limit = 128
+    powers = {}
+
+    def power_of_two(width: int) -> Decimal:
+        result = powers.get(width)
+        if result is None:
+            if width <= bit_limit:
+                result = Decimal(2) ** width
+            elif width - 1 in powers:
+                result = powers[width - 1] * 2
+            else:
+                half = width >> 1
+                result = power_of_two(half) * power_of_two(width - half)
+            powers[width] = result
+        return result
+
+    def convert(number: int, width: int) -> Decimal:
+        if width <= bit_limit:
+            return Decimal(number)
+        half = width >> 1
+        high = number >> half
+        low = number - (high << half)
+        return convert(low, half) + convert(high, width - half) * power_of_two(half)
+
+    with localcontext() as ctx:
+        ctx.prec = decimal.MAX_PREC
+        ctx.Emax = decimal.MAX_EMAX
+        ctx.Emin = decimal.MIN_EMIN
+        ctx.traps[decimal.Inexact] = 1
+        return str(convert(value, value.bit_length()))
+
+
+def _compute_factorial(n: int, base_n: int, base_value: Optional[int]) -> Tuple[int, str]:
+    """
+        Runs in a worker process: n! (continuing from base_n! when a checkpoint is given) and
+        its decimal representation.
+    """
+    if base_value is None:
+        value = math.factorial(n)
+    else:
+        value = base_value * _range_product(base_n + 1, n + 1)
+    return value, int_to_decimal_string(value)
+
+
+class FactorialTimeout(Exception):
+    pass
+
+
+ENCODINGS = ("decimal", "hex", "base64", "summary")
+
+
+def to_bytes(value: int) -> bytes:
+    """
+        Big-endian binary representation of a non-negative int.
+    """
+    return value.to_bytes(max(1, (value.bit_length() + 7) // 8), "big")
+
+
+def encode_factorial(value: int, digits: str, encoding: str, edge_digits: int = 20) -> str:
+    """
+        Compact encodings of a factorial. hex and base64 are linear-time conversions of the
+        binary value; summary keeps only the leading/trailing digits and the digit count.
+    """
+    if encoding == "decimal":
+        return digits
+    if encoding == "hex":
+        return format(value, "x")
+    if encoding == "base64":
+        return base64.b64encode(to_bytes(value)).decode("ascii")
+    if encoding == "summary":
+        if len(digits) <= 2 * edge_digits:
+            return f"{digits} ({len(digits)} digits)"
+        return f"{digits[:edge_digits]}...{digits[-edge_digits:]} ({len(digits)} digits)"
+    raise ValueError(f"encoding must be one of {', '.join(ENCODINGS)}")
+
+
+class FactorialEngine:
+    """
+        Computes big factorials off the event loop. Small n are answered inline; larger ones
+        run in a process pool with a per-call timeout, and a timed-out or cancelled call
+        terminates its worker so it stops using CPU. Recent results are kept in an LRU cache
+        bounded by bytes, and a cached m! close below n is used as a checkpoint for n!.
+    """
+
+    def __init__(self, inline_limit: int, workers: int, timeout: float, cache_bytes: int):
+        self.inline_limit = inline_limit
+        self.workers = workers
+        self.timeout = timeout
+        self.cache_bytes = cache_bytes
+        self._cache: "OrderedDict[int, Tuple[int, str]]" = OrderedDict()
+        self._cached_ns: List[int] = []
+        self._cached_size = 0
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._inflight = {}
+
+    async def factorial(self, n: int) -> Tuple[int, str]:
+        """
+            Returns (n!, decimal string of n!).
+        """
+        if not isinstance(n, int) or n < 0:
+            raise ValueError("n must be a non-negative integer")
+        cached = self._cache.get(n)
+        if cached is not None:
+            self._cache.move_to_end(n)
+            return cached
+        if n <= self.inline_limit:
+            value = math.factorial(n)
+            return value, int_to_decimal_string(value)
+        # Pedidos concurrentes del mismo n comparten un solo cálculo, que se cancela
+        # (terminando su worker) cuando ya nadie lo espera.
+        entry = self._inflight.get(n)
+        if entry is None:
+            future = asyncio.ensure_future(self._compute(n))
+            entry = self._inflight[n] = [future, 0]
+            future.add_done_callback(lambda _: self._inflight.pop(n, None))
+        entry[1] += 1
+        try:
+            return await asyncio.shield(entry[0])
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and not entry[0].done():
+                entry[0].cancel()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._inflight)
+
+    async def close(self):
+        for future, _ in list(self._inflight.values()):
+            future.cancel()
+        if self._pool is not None:
+            self._terminate_pool()
+
+    async def _compute(self, n: int) -> Tuple[int, str]:
+        base_n, base_value = self._checkpoint_for(n)
+        loop = asyncio.get_running_loop()
+        for attempt in range(2):
+            pool = self._get_pool()
+            future = loop.run_in_executor(pool, _compute_factorial, n, base_n, base_value)
+            try:
+                result = await asyncio.wait_for(future, timeout=self.timeout)
+            except asyncio.TimeoutError:
+                self._terminate_pool(pool)
+                raise FactorialTimeout(f"Computing {n}! took longer than {self.timeout} seconds")
+            except asyncio.CancelledError:
+                self._terminate_pool(pool)
+                raise
+            except BrokenProcessPool:
+                # Otro cálculo mató el pool (timeout/cancelación); se reintenta en uno nuevo.
+                if attempt:
+                    raise
+                continue
+            self._store(n, result)
+            return result
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._pool
+
+    def _terminate_pool(self, pool: Optional[ProcessPoolExecutor] = None):
+        pool = pool or self._pool
+        if pool is None:
+            return
+        if pool is self._pool:
+            self._pool = None
+        processes = list((pool._processes or {}).values())
+        pool.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.terminate()
+
+    def _checkpoint_for(self, n: int) -> Tuple[int, Optional[int]]:
+        index = bisect.bisect_right(self._cached_ns, n) - 1
+        if index >= 0:
+            base_n = self._cached_ns[index]
+            # Solo conviene partir de m! si el tramo restante es corto frente a n.
+            if n - base_n <= n // 4:
+                self._cache.move_to_end(base_n)
+                return base_n, self._cache[base_n][0]
+        return 0, None
+
+    def _store(self, n: int, result: Tuple[int, str]):
+        size = result[0].bit_length() // 8 + len(result[1])
+        if size > self.cache_bytes or n in self._cache:
+            return
+        self._cache[n] = result
+        bisect.insort(self._cached_ns, n)
+        self._cached_size += size
+        while self._cached_size > self.cache_bytes:
+            old_n, (old_value, old_digits) = self._cache.popitem(last=False)
+            self._cached_ns.remove(old_n)
+            self._cached_size -= old_value.bit_length() // 8 + len(old_digits)
+
+
+factorial_engine = FactorialEngine(
+    inline_limit=config.FACTORIAL_INLINE_LIMIT,
+    workers=config.FACTORIAL_WORKERS,
+    timeout=config.FACTORIAL_TIMEOUT,
+    cache_bytes=config.FACTORIAL_CACHE_BYTES,
+)
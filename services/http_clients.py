@@ -0,0 +1,89 @@
+from typing import Dict, Iterable, Optional
+
+import httpx
+
+from config import config
+from services.metrics import InstrumentedTransport
+from services.resilience import EndpointPolicy, ResilientTransport
+
+# Un cliente (y por lo tanto un pool de conexiones keep-alive) por cada upstream.
+# "s3" y "external" no tienen base_url: reciben URLs absolutas (presigned POST y URLs de usuarios).
+UPSTREAMS = {
+    "legal_docs": lambda: config.LEGAL_DOCS_URL,
+    "chimbitas_lambda": lambda: config.CHIMBITAS_LAMBDA_URL,
+    "api_chimbitas": lambda: config.API_CHIMBITAS_URL,
+    "s3": lambda: None,
+    "external": lambda: None,
+}
+
+# Políticas de las lecturas idempotentes por upstream y path; None aplica a cualquier GET del upstream.
+# /task/status no usa hedging: el poller ya reparte sus consultas en el tiempo.
+ENDPOINT_POLICIES = {
+    "legal_docs": {"/get-templates": EndpointPolicy(hedge=True)},
+    "chimbitas_lambda": {"/sessions/list": EndpointPolicy(hedge=True)},
+    "api_chimbitas": {"/task/status": EndpointPolicy()},
+    "s3": {},
+    "external": {None: EndpointPolicy()},
+}
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+_transports: Dict[str, ResilientTransport] = {}
+
+
+def _build_client(name: str) -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=config.HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=config.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=config.HTTP_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(
+        connect=config.HTTP_CONNECT_TIMEOUT,
+        read=config.HTTP_READ_TIMEOUT,
+        write=config.HTTP_WRITE_TIMEOUT,
+        pool=config.HTTP_POOL_TIMEOUT,
+    )
+    base_url = UPSTREAMS[name]()
+    # Cada intento (reintentos y hedges incluidos) queda registrado en las métricas y el trace.
+    transport = _transports[name] = ResilientTransport(
+        name,
+        InstrumentedTransport(name, httpx.AsyncHTTPTransport(limits=limits), label_by_path=bool(base_url)),
+        ENDPOINT_POLICIES[name],
+        by_path=bool(base_url),
+    )
+    return httpx.AsyncClient(
+        base_url=base_url or "",
+        transport=transport,
+        timeout=timeout,
+        follow_redirects=True,
+    )
+
+
+def get_client(name: str) -> httpx.AsyncClient:
+    """
+        Returns the shared pooled client for an upstream. Clients are created by the server
+        lifespan; when a sub-server runs on its own they are created on first use.
+    """
+    client = _clients.get(name)
+    if client is None or client.is_closed:
+        client = _clients[name] = _build_client(name)
+    return client
+
+
+def circuit_states() -> Dict[str, dict]:
+    return {
+        breaker.name: breaker.to_dict()
+        for transport in _transports.values()
+        for breaker in transport.breakers.values()
+    }
+
+
+async def open_clients(names: Optional[Iterable[str]] = None):
+    for name in names if names is not None else UPSTREAMS:
+        get_client(name)
+
+
+async def close_clients():
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        await client.aclose()
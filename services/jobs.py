@@ -0,0 +1,344 @@
+import asyncio
+import contextlib
+import contextvars
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from services.admission import Busy
+from services.log import request_id
+from services.shared_store import SharedStore
+from services.tracing import span, tracer
+from services.worker_status import WORKER_ID
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATUSES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class JobFailed(Exception):
+    """
+        Raised by a job runner to finish the job as failed with a user-facing message.
+    """
+
+
+class JobStage:
+    def __init__(self, name: str):
+        self.name = name
+        self.status = PENDING
+        self.started_at: Optional[str] = None
+        self.finished_at: Optional[str] = None
+        self.duration_seconds: Optional[float] = None
+        self.detail: Dict[str, Any] = {}
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "status": self.status,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "duration_seconds": self.duration_seconds,
+            "detail": self.detail,
+        }
+
+
+class Job:
+    def __init__(self, kind: str, stage_names: List[str], runner: Callable[["Job"], Awaitable[Any]]):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = PENDING
+        self.stages = [JobStage(name) for name in stage_names]
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.detail: Dict[str, Any] = {}
+        self.created_at = _now()
+        self.updated_at = self.created_at
+        # Request id de quien envió el job: sus logs se correlacionan con esa petición.
+        self.request_id: Optional[str] = None
+        self._runner = runner
+        self._task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+        self._on_change: Optional[Callable[["Job"], None]] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    @property
+    def completed_stages(self) -> int:
+        return sum(1 for stage in self.stages if stage.status == SUCCEEDED)
+
+    @property
+    def current_stage(self) -> Optional[str]:
+        for stage in self.stages:
+            if stage.status == RUNNING:
+                return stage.name
+        return None
+
+    def get_stage(self, name: str) -> JobStage:
+        for stage in self.stages:
+            if stage.name == name:
+                return stage
+        raise KeyError(name)
+
+    @contextlib.asynccontextmanager
+    async def stage(self, name: str):
+        """
+            Marks a stage as running for the duration of the block and records its outcome,
+        also as a span of the job's trace.
+        """
+        stage = self.get_stage(name)
+        stage.status = RUNNING
+        stage.started_at = _now()
+        started = time.monotonic()
+        self._touch()
+        try:
+            with span(name) as stage_span:
+                try:
+                    yield stage
+                finally:
+                    stage_span.set(**stage.detail)
+        except asyncio.CancelledError:
+            stage.status = CANCELLED
+            raise
+        except BaseException:
+            stage.status = FAILED
+            raise
+        else:
+            stage.status = SUCCEEDED
+        finally:
+            stage.finished_at = _now()
+            stage.duration_seconds = round(time.monotonic() - started, 3)
+            self._touch()
+
+    def skip_stage(self, name: str, **detail):
+        """
+            Marks a stage as succeeded without running it, e.g. because an earlier run of the
+            same work already completed it.
+        """
+        stage = self.get_stage(name)
+        stage.status = SUCCEEDED
+        stage.started_at = stage.finished_at = _now()
+        stage.duration_seconds = 0.0
+        stage.detail.update(detail, resumed=True)
+        self._touch()
+
+    async def wait_for_change(self, timeout: Optional[float] = None):
+        event = self._changed
+        try:
+            await asyncio.wait_for(event.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def _touch(self):
+        self.updated_at = _now()
+        # Despierta a quien espera cambios y deja un evento nuevo para la próxima espera.
+        self._changed.set()
+        self._changed = asyncio.Event()
+        if self._on_change is not None:
+            self._on_change(self)
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "current_stage": self.current_stage,
+            "completed_stages": self.completed_stages,
+            "total_stages": len(self.stages),
+            "stages": [stage.to_dict() for stage in self.stages],
+            "result": self.result,
+            "error": self.error,
+            "detail": self.detail,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+
+class JobManager:
+    """
+        In-process job scheduler. Submitted jobs wait in a queue until one of `workers`
+        worker coroutines picks them up; finished jobs are kept (up to `max_retained`) so
+        their status and results can still be queried.
+
+        With an enabled shared store every change is also published as a snapshot, so the
+        status of a job can be read from any worker process, not only the one running it.
+    """
+
+    def __init__(self, workers: int, max_retained: int, store: Optional[SharedStore] = None, snapshot_ttl: float = 86400,
+                 max_pending: Optional[int] = None):
+        self.workers = max(1, workers)
+        self.max_retained = max_retained
+        self.max_pending = max_pending
+        self.store = store if store is not None and store.enabled else None
+        self.snapshot_ttl = snapshot_ttl
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        self._dirty: set = set()
+        self._publishers: Dict[str, asyncio.Task] = {}
+
+    def submit(self, kind: str, stage_names: List[str], runner: Callable[[Job], Awaitable[Any]]) -> Job:
+        self._ensure_workers()
+        if self.max_pending is not None and self._queue.qsize() >= self.max_pending:
+            raise Busy(f"{self._queue.qsize()} {kind} jobs are already waiting; retry later")
+        job = Job(kind, stage_names, runner)
+        job.request_id = request_id.get()
+        job._on_change = self._publish
+        self._jobs[job.id] = job
+        self._publish(job)
+        self._evict_finished()
+        self._queue.put_nowait(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def list(self, status: Optional[str] = None) -> List[Job]:
+        return [job for job in self._jobs.values() if status is None or job.status == status]
+
+    @property
+    def running(self) -> int:
+        return sum(1 for job in self._jobs.values() if job.status == RUNNING)
+
+    def snapshot_of(self, job: Job) -> dict:
+        return {**job.to_dict(), "worker_id": WORKER_ID}
+
+    async def snapshot(self, job_id: str) -> Optional[dict]:
+        """
+            Status of a job run by this process or, through the shared store, by another one.
+        """
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return self.snapshot_of(job)
+        if self.store is None:
+            return None
+        shared = await self.store.get(f"job:{job_id}")
+        return shared.value if shared is not None else None
+
+    async def snapshots(self, status: Optional[str] = None) -> List[dict]:
+        snapshots = {job.id: self.snapshot_of(job) for job in self._jobs.values()}
+        if self.store is not None:
+            for _, snapshot in await self.store.items("job:"):
+                snapshots.setdefault(snapshot["job_id"], snapshot)
+        return [snapshot for snapshot in snapshots.values() if status is None or snapshot["status"] == status]
+
+    async def cancel(self, job_id: str, timeout: float = 5.0) -> Optional[Job]:
+        """
+            Cancels a pending or running job and waits (up to `timeout`) for it to stop.
+        """
+        job = self._jobs.get(job_id)
+        if job is None or job.finished:
+            return job
+        if job._task is None:
+            job.status = CANCELLED
+            job._touch()
+            return job
+        job._task.cancel()
+        try:
+            await asyncio.wait_for(self.wait(job), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        return job
+
+    async def wait(self, job: Job, on_change: Optional[Callable[[Job], Awaitable[None]]] = None) -> Job:
+        while not job.finished:
+            await job.wait_for_change()
+            if on_change is not None:
+                await on_change(job)
+        return job
+
+    async def close(self):
+        for job in self._jobs.values():
+            if job._task is not None and not job._task.done():
+                job._task.cancel()
+        for task in self._worker_tasks:
+            task.cancel()
+        self._worker_tasks = []
+        self._queue = None
+        publishers = list(self._publishers.values())
+        if publishers:
+            await asyncio.wait(publishers, timeout=5)
+
+    def _publish(self, job: Job):
+        if self.store is None:
+            return
+        # Se agrupan los cambios: como máximo una escritura en curso por job, siempre con el último estado.
+        self._dirty.add(job.id)
+        if job.id not in self._publishers:
+            self._publishers[job.id] = asyncio.get_running_loop().create_task(self._write_snapshots(job), context=contextvars.Context())
+
+    async def _write_snapshots(self, job: Job):
+        try:
+            while job.id in self._dirty:
+                self._dirty.discard(job.id)
+                await self.store.set(f"job:{job.id}", self.snapshot_of(job), self.snapshot_ttl)
+        except Exception as e:
+            logger.warning("Error publishing job %s snapshot: %s", job.id, e)
+        finally:
+            del self._publishers[job.id]
+
+    def _ensure_workers(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        self._worker_tasks = [task for task in self._worker_tasks if not task.done()]
+        while len(self._worker_tasks) < self.workers:
+            # Contexto vacío: los workers sobreviven a la petición que los arrancó.
+            self._worker_tasks.append(asyncio.get_running_loop().create_task(self._work(), context=contextvars.Context()))
+
+    async def _work(self):
+        while True:
+            job = await self._queue.get()
+            if job.status == PENDING:
+                await self._run(job)
+
+    async def _run(self, job: Job):
+        token = request_id.set(job.request_id)
+        try:
+            await self._run_job(job)
+        finally:
+            request_id.reset(token)
+
+    async def _run_job(self, job: Job):
+        job.status = RUNNING
+        job._touch()
+        # La traza usa el id del job; la tarea del runner hereda el span raíz.
+        with tracer.trace(job.kind, trace_id=job.id, job_id=job.id) as root:
+            job._task = asyncio.ensure_future(job._runner(job))
+            try:
+                job.result = await job._task
+                job.status = SUCCEEDED
+            except asyncio.CancelledError:
+                job.status = CANCELLED
+                root.fail("cancelled")
+                if asyncio.current_task().cancelling():
+                    # El worker mismo fue cancelado (apagado del servidor).
+                    job._touch()
+                    raise
+            except JobFailed as e:
+                job.status = FAILED
+                job.error = str(e)
+                root.fail(job.error)
+            except Exception as e:
+                logger.exception("Job %s failed: %s", job.id, e)
+                job.status = FAILED
+                job.error = f"Unexpected error: {e}"
+                root.fail(job.error)
+        job._touch()
+
+    def _evict_finished(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(self._jobs) - self.max_retained)]:
+            del self._jobs[job_id]
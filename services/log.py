@@ -0,0 +1,258 @@
+import atexit
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import logging.handlers
+import queue
+import reprlib
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from config import config
+from services.tracing import current_span
+
+# Identificador de la solicitud HTTP o llamada de tool en curso; se agrega a cada línea de log.
+request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+
+_STANDARD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "sample", "suppressed"}
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def _short_repr() -> reprlib.Repr:
+    short = reprlib.Repr()
+    short.maxlevel = 3
+    short.maxdict = short.maxlist = short.maxtuple = short.maxset = 10
+    short.maxstring = short.maxother = config.LOG_MAX_FIELD_CHARS
+    return short
+
+
+def _truncate(text: str, limit: int) -> str:
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}... [{len(text) - limit} more chars]"
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+        Puts records on the logging queue; the listener thread writes them. Arguments are
+        rendered here with bounded reprs, so the cost on the event loop depends on the
+        truncation limits and not on the size of the payloads being logged.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self._repr = _short_repr()
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        message = str(record.msg)
+        if record.args:
+            args = record.args if isinstance(record.args, tuple) else (record.args,)
+            rendered = tuple(
+                arg if isinstance(arg, (int, float)) and not isinstance(arg, bool)
+                else _truncate(arg, config.LOG_MAX_FIELD_CHARS) if isinstance(arg, str)
+                else self._repr.repr(arg)
+                for arg in args
+            )
+            try:
+                message = message % rendered
+            except (TypeError, ValueError):
+                message = f"{message} {rendered}"
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = _truncate(message, config.LOG_MAX_MESSAGE_CHARS)
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _truncate(logging.Formatter().formatException(record.exc_info), config.LOG_MAX_MESSAGE_CHARS)
+            record.exc_info = None
+        record.request_id = request_id.get()
+        span = current_span()
+        if span is not None and span.trace is not None:
+            record.trace_id = span.trace.trace_id
+            record.span_id = span.span_id
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Nunca se bloquea a quien loguea: si la cola está llena se descarta la línea.
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        line = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for name, value in record.__dict__.items():
+            if name not in _STANDARD_ATTRIBUTES and value is not None:
+                line[name] = value
+        if getattr(record, "suppressed", 0):
+            line["suppressed"] = record.suppressed
+        if record.exc_text:
+            line["exception"] = record.exc_text
+        return json.dumps(line, default=str, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """
+        Rate-limits repetitive records, the ones logged with extra={"sample": key}: at most
+        `per_second` records per key go through and the next one reports how many were
+        dropped in between (`suppressed`).
+    """
+
+    def __init__(self, per_second: float):
+        super().__init__()
+        self.interval = 1 / per_second if per_second > 0 else 0
+        self._last: Dict[str, float] = {}
+        self._suppressed: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = getattr(record, "sample", None)
+        if key is None or self.interval == 0:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last.get(key, float("-inf")) < self.interval:
+                self._suppressed[key] = self._suppressed.get(key, 0) + 1
+                return False
+            self._last[key] = now
+            record.suppressed = self._suppressed.pop(key, 0)
+        return True
+
+
+def parse_levels(spec: str) -> Dict[str, str]:
+    levels = {}
+    for entry in spec.split(","):
+        name, _, level = entry.partition("=")
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure_logging():
+    """
+        Routes every logger (ours, httpx, mcp, uvicorn's) through one queue: callers only
+        enqueue, a background thread writes JSON lines to stdout. Levels come from LOG_LEVEL
+        and, per logger, LOG_LEVELS ("services.task_poller=WARNING,httpx=WARNING").
+        Safe to call more than once.
+    """
+    global _listener
+    if _listener is not None:
+        return
+    log_queue: queue.Queue = queue.Queue(maxsize=config.LOG_QUEUE_SIZE)
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter())
+    _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=False)
+    _listener.start()
+    handler = _NonBlockingQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(config.LOG_SAMPLE_PER_SECOND))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(config.LOG_LEVEL.upper())
+    for name, level in parse_levels(config.LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level)
+    # uvicorn trae sus propios handlers; se propagan al root para pasar por la misma cola.
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        logging.getLogger(name).handlers = []
+        logging.getLogger(name).propagate = True
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """
+        Flushes the queued records and stops the writer thread.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class RequestIdMiddleware:
+    """
+        ASGI middleware that takes the caller's X-Request-ID (or makes one up), binds it to
+        the logs of the request and returns it in the response headers.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        incoming = dict(scope.get("headers") or []).get(b"x-request-id")
+        current = incoming.decode("latin-1")[:64] if incoming else uuid.uuid4().hex[:16]
+        if not incoming:
+            # Queda también en los headers de la solicitud, de donde lo toman las tools.
+            scope = dict(scope, headers=list(scope.get("headers") or []) + [(b"x-request-id", current.encode("latin-1"))])
+        token = request_id.set(current)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", current.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_id.reset(token)
+
+
+def correlate_tools(mcp, server: str):
+    """
+        Binds the id of the HTTP request that carried each tool call (X-Request-ID) to the
+        logs of the call. FastMCP runs tools outside the HTTP request's context, so the
+        middleware's binding does not reach them on its own.
+    """
+    for tool in mcp._tool_manager.list_tools():
+        if getattr(tool.fn, "__correlated__", False):
+            continue
+        tool.fn = _correlated(mcp, tool.fn, tool.is_async)
+
+
+def _call_request_id(mcp) -> str:
+    try:
+        context = mcp.get_context()
+        request = context.request_context.request
+        header = request.headers.get("x-request-id") if request is not None else None
+        return header or f"mcp-{context.request_id}"
+    except (LookupError, ValueError, AttributeError):
+        return uuid.uuid4().hex[:16]
+
+
+def _correlated(mcp, fn, is_async: bool):
+    if is_async:
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            token = request_id.set(_call_request_id(mcp))
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                request_id.reset(token)
+    else:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            token = request_id.set(_call_request_id(mcp))
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                request_id.reset(token)
+
+    wrapper.__correlated__ = True
+    wrapper.__signature__ = inspect.signature(fn)
+    return wrapper
@@ -0,0 +1,189 @@
+import contextlib
+import functools
+import inspect
+import os
+import time
+
+import httpx
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest, multiprocess
+
+from services.tracing import span
+
+TOOL_CALLS = Counter("mcp_tool_calls_total", "MCP tool calls.", ["server", "tool", "outcome"])
+TOOL_DURATION = Histogram(
+    "mcp_tool_duration_seconds", "MCP tool latency.", ["server", "tool"],
+    buckets=(0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800, 10800),
+)
+# Con varios workers (PROMETHEUS_MULTIPROC_DIR) los gauges se suman entre los procesos vivos.
+TOOL_IN_FLIGHT = Gauge("mcp_tool_in_flight", "MCP tool calls currently running.", ["server", "tool"], multiprocess_mode="livesum")
+
+UPSTREAM_REQUESTS = Counter("upstream_requests_total", "Requests to upstream services.", ["upstream", "method", "endpoint", "status"])
+UPSTREAM_DURATION = Histogram(
+    "upstream_request_duration_seconds", "Time until the upstream response headers arrive.", ["upstream", "method", "endpoint"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+UPSTREAM_IN_FLIGHT = Gauge("upstream_in_flight", "Upstream requests whose response is not fully read yet.", ["upstream"], multiprocess_mode="livesum")
+UPSTREAM_BYTES = Counter("upstream_bytes_total", "Body bytes exchanged with upstream services.", ["upstream", "direction"])
+UPSTREAM_RETRIES = Counter("upstream_retries_total", "Idempotent upstream reads retried.", ["upstream", "endpoint", "reason"])
+UPSTREAM_HEDGES = Counter("upstream_hedged_requests_total", "Second requests sent because the first was slower than p95.", ["upstream", "endpoint"])
+CIRCUIT_OPENED = Counter("upstream_circuit_opened_total", "Times an upstream circuit breaker opened.", ["circuit"])
+CIRCUIT_REJECTED = Counter("upstream_circuit_rejected_total", "Requests failed fast by an open circuit breaker.", ["circuit"])
+
+ADMISSION_IN_FLIGHT = Gauge("admission_in_flight", "Calls admitted by a gate and still running.", ["gate"], multiprocess_mode="livesum")
+ADMISSION_QUEUED = Gauge("admission_queue_depth", "Calls waiting in a gate's queue.", ["gate"], multiprocess_mode="livesum")
+ADMISSION_WAIT = Histogram(
+    "admission_wait_seconds", "Time calls waited for a gate (queue and rate limit).", ["gate"],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+ADMISSION_REJECTED = Counter("admission_rejected_total", "Calls turned away as busy.", ["gate", "reason"])
+
+_tool_calls_in_flight = 0
+
+
+def tool_calls_in_flight() -> int:
+    """
+        Tool calls running in this process, across every server and tool.
+    """
+    return _tool_calls_in_flight
+
+
+def render_metrics():
+    """
+        Returns (body, content type) for /metrics. Under multiple workers each process writes
+        its samples to PROMETHEUS_MULTIPROC_DIR and any of them serves the aggregate.
+    """
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead():
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(os.getpid())
+
+
+def _is_error(result) -> bool:
+    # Las tools devuelven los errores en vez de lanzarlos: {"error": ...} o success=False.
+    if isinstance(result, dict):
+        return "error" in result
+    return getattr(result, "success", True) is False
+
+
+def instrument_tools(mcp, server: str):
+    """
+        Wraps every tool registered on a FastMCP server so each call records its count,
+        outcome, latency and in-flight concurrency. Call once, after all tools are defined.
+    """
+    for tool in mcp._tool_manager.list_tools():
+        if getattr(tool.fn, "__instrumented__", False):
+            continue
+        tool.fn = _instrument(tool.fn, server, tool.name, tool.is_async)
+
+
+def _instrument(fn, server: str, name: str, is_async: bool):
+    labels = {"server": server, "tool": name}
+
+    def record(started: float, outcome: str):
+        TOOL_DURATION.labels(**labels).observe(time.perf_counter() - started)
+        TOOL_CALLS.labels(outcome=outcome, **labels).inc()
+
+    @contextlib.contextmanager
+    def in_flight():
+        global _tool_calls_in_flight
+        _tool_calls_in_flight += 1
+        try:
+            with TOOL_IN_FLIGHT.labels(**labels).track_inprogress():
+                yield
+        finally:
+            _tool_calls_in_flight -= 1
+
+    if is_async:
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            with in_flight():
+                try:
+                    result = await fn(*args, **kwargs)
+                except BaseException:
+                    record(started, "exception")
+                    raise
+            record(started, "error" if _is_error(result) else "success")
+            return result
+    else:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            with in_flight():
+                try:
+                    result = fn(*args, **kwargs)
+                except BaseException:
+                    record(started, "exception")
+                    raise
+            record(started, "error" if _is_error(result) else "success")
+            return result
+
+    wrapper.__instrumented__ = True
+    # FastMCP valida los argumentos con la firma original, la copia wraps la conserva.
+    wrapper.__signature__ = inspect.signature(fn)
+    return wrapper
+
+
+class _CountingStream(httpx.AsyncByteStream):
+    def __init__(self, stream: httpx.AsyncByteStream, upstream: str):
+        self._stream = stream
+        self._upstream = upstream
+        self._closed = False
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            UPSTREAM_BYTES.labels(self._upstream, "received").inc(len(chunk))
+            yield chunk
+
+    async def aclose(self):
+        if not self._closed:
+            self._closed = True
+            UPSTREAM_IN_FLIGHT.labels(self._upstream).dec()
+        await self._stream.aclose()
+
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """
+        httpx transport that records latency, status codes, bytes and concurrency of every
+        request made through a shared upstream client. Upstreams with a base URL are
+        labelled by path (/token, /sessions/add, ...); absolute-URL upstreams such as S3 or
+        user downloads are labelled by host to keep the label set bounded.
+    """
+
+    def __init__(self, upstream: str, transport: httpx.AsyncBaseTransport, label_by_path: bool):
+        self.upstream = upstream
+        self.transport = transport
+        self.label_by_path = label_by_path
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        endpoint = request.url.path if self.label_by_path else request.url.host
+        labels = {"upstream": self.upstream, "method": request.method, "endpoint": endpoint}
+        sent = request.headers.get("Content-Length")
+        if sent is not None:
+            UPSTREAM_BYTES.labels(self.upstream, "sent").inc(int(sent))
+        UPSTREAM_IN_FLIGHT.labels(self.upstream).inc()
+        started = time.perf_counter()
+        try:
+            with span(f"{request.method} {endpoint}", upstream=self.upstream, bytes_sent=int(sent or 0)) as request_span:
+                response = await self.transport.handle_async_request(request)
+                request_span.set(status_code=response.status_code)
+                if response.status_code >= 400:
+                    request_span.fail(f"HTTP {response.status_code}")
+        except BaseException as e:
+            UPSTREAM_IN_FLIGHT.labels(self.upstream).dec()
+            UPSTREAM_REQUESTS.labels(status=type(e).__name__, **labels).inc()
+            raise
+        UPSTREAM_DURATION.labels(**labels).observe(time.perf_counter() - started)
+        UPSTREAM_REQUESTS.labels(status=str(response.status_code), **labels).inc()
+        # La solicitud sigue "en vuelo" hasta que se termina de leer el cuerpo.
+        response.stream = _CountingStream(response.stream, self.upstream)
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
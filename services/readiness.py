@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+
+def parse_probe_paths(spec: str) -> Dict[str, str]:
+    """
+        Parses READY_PROBE_PATHS, "upstream=/path,...". Upstreams not listed are probed at "/".
+    """
+    paths = {}
+    for entry in spec.split(","):
+        name, _, path = entry.partition("=")
+        if name.strip() and path.strip():
+            paths[name.strip()] = path.strip()
+    return paths
+
+
+class UpstreamHealth:
+    def __init__(self, name: str):
+        self.name = name
+        self.reachable: Optional[bool] = None
+        self.status_code: Optional[int] = None
+        self.latency_ms: Optional[float] = None
+        self.error: Optional[str] = None
+        self.checked_at: Optional[float] = None
+        self.consecutive_failures = 0
+
+    def stale(self, max_age: float) -> bool:
+        return self.checked_at is None or time.time() - self.checked_at > max_age
+
+    def to_dict(self) -> dict:
+        return {
+            "reachable": self.reachable,
+            "status_code": self.status_code,
+            "latency_ms": self.latency_ms,
+            "error": self.error,
+            "checked_at": self.checked_at,
+            "consecutive_failures": self.consecutive_failures,
+        }
+
+
+class ReadinessMonitor:
+    """
+        Probes the upstreams of the enabled sub-servers (those with a base URL) every
+        `interval` seconds in the background and keeps the last result, so /ready answers
+        from memory and orchestrator probes never reach the upstreams. Probes go through the
+        shared clients, which keeps a warm keep-alive connection in each pool, and are marked
+        as probes so the circuit breaker and the admission gate let them through. Any HTTP
+        answer below 500 counts as reachable.
+
+        Only the `required` upstreams decide readiness (when probed); the rest are reported for
+        information, so an outage of one upstream does not take every replica out of
+        rotation.
+    """
+
+    def __init__(self, interval: float, timeout: float, probe_paths: Dict[str, str], required: List[str]):
+        self.interval = interval
+        self.timeout = timeout
+        self.probe_paths = probe_paths
+        self.required = required
+        self.upstreams: Dict[str, UpstreamHealth] = {}
+        self.warm_start: Dict[str, dict] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, upstreams: List[str], wait: bool = False):
+        """
+            Starts the background probes of `upstreams`. With `wait`, the first round is
+            awaited, which also opens a connection to every upstream before the server takes
+            traffic.
+        """
+        if not upstreams:
+            return
+        # Import diferido: sin upstreams que sondear no se cargan los clientes HTTP.
+        from services.http_clients import UPSTREAMS
+        self.upstreams = {name: UpstreamHealth(name) for name in upstreams if UPSTREAMS[name]()}
+        if wait:
+            await self.probe_all()
+        self._task = asyncio.ensure_future(self._run(probe_first=not wait))
+
+    async def probe_all(self):
+        await asyncio.gather(*(self._probe(health) for health in self.upstreams.values()))
+
+    async def warm_up(self, step: str, warm_up, timeout: float):
+        """
+            Runs one warm-up coroutine (priming a cache, fetching a token) and records its
+            outcome. A failed or slow step is logged and skipped: warming up only spares the
+            first requests a cold start, it never keeps the server from starting.
+        """
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(warm_up(), timeout)
+            outcome = {"ok": True}
+        except Exception as e:
+            logger.warning("Warm-up step %s failed: %s", step, e)
+            outcome = {"ok": False, "error": str(e) or type(e).__name__}
+        outcome["seconds"] = round(time.perf_counter() - started, 4)
+        self.warm_start[step] = outcome
+
+    def status(self) -> dict:
+        max_age = 3 * self.interval
+        unready = [
+            name for name in self.required
+            if name in self.upstreams and (self.upstreams[name].stale(max_age) or not self.upstreams[name].reachable)
+        ]
+        return {
+            "ready": not unready,
+            "unready_upstreams": unready,
+            "upstreams": {name: health.to_dict() for name, health in self.upstreams.items()},
+            "warm_start": self.warm_start,
+        }
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self, probe_first: bool):
+        if not probe_first:
+            await asyncio.sleep(self.interval)
+        while True:
+            await self.probe_all()
+            await asyncio.sleep(self.interval)
+
+    async def _probe(self, health: UpstreamHealth):
+        from services.http_clients import get_client
+        started = time.perf_counter()
+        try:
+            response = await get_client(health.name).head(self.probe_paths.get(health.name, "/"), timeout=self.timeout, extensions={"probe": True})
+            health.status_code = response.status_code
+            health.reachable = response.status_code < 500
+            health.error = None if health.reachable else f"HTTP {response.status_code}"
+        except Exception as e:
+            health.status_code = None
+            health.reachable = False
+            health.error = str(e) or type(e).__name__
+        health.latency_ms = round((time.perf_counter() - started) * 1000, 1)
+        health.checked_at = time.time()
+        if health.reachable:
+            health.consecutive_failures = 0
+        else:
+            health.consecutive_failures += 1
+            logger.warning("Upstream %s unreachable: %s", health.name, health.error, extra={"sample": f"probe:{health.name}"})
+
+
+readiness = ReadinessMonitor(
+    interval=config.READY_PROBE_INTERVAL,
+    timeout=config.READY_PROBE_TIMEOUT,
+    probe_paths=parse_probe_paths(config.READY_PROBE_PATHS),
+    required=[name.strip() for name in config.READY_REQUIRED_UPSTREAMS.split(",") if name.strip()],
+)
@@ -0,0 +1,287 @@
+import asyncio
+import collections
+import logging
+import random
+import time
+from typing import Deque, Dict, Optional
+
+import httpx
+
+from config import config
+from services.admission import AdmissionGate, Busy, gate, parse_limits
+from services.metrics import CIRCUIT_OPENED, CIRCUIT_REJECTED, UPSTREAM_HEDGES, UPSTREAM_RETRIES
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENT_METHODS = ("GET", "HEAD")
+# 429 y los errores de gateway suelen ser transitorios; el resto de 4xx/5xx no se reintenta.
+RETRY_STATUSES = (429, 502, 503, 504)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class UpstreamUnavailable(httpx.TransportError):
+    """
+        Raised without contacting the upstream while its circuit breaker is open.
+    """
+
+
+class UpstreamBusy(UpstreamUnavailable, Busy):
+    """
+        Raised without contacting the upstream when its admission queue is full or timed out.
+    """
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    # El cupo de admisión se libera cuando se termina de leer (o se cierra) la respuesta.
+    def __init__(self, stream: httpx.AsyncByteStream, upstream_gate: AdmissionGate):
+        self._stream = stream
+        self._gate = upstream_gate
+        self._released = False
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        if not self._released:
+            self._released = True
+            self._gate.release()
+        await self._stream.aclose()
+
+
+class EndpointPolicy:
+    """
+        How idempotent reads of one endpoint are made: `timeout` bounds each attempt until
+        the response headers arrive (bodies keep the client read timeout), failed attempts
+        are retried up to `attempts` in total with jittered exponential backoff, and with
+        `hedge` a second request is sent when the first is slower than the endpoint's p95.
+    """
+
+    def __init__(self, timeout: float = None, attempts: int = None, hedge: bool = False):
+        self.timeout = timeout if timeout is not None else config.HTTP_GET_TIMEOUT
+        self.attempts = max(1, attempts if attempts is not None else config.HTTP_RETRY_ATTEMPTS)
+        self.hedge = hedge
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(config.HTTP_RETRY_MAX_BACKOFF, config.HTTP_RETRY_BACKOFF * 2 ** attempt))
+
+
+class LatencyWindow:
+    """
+        Time to response headers of the last `size` successful requests of an endpoint.
+    """
+
+    def __init__(self, size: int = 200):
+        self._samples: Deque[float] = collections.deque(maxlen=size)
+
+    def add(self, seconds: float):
+        self._samples.append(seconds)
+
+    def hedge_delay(self) -> float:
+        if len(self._samples) < config.HTTP_HEDGE_MIN_SAMPLES:
+            return config.HTTP_HEDGE_DEFAULT_DELAY
+        ordered = sorted(self._samples)
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * config.HTTP_HEDGE_PERCENTILE))]
+        return max(config.HTTP_HEDGE_MIN_DELAY, p95)
+
+
+class CircuitBreaker:
+    """
+        Opens after `failure_threshold` consecutive failures (connection errors, timeouts or
+        5xx) and then rejects requests at once for `reset_timeout` seconds. After that a
+        single probe request is let through: it closes the circuit if it succeeds and opens
+        it again if it fails.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    def allow(self) -> bool:
+        if self.state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self.state = HALF_OPEN
+            self._probing = False
+        if self.state == HALF_OPEN:
+            if self._probing:
+                return False
+            self._probing = True
+        return self.state != OPEN
+
+    def record_success(self):
+        self.state = CLOSED
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+            self.state = OPEN
+            self._opened_at = time.monotonic()
+            CIRCUIT_OPENED.labels(self.name).inc()
+            logger.warning("Circuit for %s opened after %d consecutive failures", self.name, self.failures)
+
+    def release(self):
+        # Un intento cancelado (p. ej. el perdedor de un hedge) no cuenta como resultado.
+        self._probing = False
+
+    def to_dict(self) -> dict:
+        return {"state": self.state, "consecutive_failures": self.failures}
+
+
+class ResilientTransport(httpx.AsyncBaseTransport):
+    """
+        httpx transport that applies an EndpointPolicy to idempotent reads and a circuit
+        breaker to every request of an upstream. Upstreams with a base URL share one breaker
+        and look policies up by path; absolute-URL upstreams get a breaker per host and use
+        their default policy (the `None` entry). Every attempt also takes a slot of the
+        upstream's admission gate (UPSTREAM_LIMITS) until its response is closed.
+
+        Requests sent with `extensions={"probe": True}` (the readiness checks) skip the
+        breaker, the gate and the retries: they report the upstream as it is, never trip the
+        breaker and never wait behind tool traffic.
+    """
+
+    def __init__(self, upstream: str, transport: httpx.AsyncBaseTransport, policies: Dict[Optional[str], EndpointPolicy], by_path: bool):
+        self.upstream = upstream
+        self.transport = transport
+        self.policies = policies
+        self.by_path = by_path
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.gate = gate(f"upstream:{upstream}", parse_limits(config.UPSTREAM_LIMITS).get(upstream))
+        self._windows: Dict[str, LatencyWindow] = {}
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if request.extensions.get("probe"):
+            return await self.transport.handle_async_request(request)
+        breaker = self._breaker(request)
+        endpoint = request.url.path if self.by_path else request.url.host
+        policy = None
+        if request.method in IDEMPOTENT_METHODS:
+            policy = self.policies.get(endpoint if self.by_path else None, self.policies.get(None))
+        if policy is None:
+            return await self._send(request, breaker)
+        window = self._windows.setdefault(endpoint, LatencyWindow())
+        attempt = 0
+        while True:
+            try:
+                if policy.hedge:
+                    response = await self._hedged(request, breaker, policy, window, endpoint)
+                else:
+                    response = await self._send(request, breaker, policy.timeout, window)
+            except UpstreamUnavailable:
+                raise
+            except httpx.TransportError as e:
+                if attempt + 1 >= policy.attempts:
+                    raise
+                reason = type(e).__name__
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt + 1 >= policy.attempts:
+                    return response
+                await response.aclose()
+                reason = str(response.status_code)
+            UPSTREAM_RETRIES.labels(self.upstream, endpoint, reason).inc()
+            await asyncio.sleep(policy.backoff(attempt))
+            attempt += 1
+
+    async def _send(self, request: httpx.Request, breaker: CircuitBreaker, timeout: Optional[float] = None,
+                    window: Optional[LatencyWindow] = None) -> httpx.Response:
+        if not breaker.allow():
+            CIRCUIT_REJECTED.labels(breaker.name).inc()
+            raise UpstreamUnavailable(f"{breaker.name} is unavailable (circuit open)", request=request)
+        if self.gate is not None:
+            try:
+                await self.gate.acquire()
+            except BaseException as e:
+                breaker.release()
+                if isinstance(e, Busy):
+                    raise UpstreamBusy(str(e), request=request)
+                raise
+        started = time.perf_counter()
+        try:
+            try:
+                response = await asyncio.wait_for(self.transport.handle_async_request(request), timeout)
+            except BaseException:
+                if self.gate is not None:
+                    self.gate.release()
+                raise
+        except asyncio.TimeoutError:
+            breaker.record_failure()
+            raise httpx.ReadTimeout(f"No response from {breaker.name} within {timeout} seconds", request=request)
+        except httpx.TransportError:
+            breaker.record_failure()
+            raise
+        except BaseException:
+            breaker.release()
+            raise
+        if self.gate is not None:
+            response.stream = _ReleasingStream(response.stream, self.gate)
+        if response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+            if window is not None:
+                window.add(time.perf_counter() - started)
+        return response
+
+    async def _hedged(self, request: httpx.Request, breaker: CircuitBreaker, policy: EndpointPolicy,
+                      window: LatencyWindow, endpoint: str) -> httpx.Response:
+        pending = {asyncio.ensure_future(self._send(request, breaker, policy.timeout, window))}
+        fallback = None
+        try:
+            done, pending = await asyncio.wait(pending, timeout=window.hedge_delay())
+            if not done:
+                UPSTREAM_HEDGES.labels(self.upstream, endpoint).inc()
+                pending.add(asyncio.ensure_future(self._send(request, breaker, policy.timeout, window)))
+            while True:
+                winner = None
+                for task in done:
+                    error = task.exception()
+                    result = error if error is not None else task.result()
+                    if winner is None and error is None and result.status_code not in RETRY_STATUSES:
+                        winner = result
+                    elif fallback is None:
+                        # Se guarda el primer fallo por si el otro intento también falla.
+                        fallback = result
+                    elif isinstance(result, httpx.Response):
+                        await result.aclose()
+                if winner is not None:
+                    if isinstance(fallback, httpx.Response):
+                        await fallback.aclose()
+                    return winner
+                if not pending:
+                    break
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        except BaseException:
+            if isinstance(fallback, httpx.Response):
+                await fallback.aclose()
+            raise
+        finally:
+            for task in pending:
+                task.cancel()
+            # Un intento pudo terminar antes de cancelarlo: su respuesta retiene una conexión
+            # y un lugar del admission gate hasta cerrarla.
+            for result in await asyncio.gather(*pending, return_exceptions=True):
+                if isinstance(result, httpx.Response):
+                    await result.aclose()
+        if isinstance(fallback, BaseException):
+            raise fallback
+        return fallback
+
+    def _breaker(self, request: httpx.Request) -> CircuitBreaker:
+        name = self.upstream if self.by_path else f"{self.upstream}:{request.url.host}"
+        breaker = self.breakers.get(name)
+        if breaker is None:
+            breaker = self.breakers[name] = CircuitBreaker(name, config.CIRCUIT_FAILURE_THRESHOLD, config.CIRCUIT_RESET_TIMEOUT)
+        return breaker
+
+    async def aclose(self):
+        await self.transport.aclose()
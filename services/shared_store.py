@@ -0,0 +1,132 @@
+import asyncio
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, List, Optional, Tuple
+
+from config import config
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueos entre procesos, cada worker se coordina solo consigo mismo.
+    fcntl = None
+
+
+class SharedEntry:
+    def __init__(self, value: Any, etag: Optional[str], stored_at: float, expires_at: float):
+        self.value = value
+        self.etag = etag
+        self.stored_at = stored_at
+        self.expires_at = expires_at
+
+
+class SharedStore:
+    """
+        Key/value store shared by every worker process of one host, kept in a SQLite file
+        (WAL mode, so readers never wait for writers). Values are JSON and expire on their
+        own. `lock(name)` is a cross-process mutex backed by flock, used where only one
+        worker should hit an upstream, such as the Chimbitas login. The database holds the
+        Chimbitas token, so it and its lock files are only readable by the process owner.
+
+        An empty path disables the store; callers then keep their per-process behaviour.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connection: Optional[sqlite3.Connection] = None
+        self._mutex = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    async def get(self, key: str) -> Optional[SharedEntry]:
+        row = await asyncio.to_thread(self._execute, "SELECT value, etag, stored_at, expires_at FROM kv WHERE key = ? AND expires_at > ?", (key, time.time()))
+        if not row:
+            return None
+        value, etag, stored_at, expires_at = row[0]
+        return SharedEntry(json.loads(value), etag, stored_at, expires_at)
+
+    async def set(self, key: str, value: Any, ttl: float, etag: Optional[str] = None, stored_at: Optional[float] = None):
+        stored_at = stored_at if stored_at is not None else time.time()
+        await asyncio.to_thread(
+            self._execute,
+            "INSERT OR REPLACE INTO kv (key, value, etag, stored_at, expires_at) VALUES (?, ?, ?, ?, ?)",
+            (key, json.dumps(value), etag, stored_at, stored_at + ttl),
+        )
+
+    async def delete(self, *keys: str):
+        if keys:
+            await asyncio.to_thread(self._execute, f"DELETE FROM kv WHERE key IN ({', '.join('?' for _ in keys)})", keys)
+
+    async def items(self, prefix: str) -> List[Tuple[str, Any]]:
+        """
+            Unexpired (key, value) pairs whose key starts with `prefix`.
+        """
+        rows = await asyncio.to_thread(
+            self._execute,
+            "SELECT key, value FROM kv WHERE key >= ? AND key < ? AND expires_at > ?",
+            (prefix, prefix + "￿", time.time()),
+        )
+        return [(key, json.loads(value)) for key, value in rows]
+
+    @contextlib.asynccontextmanager
+    async def lock(self, name: str, poll_interval: float = 0.05):
+        if fcntl is None:
+            yield
+            return
+        fd = os.open(f"{self.path}.{name}.lock", os.O_CREAT | os.O_RDWR, 0o600)
+        try:
+            # Sin bloquear el event loop: se reintenta hasta obtener el lock (y se puede cancelar).
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    await asyncio.sleep(poll_interval)
+            try:
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+    def close(self):
+        with self._mutex:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def _execute(self, sql: str, parameters=()) -> list:
+        with self._mutex:
+            if self._connection is None:
+                self._connection = self._connect()
+            rows = self._connection.execute(sql, parameters).fetchall()
+            if sql.startswith("INSERT"):
+                # Limpieza oportunista de entradas vencidas.
+                self._connection.execute("DELETE FROM kv WHERE expires_at <= ?", (time.time(),))
+            return rows
+
+    def _connect(self) -> sqlite3.Connection:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # SQLite crea los archivos -wal y -shm con los permisos de la base.
+        os.close(os.open(self.path, os.O_CREAT | os.O_RDWR, 0o600))
+        for path in (self.path, f"{self.path}-wal", f"{self.path}-shm"):
+            with contextlib.suppress(FileNotFoundError, PermissionError):
+                os.chmod(path, 0o600)
+        connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, etag TEXT, stored_at REAL NOT NULL, expires_at REAL NOT NULL)"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS kv_expires_at ON kv (expires_at)")
+        return connection
+
+
+shared_store = SharedStore(config.SHARED_STORE_PATH)
@@ -0,0 +1,190 @@
+import contextlib
+import tempfile
+import uuid
+from typing import AsyncIterator, Dict, List, Optional
+
+import httpx
+
+from config import config
+from services.blob_cache import blob_cache
+from services.http_clients import get_client
+
+
+class SourceStream:
+    """
+        Body of a downloaded document that is read in chunks. `size` is the exact number of
+        bytes the iterator will yield.
+    """
+
+    def __init__(self, chunks: AsyncIterator[bytes], size: int):
+        self.chunks = chunks
+        self.size = size
+
+
+class StreamedFile:
+    def __init__(self, field: str, filename: Optional[str], content_type: str, source: SourceStream):
+        self.field = field
+        self.filename = filename
+        self.content_type = content_type
+        self.source = source
+        self.bytes_sent = 0
+
+
+@contextlib.asynccontextmanager
+async def open_source(url: str):
+    """
+        Opens `url` for streaming. The body is never held in memory as a whole: when the
+        upstream announces its length the chunks are piped through as they arrive, otherwise
+        they are spooled to a temporary file first so the length is known before uploading.
+
+        Downloads that carry an ETag or Last-Modified are kept in the blob cache; the next
+        time the same URL is requested it is revalidated with a conditional GET and a 304
+        is served from disk without downloading the body again.
+    """
+    headers = {"Accept-Encoding": "identity"}
+    cached = blob_cache.lookup(url)
+    if cached is not None:
+        async with get_client("external").stream("GET", url, headers={**headers, **cached.conditional_headers()}) as response:
+            if response.status_code != 304:
+                async with _downloaded(url, response) as source:
+                    yield source
+                return
+            file = blob_cache.open(cached)
+            if file is not None:
+                with file:
+                    yield SourceStream(_file_chunks(file), cached.size)
+                return
+        # El blob ya no está en disco: se olvida la URL y se descarga completa.
+        blob_cache.forget(url)
+    async with get_client("external").stream("GET", url, headers=headers) as response:
+        async with _downloaded(url, response) as source:
+            yield source
+
+
+@contextlib.asynccontextmanager
+async def _downloaded(url: str, response: httpx.Response):
+    """
+        Streams (or spools) the body of a non-304 response, keeping it in the blob cache.
+    """
+    response.raise_for_status()
+    length = response.headers.get("Content-Length")
+    if length is not None and "Content-Encoding" not in response.headers:
+        writer = blob_cache.writer(url, response.headers, int(length))
+        chunks = response.aiter_bytes(config.TRANSFER_CHUNK_SIZE)
+        if writer is None:
+            yield SourceStream(chunks, int(length))
+            return
+        try:
+            yield SourceStream(writer.tee(chunks), int(length))
+        except BaseException:
+            writer.discard()
+            raise
+        writer.commit()
+        return
+    writer = blob_cache.writer(url, response.headers, None)
+    with tempfile.TemporaryFile() as spool:
+        async for chunk in response.aiter_bytes(config.TRANSFER_CHUNK_SIZE):
+            spool.write(chunk)
+            if writer is not None:
+                writer.write(chunk)
+        if writer is not None:
+            writer.commit()
+        size = spool.tell()
+        spool.seek(0)
+        yield SourceStream(_file_chunks(spool), size)
+
+
+@contextlib.asynccontextmanager
+async def spooled_source(url: str):
+    """
+        Downloads `url` completely into a temporary file and yields it as a SourceStream.
+        For uploads that carry several documents in one request: the downloads can run
+        concurrently and no connection is held open while earlier parts are being sent.
+    """
+    with tempfile.TemporaryFile() as spool:
+        async with open_source(url) as source:
+            async for chunk in source.chunks:
+                spool.write(chunk)
+        size = spool.tell()
+        spool.seek(0)
+        yield SourceStream(_file_chunks(spool), size)
+
+
+async def _file_chunks(file) -> AsyncIterator[bytes]:
+    while True:
+        chunk = file.read(config.TRANSFER_CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _quote(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', "%22").replace("\r", "%0D").replace("\n", "%0A")
+
+
+class StreamingMultipart:
+    """
+        multipart/form-data body whose file parts are streamed from their sources. The
+        Content-Length is computed up front, which the S3 presigned POST requires, and
+        `bytes_sent` counts what was actually written to the wire.
+    """
+
+    def __init__(self, fields: Dict[str, str], files: List[StreamedFile]):
+        self.boundary = uuid.uuid4().hex
+        self.fields = fields
+        self.files = files
+        self.bytes_sent = 0
+
+    @property
+    def content_type(self) -> str:
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def _field_part(self, name: str, value) -> bytes:
+        return (
+            f'--{self.boundary}\r\nContent-Disposition: form-data; name="{_quote(name)}"\r\n\r\n'
+            f"{value}\r\n"
+        ).encode("utf-8")
+
+    def _file_header(self, file: StreamedFile) -> bytes:
+        disposition = f'form-data; name="{_quote(file.field)}"'
+        if file.filename is not None:
+            disposition += f'; filename="{_quote(file.filename)}"'
+        return (
+            f"--{self.boundary}\r\nContent-Disposition: {disposition}\r\n"
+            f"Content-Type: {file.content_type}\r\n\r\n"
+        ).encode("utf-8")
+
+    def _closing(self) -> bytes:
+        return f"--{self.boundary}--\r\n".encode("utf-8")
+
+    @property
+    def content_length(self) -> int:
+        length = sum(len(self._field_part(name, value)) for name, value in self.fields.items())
+        for file in self.files:
+            length += len(self._file_header(file)) + file.source.size + 2
+        return length + len(self._closing())
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        for name, value in self.fields.items():
+            yield self._count(self._field_part(name, value))
+        for file in self.files:
+            yield self._count(self._file_header(file))
+            async for chunk in file.source.chunks:
+                file.bytes_sent += len(chunk)
+                yield self._count(chunk)
+            yield self._count(b"\r\n")
+        yield self._count(self._closing())
+
+    def _count(self, chunk: bytes) -> bytes:
+        self.bytes_sent += len(chunk)
+        return chunk
+
+
+async def post_multipart_stream(client: httpx.AsyncClient, url: str, fields: Dict[str, str], files: List[StreamedFile]):
+    """
+        POSTs a streamed multipart body and returns (response, bytes_sent).
+    """
+    body = StreamingMultipart(fields, files)
+    headers = {"Content-Type": body.content_type, "Content-Length": str(body.content_length)}
+    response = await client.post(url, content=body, headers=headers)
+    return response, body.bytes_sent
@@ -0,0 +1,338 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import random
+import time
+from typing import Dict, List, Optional, Tuple
+
+from config import config
+from services.chimbitas_auth import token_manager
+from services.http_clients import get_client
+from services.shared_store import SharedStore, shared_store
+from services.tracing import current_span
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ("completed", "failed")
+
+TaskKey = Tuple[int, int]
+
+
+class PollingTimeout(Exception):
+    pass
+
+
+class PollingError(Exception):
+    pass
+
+
+class _Watch:
+    def __init__(self, key: TaskKey, interval: float):
+        self.key = key
+        self.interval = interval
+        self.errors = 0
+        self.checks = 0
+        self.total_errors = 0
+        # Inicio más reciente del task entre quienes esperan; eventos anteriores son de otra ejecución.
+        self.since: Optional[float] = None
+        self.waiters: List[asyncio.Future] = []
+
+
+class TaskStatusPoller:
+    """
+        Watches many (session_id, analysis_type_id) pairs from a single scheduling loop.
+        Each pair is checked on its own exponential backoff with jitter; callers waiting on
+        the same pair share one watch, and due checks are dispatched together with a bound
+        on how many /task/status requests are in flight at once.
+
+        With `fallback_interval` set, completion is expected to be pushed through `notify()`
+        (the callback endpoint) and polling only runs every `fallback_interval` as a safety
+        net. Events that arrive before anyone waits are kept for `event_ttl` seconds (at most
+        `max_events` of them, oldest dropped first), and with an enabled shared store they are
+        relayed to the waiters of every worker process. An event is consumed by the wait it
+        resolves, and a wait ignores events received before its `since`.
+    """
+
+    def __init__(self, initial_interval: float, max_interval: float, backoff_factor: float,
+                 jitter: float, deadline: float, max_errors: int, max_concurrency: int,
+                 fallback_interval: Optional[float] = None, store: Optional[SharedStore] = None,
+                 event_ttl: float = 600, relay_interval: float = 1, max_events: int = 10000):
+        self.initial_interval = fallback_interval if fallback_interval is not None else initial_interval
+        self.max_interval = max(max_interval, fallback_interval or 0)
+        self.fallback_interval = fallback_interval
+        self.store = store if store is not None and store.enabled else None
+        self.event_ttl = event_ttl
+        self.max_events = max(1, max_events)
+        self.relay_interval = relay_interval
+        self.backoff_factor = backoff_factor
+        self.jitter = jitter
+        self.deadline = deadline
+        self.max_errors = max_errors
+        self.max_concurrency = max_concurrency
+        self._watches: Dict[TaskKey, _Watch] = {}
+        self._schedule: List[Tuple[float, int, _Watch]] = []
+        self._counter = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop_task: Optional[asyncio.Task] = None
+        self._relay_task: Optional[asyncio.Task] = None
+        self._checks: set = set()
+        self._events: Dict[TaskKey, Tuple[float, float, Tuple[str, dict]]] = {}
+
+    async def wait_for(self, session_id, analysis_type_id, deadline: Optional[float] = None,
+                       since: Optional[float] = None) -> Tuple[str, dict]:
+        """
+            Waits until the task reaches a terminal status and returns (status, payload).
+            Raises PollingTimeout when the deadline passes and PollingError when the status
+            endpoint keeps failing. `since` is when the task was started (time.time()): pushed
+            events received earlier belong to a previous run on the same session and are ignored.
+        """
+        self._ensure_running()
+        key = (int(session_id), int(analysis_type_id))
+        event = self._pop_event(key, since)
+        if event is not None:
+            return event
+        watch = self._watches.get(key)
+        if watch is None:
+            watch = self._watches[key] = _Watch(key, self.initial_interval)
+            # Con callbacks la primera consulta es ya el respaldo; sin ellos se consulta de inmediato.
+            self._push(watch, self.initial_interval if self.fallback_interval is not None else 0.0)
+        if since is not None:
+            watch.since = max(watch.since or since, since)
+        waiter = asyncio.get_running_loop().create_future()
+        watch.waiters.append(waiter)
+        try:
+            return await asyncio.wait_for(waiter, timeout=deadline if deadline is not None else self.deadline)
+        except asyncio.TimeoutError:
+            raise PollingTimeout(f"Polling timed out for session {key[0]}")
+        finally:
+            self._discard_waiter(key, waiter)
+            span = current_span()
+            if span is not None:
+                span.set(status_checks=watch.checks, status_errors=watch.total_errors)
+
+    async def notify(self, session_id, analysis_type_id, status: str, payload: dict) -> bool:
+        """
+            Delivers a pushed status event. A terminal status wakes the callers waiting on the
+            task at once; returns whether any waiter in this process was woken.
+        """
+        if status not in TERMINAL_STATUSES:
+            return False
+        key = (int(session_id), int(analysis_type_id))
+        result = (status, payload)
+        watch = self._watches.get(key)
+        if watch is not None:
+            self._resolve(watch, result=result)
+            return True
+        # Nadie espera aquí: se guarda para quien espere después, en este u otro worker.
+        received_at = time.time()
+        if self.store is not None:
+            await self.store.set(self._event_key(key), [status, payload, received_at], self.event_ttl)
+        self._remember_event(key, result, received_at)
+        return False
+
+    @property
+    def active_watches(self) -> int:
+        return len(self._watches)
+
+    async def close(self):
+        if self._relay_task is not None:
+            self._relay_task.cancel()
+            self._relay_task = None
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+        for task in self._checks:
+            task.cancel()
+        self._loop_task = None
+        self._checks.clear()
+        for watch in self._watches.values():
+            for waiter in watch.waiters:
+                if not waiter.done():
+                    waiter.cancel()
+        self._watches.clear()
+        self._schedule.clear()
+
+    def _ensure_running(self):
+        if self._loop_task is None or self._loop_task.done():
+            self._wakeup = asyncio.Event()
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            # Contexto vacío: el bucle es compartido y no pertenece a la traza de quien lo arrancó.
+            self._loop_task = asyncio.get_running_loop().create_task(self._run(), context=contextvars.Context())
+        if self.fallback_interval is not None and self.store is not None and (self._relay_task is None or self._relay_task.done()):
+            self._relay_task = asyncio.get_running_loop().create_task(self._relay(), context=contextvars.Context())
+
+    def _remember_event(self, key: TaskKey, result: Tuple[str, dict], received_at: float):
+        now = time.monotonic()
+        for stale in [stale for stale, (expires_at, _, _) in self._events.items() if expires_at <= now]:
+            del self._events[stale]
+        self._events.pop(key, None)
+        while len(self._events) >= self.max_events:
+            del self._events[next(iter(self._events))]
+        self._events[key] = (now + self.event_ttl, received_at, result)
+
+    def _pop_event(self, key: TaskKey, since: Optional[float]) -> Optional[Tuple[str, dict]]:
+        event = self._events.pop(key, None)
+        if event is None or event[0] <= time.monotonic() or not self._current(event[1], since):
+            return None
+        # Consumido: el evento compartido tampoco debe responder a una espera posterior.
+        if self.store is not None:
+            self._forget_shared(key)
+        return event[2]
+
+    @staticmethod
+    def _current(received_at: float, since: Optional[float]) -> bool:
+        return since is None or received_at >= since
+
+    @staticmethod
+    def _decode(value: list) -> Tuple[str, dict, float]:
+        # Los eventos sin hora de recepción (versiones anteriores) se tratan como antiguos.
+        status, payload, *rest = value
+        return status, payload, rest[0] if rest else 0.0
+
+    @staticmethod
+    def _event_key(key: TaskKey) -> str:
+        return f"task_event:{key[0]}:{key[1]}"
+
+    def _forget_shared(self, *keys: TaskKey):
+        task = asyncio.ensure_future(self.store.delete(*[self._event_key(key) for key in keys]))
+        self._checks.add(task)
+        task.add_done_callback(self._checks.discard)
+
+    async def _relay(self):
+        # Eventos recibidos por otro worker: se revisan en el store mientras haya tasks en espera.
+        while True:
+            await asyncio.sleep(self.relay_interval)
+            if not self._watches:
+                continue
+            try:
+                events = await self.store.items("task_event:")
+            except Exception as e:
+                logger.warning("Error reading task events: %s", e, extra={"sample": "task_event_relay_error"})
+                continue
+            consumed = []
+            for name, value in events:
+                status, payload, received_at = self._decode(value)
+                _, session_id, analysis_type_id = name.split(":")
+                watch = self._watches.get((int(session_id), int(analysis_type_id)))
+                if watch is not None and self._current(received_at, watch.since):
+                    consumed.append(watch.key)
+                    self._resolve(watch, result=(status, payload))
+            if consumed:
+                self._forget_shared(*consumed)
+
+    def _push(self, watch: _Watch, delay: float):
+        heapq.heappush(self._schedule, (time.monotonic() + delay, next(self._counter), watch))
+        self._wakeup.set()
+
+    def _discard_waiter(self, key: TaskKey, waiter: asyncio.Future):
+        watch = self._watches.get(key)
+        if watch is None:
+            return
+        if waiter in watch.waiters:
+            watch.waiters.remove(waiter)
+        if not watch.waiters:
+            # Nadie espera este task: deja de consultarlo. La entrada vieja del heap se ignora.
+            del self._watches[key]
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            if not self._schedule:
+                await self._wakeup.wait()
+                continue
+            due_at = self._schedule[0][0]
+            delay = due_at - time.monotonic()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            now = time.monotonic()
+            while self._schedule and self._schedule[0][0] <= now:
+                _, _, watch = heapq.heappop(self._schedule)
+                if self._watches.get(watch.key) is not watch:
+                    continue
+                task = asyncio.ensure_future(self._check(watch))
+                self._checks.add(task)
+                task.add_done_callback(self._checks.discard)
+
+    async def _check(self, watch: _Watch):
+        async with self._semaphore:
+            try:
+                if self.fallback_interval is not None and self.store is not None:
+                    shared = await self.store.get(self._event_key(watch.key))
+                    if shared is not None:
+                        status, payload, received_at = self._decode(shared.value)
+                        current = self._current(received_at, watch.since)
+                        # Un evento anterior al inicio del task es de otra ejecución: se descarta.
+                        if not current or self._watches.get(watch.key) is watch:
+                            await self.store.delete(self._event_key(watch.key))
+                        if current:
+                            if self._watches.get(watch.key) is watch:
+                                self._resolve(watch, result=(status, payload))
+                            return
+                payload = await self._fetch_status(watch.key)
+            except Exception as e:
+                logger.warning("Error polling status of task %s: %s", watch.key, e, extra={"sample": "poll_error"})
+                payload = None
+        if self._watches.get(watch.key) is not watch:
+            return
+        watch.checks += 1
+        if payload is None:
+            watch.errors += 1
+            watch.total_errors += 1
+            if watch.errors >= self.max_errors:
+                self._resolve(watch, error=PollingError("Error fetching task status. Please try again."))
+                return
+        else:
+            watch.errors = 0
+            status = payload.get("status")
+            logger.info("Task %s status: %s", watch.key, status, extra={"sample": "poll_status"})
+            if status in TERMINAL_STATUSES:
+                self._resolve(watch, result=(status, payload))
+                return
+        self._push(watch, self._next_interval(watch))
+
+    async def _fetch_status(self, key: TaskKey) -> dict:
+        token = await token_manager.get_token()
+        response = await get_client("api_chimbitas").get(
+            "/task/status",
+            params={"session_id": key[0], "analysis_type_id": key[1]},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def _next_interval(self, watch: _Watch) -> float:
+        interval = watch.interval
+        watch.interval = min(watch.interval * self.backoff_factor, self.max_interval)
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _resolve(self, watch: _Watch, result=None, error: Exception = None):
+        self._watches.pop(watch.key, None)
+        for waiter in watch.waiters:
+            if waiter.done():
+                continue
+            if error is not None:
+                waiter.set_exception(error)
+            else:
+                waiter.set_result(result)
+
+
+task_poller = TaskStatusPoller(
+    initial_interval=config.POLL_INITIAL_INTERVAL,
+    max_interval=config.POLL_MAX_INTERVAL,
+    backoff_factor=config.POLL_BACKOFF_FACTOR,
+    jitter=config.POLL_JITTER,
+    deadline=config.POLL_DEADLINE,
+    max_errors=config.POLL_MAX_ERRORS,
+    max_concurrency=config.POLL_MAX_CONCURRENCY,
+    fallback_interval=config.POLL_FALLBACK_INTERVAL if config.TASK_CALLBACK_URL else None,
+    store=shared_store,
+    event_ttl=config.TASK_EVENT_TTL,
+    max_events=config.TASK_EVENT_MAX_ENTRIES,
+    relay_interval=config.TASK_EVENT_RELAY_INTERVAL,
+)
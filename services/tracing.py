@@ -0,0 +1,246 @@
+import asyncio
+import contextlib
+import contextvars
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+OK = "ok"
+ERROR = "error"
+UNSET = "unset"
+
+# Código de estado OTLP: 0 unset, 1 ok, 2 error.
+_OTLP_STATUS = {UNSET: 0, OK: 1, ERROR: 2}
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+
+def _otlp_value(value: Any) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class Span:
+    def __init__(self, trace: Optional["Trace"], name: str, parent: Optional["Span"], attributes: Dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attributes = dict(attributes)
+        self.status = UNSET
+        self.status_message: Optional[str] = None
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+
+    @property
+    def duration_ms(self) -> Optional[float]:
+        if self.end_ns is None:
+            return None
+        return round((self.end_ns - self.start_ns) / 1e6, 3)
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def fail(self, message: str):
+        self.status = ERROR
+        self.status_message = message
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            if self.status == UNSET:
+                self.status = OK
+
+    def to_dict(self) -> dict:
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": self.duration_ms,
+            "status": self.status,
+            "status_message": self.status_message,
+            "attributes": self.attributes,
+        }
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or time.time_ns()),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in self.attributes.items()],
+            "status": {"code": _OTLP_STATUS[self.status]},
+        }
+        if self.parent_id is not None:
+            span["parentSpanId"] = self.parent_id
+        if self.status_message:
+            span["status"]["message"] = self.status_message
+        return span
+
+
+class Trace:
+    def __init__(self, trace_id: str, name: str, max_spans: int):
+        self.trace_id = trace_id
+        self.name = name
+        self.max_spans = max_spans
+        self.spans: List[Span] = []
+        self.dropped_spans = 0
+        self.finished = False
+
+    @property
+    def root(self) -> Optional[Span]:
+        return self.spans[0] if self.spans else None
+
+    def add(self, span: Span) -> bool:
+        if len(self.spans) >= self.max_spans:
+            self.dropped_spans += 1
+            return False
+        self.spans.append(span)
+        return True
+
+    def summary(self) -> dict:
+        root = self.root
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "finished": self.finished,
+            "status": root.status if root else UNSET,
+            "duration_ms": root.duration_ms if root else None,
+            "spans": len(self.spans),
+            "dropped_spans": self.dropped_spans,
+        }
+
+    def to_dict(self) -> dict:
+        return {**self.summary(), "span_list": [span.to_dict() for span in self.spans]}
+
+    def to_otlp(self) -> dict:
+        """
+            The trace as an OTLP/JSON ExportTraceServiceRequest body.
+        """
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": config.TRACE_SERVICE_NAME}}]},
+                "scopeSpans": [{
+                    "scope": {"name": "mcp_servers"},
+                    "spans": [span.to_otlp() for span in self.spans],
+                }],
+            }]
+        }
+
+
+class Tracer:
+    """
+        Keeps the last `max_retained` traces in memory. A trace is a tree of timed spans:
+        the root opened by `trace()` and every `span()` opened while it is the current
+        context, including spans from tasks started inside it.
+    """
+
+    def __init__(self, max_retained: int, max_spans: int, otlp_endpoint: Optional[str] = None):
+        self.max_retained = max_retained
+        self.max_spans = max_spans
+        self.otlp_endpoint = otlp_endpoint
+        self._traces: "OrderedDict[str, Trace]" = OrderedDict()
+        self._exports: set = set()
+
+    @contextlib.contextmanager
+    def trace(self, name: str, trace_id: Optional[str] = None, **attributes):
+        trace = Trace(trace_id or os.urandom(16).hex(), name, self.max_spans)
+        self._traces[trace.trace_id] = trace
+        while len(self._traces) > self.max_retained:
+            self._traces.popitem(last=False)
+        root = Span(trace, name, None, attributes)
+        trace.add(root)
+        token = _current_span.set(root)
+        try:
+            yield root
+        except BaseException as e:
+            root.fail(_describe(e))
+            raise
+        finally:
+            _current_span.reset(token)
+            root.end()
+            trace.finished = True
+            self._export(trace)
+
+    def get(self, trace_id: str) -> Optional[Trace]:
+        return self._traces.get(trace_id)
+
+    def list(self) -> List[Trace]:
+        return list(self._traces.values())
+
+    async def close(self):
+        tasks = list(self._exports)
+        if tasks:
+            await asyncio.wait(tasks, timeout=5)
+
+    def _export(self, trace: Trace):
+        if not self.otlp_endpoint:
+            return
+        try:
+            task = asyncio.get_running_loop().create_task(self._post(trace), context=contextvars.Context())
+        except RuntimeError:
+            return
+        self._exports.add(task)
+        task.add_done_callback(self._exports.discard)
+
+    async def _post(self, trace: Trace):
+        # Import diferido: http_clients instrumenta sus transportes con este módulo.
+        from services.http_clients import get_client
+        try:
+            response = await get_client("external").post(self.otlp_endpoint, json=trace.to_otlp())
+            response.raise_for_status()
+        except Exception as e:
+            logger.warning("Error exporting trace %s: %s", trace.trace_id, e)
+
+
+def _describe(error: BaseException) -> str:
+    if isinstance(error, asyncio.CancelledError):
+        return "cancelled"
+    return f"{type(error).__name__}: {error}"
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes):
+    """
+        Times a block as a child of the current span. Outside of a trace (or once its trace
+        has finished) the span is still yielded so callers can set attributes, but it is
+        not recorded anywhere.
+    """
+    parent = _current_span.get()
+    trace = parent.trace if parent is not None and not parent.trace.finished else None
+    current = Span(trace, name, parent if trace is not None else None, attributes)
+    if trace is None or not trace.add(current):
+        yield current
+        current.end()
+        return
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.fail(_describe(e))
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end()
+
+
+tracer = Tracer(config.TRACE_MAX_RETAINED, config.TRACE_MAX_SPANS, config.OTLP_TRACES_ENDPOINT)
@@ -0,0 +1,50 @@
+import asyncio
+from typing import Any, Awaitable, Callable, List, Sequence
+
+
+class TransferError(Exception):
+    """
+        Raised by a stage handler when an item cannot continue through the pipeline.
+    """
+
+    def __init__(self, message: str, item: Any = None):
+        super().__init__(message)
+        self.item = item
+
+
+class PipelineStage:
+    """
+        One step of the pipeline. `handler(item, previous_result)` returns the value passed
+        on to the next stage; at most `concurrency` items run this stage at the same time.
+    """
+
+    def __init__(self, name: str, handler: Callable[[Any, Any], Awaitable[Any]], concurrency: int):
+        self.name = name
+        self.handler = handler
+        self.concurrency = max(1, concurrency)
+
+
+async def run_pipeline(items: Sequence[Any], stages: List[PipelineStage]) -> List[Any]:
+    """
+        Pushes every item through the stages concurrently, so one item can be uploading while
+        another is still downloading. Results are returned in the same order as `items`.
+        The first failure cancels all in-flight work and is re-raised.
+    """
+    semaphores = [asyncio.Semaphore(stage.concurrency) for stage in stages]
+    results: List[Any] = [None] * len(items)
+
+    async def run_item(index: int, item: Any):
+        value = None
+        for stage, semaphore in zip(stages, semaphores):
+            async with semaphore:
+                value = await stage.handler(item, value)
+        results[index] = value
+
+    try:
+        async with asyncio.TaskGroup() as group:
+            for index, item in enumerate(items):
+                group.create_task(run_item(index, item))
+    except* Exception as failures:
+        # TaskGroup ya canceló el resto de transferencias; se propaga el primer error real.
+        raise failures.exceptions[0]
+    return results
@@ -0,0 +1,77 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from config import config
+from services.shared_store import SharedStore, shared_store
+
+logger = logging.getLogger(__name__)
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+STARTED_AT = time.time()
+
+_load_providers: Dict[str, Callable[[], Any]] = {}
+
+
+def register_load(name: str, provider: Callable[[], Any]):
+    """
+        Adds a figure to this worker's load report, e.g. the number of running jobs.
+    """
+    _load_providers[name] = provider
+
+
+def local_status() -> dict:
+    return {
+        "worker_id": WORKER_ID,
+        "pid": os.getpid(),
+        "uptime_seconds": round(time.time() - STARTED_AT, 1),
+        "cpu_seconds": round(time.process_time(), 2),
+        "load": {name: provider() for name, provider in _load_providers.items()},
+        "reported_at": time.time(),
+    }
+
+
+class WorkerHeartbeat:
+    """
+        Publishes this worker's status to the shared store every `interval` seconds, so any
+        worker can report the load of all of them.
+    """
+
+    def __init__(self, store: SharedStore, interval: float):
+        self.store = store
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self.store.enabled and self._task is None:
+            await self._publish()
+            self._task = asyncio.ensure_future(self._run())
+
+    async def workers(self) -> List[dict]:
+        if not self.store.enabled:
+            return [local_status()]
+        await self._publish()
+        return [status for _, status in await self.store.items("worker:")]
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+            await self.store.delete(f"worker:{WORKER_ID}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self._publish()
+            except Exception as e:
+                logger.warning("Error publishing worker status: %s", e)
+
+    async def _publish(self):
+        await self.store.set(f"worker:{WORKER_ID}", local_status(), ttl=3 * self.interval)
+
+
+worker_heartbeat = WorkerHeartbeat(shared_store, config.WORKER_HEARTBEAT_INTERVAL)